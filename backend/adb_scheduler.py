@@ -0,0 +1,550 @@
+"""Central scheduler bounding concurrent adb child processes per device and server-wide."""
+import asyncio
+import asyncio.subprocess as aio_subprocess
+import itertools
+import os
+import signal
+import subprocess
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, Callable, Deque, Dict, List, Optional, Sequence, Tuple
+
+from adb_shards import adb_shards
+from agent_hub import AGENT_ERROR_FAILED, AgentCommandError, agent_hub
+from circuit_breaker import DeviceCircuitBreakers, device_breakers
+from metrics import metrics_registry
+from profiling import record_span
+
+ADB_PRIORITY_INTERACTIVE = 0
+ADB_PRIORITY_USER = 1
+ADB_PRIORITY_BACKGROUND = 2
+ADB_PRIORITY_NAMES = {
+    ADB_PRIORITY_INTERACTIVE: "interactive",
+    ADB_PRIORITY_USER: "user",
+    ADB_PRIORITY_BACKGROUND: "background",
+}
+
+ADB_MAX_CONCURRENT = int(os.environ.get("ADB_MAX_CONCURRENT", "16"))
+ADB_MAX_PER_DEVICE = int(os.environ.get("ADB_MAX_PER_DEVICE", "2"))
+# A waiter is promoted one priority level for every this many seconds it has queued,
+# so a busy terminal cannot starve the background scan indefinitely.
+ADB_PRIORITY_AGING_SECONDS = 10.0
+ADB_WAIT_SAMPLES = 256
+
+# Deadline per adb subcommand; override with e.g. ADB_TIMEOUT_INSTALL=600
+ADB_DEFAULT_TIMEOUT_SECONDS = 30.0
+ADB_OPERATION_TIMEOUTS: Dict[str, float] = {
+    "devices": 10.0,
+    "shell": 20.0,
+    "reboot": 15.0,
+    "logcat": 60.0,
+    "install": 300.0,
+    "push": 300.0,
+    "pull": 300.0,
+}
+for _operation in list(ADB_OPERATION_TIMEOUTS):
+    _override = os.environ.get(f"ADB_TIMEOUT_{_operation.upper()}")
+    if _override:
+        ADB_OPERATION_TIMEOUTS[_operation] = float(_override)
+
+# stderr fragments adb prints when the transport failed rather than the command
+ADB_TRANSPORT_ERRORS = (
+    "error: device",
+    "device offline",
+    "no devices/emulators found",
+    "protocol fault",
+    "error: closed",
+)
+
+# Metric labels: adb subcommands reported by name, anything else as "other"
+ADB_METRIC_OPERATIONS = frozenset(ADB_OPERATION_TIMEOUTS) | {
+    "install-multiple", "uninstall", "get-state", "root", "remount", "forward", "reverse",
+    "connect", "disconnect", "start-server", "kill-server", "version", "bugreport",
+}
+# Shell commands of the scanner and probes reported by name; other shell commands (terminal) as "shell"
+ADB_METRIC_SHELL_COMMANDS = frozenset({"bluetoothctl", "cat", "mount", "ql-getversion", "df"})
+
+ADB_COMMAND_SECONDS = metrics_registry.histogram(
+    "adb_command_duration_seconds", "Run time of adb commands after they were granted a slot", ["operation"]
+)
+ADB_COMMAND_FAILURES = metrics_registry.counter(
+    "adb_command_failures_total",
+    "adb commands that timed out, hit a transport error, exited non-zero or were refused by an open breaker",
+    ["operation", "reason"],
+)
+ADB_SLOT_WAIT_SECONDS = metrics_registry.histogram(
+    "adb_slot_wait_seconds", "Time adb commands queued for a scheduler slot", ["priority"]
+)
+
+SYSTEM_USER = "system"
+
+
+class DeviceUnavailableError(subprocess.SubprocessError):
+    """Raised instead of running a command while the device's circuit breaker is open."""
+
+    def __init__(self, device_id: str, retry_in: float) -> None:
+        super().__init__(f"Device {device_id} is not responding; retrying in {retry_in:.0f}s")
+        self.device_id = device_id
+        self.retry_in = retry_in
+
+
+def adb_target(command_tokens: Sequence[str]) -> Optional[str]:
+    """Return the serial an adb command addresses (`-s SERIAL`), or None for host commands."""
+    for index, token in enumerate(command_tokens[:-1]):
+        if token == "-s":
+            return command_tokens[index + 1]
+    return None
+
+
+def _operation_index(command_tokens: Sequence[str]) -> int:
+    index = 1
+    while index < len(command_tokens):
+        token = command_tokens[index]
+        if token in ("-s", "-P", "-H", "-L", "-t"):
+            index += 2
+        elif token.startswith("-"):
+            index += 1
+        else:
+            return index
+    return len(command_tokens)
+
+
+def adb_operation(command_tokens: Sequence[str]) -> str:
+    """Return the adb subcommand (`shell`, `install`, ...) skipping global options."""
+    index = _operation_index(command_tokens)
+    return command_tokens[index] if index < len(command_tokens) else ""
+
+
+def adb_metric_operation(command_tokens: Sequence[str]) -> str:
+    """Bounded metric label for an adb command, e.g. `install`, `bluetoothctl info`, `df`."""
+    index = _operation_index(command_tokens)
+    operation = command_tokens[index] if index < len(command_tokens) else ""
+    if operation != "shell":
+        return operation if operation in ADB_METRIC_OPERATIONS else "other"
+    script = " ".join(command_tokens[index + 1:])
+    words = script.replace(";", " ").split()
+    if not words:
+        return "shell"
+    if words[0] == "bluetoothctl" and len(words) > 1:
+        return f"bluetoothctl {words[1]}"
+    if words[0] == "echo" and "df -k" in script:
+        return "df"
+    return words[0] if words[0] in ADB_METRIC_SHELL_COMMANDS else "shell"
+
+
+def agent_file_arguments(command_tokens: Sequence[str]) -> Tuple[List[int], List[int]]:
+    """Indexes of local files an adb command reads (push/install sources) and writes (pull target).
+
+    Commands routed to an agent carry those files over the agent connection.
+    """
+    index = 1
+    while index < len(command_tokens) and command_tokens[index].startswith("-"):
+        index += 2 if command_tokens[index] in ("-s", "-P", "-H", "-L", "-t") else 1
+    operation = command_tokens[index] if index < len(command_tokens) else ""
+    arguments = [i for i in range(index + 1, len(command_tokens)) if not command_tokens[i].startswith("-")]
+    if not arguments:
+        return [], []
+    if operation == "push":
+        return arguments[:-1], []
+    if operation in ("install", "install-multiple"):
+        return arguments if operation == "install-multiple" else arguments[-1:], []
+    if operation == "pull" and len(arguments) > 1:
+        return [], arguments[-1:]
+    return [], []
+
+
+def _observe_command(operation: str, started: float) -> None:
+    elapsed = time.perf_counter() - started
+    ADB_COMMAND_SECONDS.observe(elapsed, operation)
+    record_span("subprocess", elapsed)
+
+
+def adb_timeout(command_tokens: Sequence[str]) -> float:
+    return ADB_OPERATION_TIMEOUTS.get(adb_operation(command_tokens), ADB_DEFAULT_TIMEOUT_SECONDS)
+
+
+def _is_transport_error(returncode: int, stderr: Any) -> bool:
+    if returncode == 0 or not stderr:
+        return False
+    if isinstance(stderr, bytes):
+        stderr = stderr.decode("utf-8", errors="replace")
+    lowered = stderr.lower()
+    return any(fragment in lowered for fragment in ADB_TRANSPORT_ERRORS)
+
+
+def _agent_error(device_id: str, exc: AgentCommandError) -> subprocess.SubprocessError:
+    """Agent connection problems look like an unavailable device to callers."""
+    if exc.kind == AGENT_ERROR_FAILED:
+        return exc
+    return DeviceUnavailableError(device_id, exc.retry_in)
+
+
+class _Waiter:
+    __slots__ = ("device_id", "priority", "user", "seq", "enqueued_at", "granted", "notify")
+
+    def __init__(self, device_id: Optional[str], priority: int, user: str, seq: int, notify: Callable[[], None]) -> None:
+        self.device_id = device_id
+        self.priority = priority
+        self.user = user
+        self.seq = seq
+        self.enqueued_at = time.monotonic()
+        self.granted = False
+        self.notify = notify
+
+
+class _DeviceQueue:
+    __slots__ = ("waiters", "running", "granted_total", "waits")
+
+    def __init__(self) -> None:
+        self.waiters: List[_Waiter] = []
+        self.running = 0
+        self.granted_total = 0
+        self.waits: Deque[float] = deque(maxlen=ADB_WAIT_SAMPLES)
+
+
+class AdbScheduler:
+    """Grant execution slots for adb commands.
+
+    At most `max_concurrent` adb processes run server-wide and at most
+    `max_per_device` against one serial. Host-level commands (`adb devices`)
+    only count against the global limit. When a slot frees up, the next
+    command is picked by priority (interactive > user > background, with
+    aging), then round-robin across users (the user served least recently
+    goes first), then in arrival order, so one user queueing many installs
+    cannot crowd out everybody else.
+    """
+
+    def __init__(
+        self,
+        max_concurrent: int = ADB_MAX_CONCURRENT,
+        max_per_device: int = ADB_MAX_PER_DEVICE,
+        breakers: DeviceCircuitBreakers = device_breakers,
+    ) -> None:
+        self.max_concurrent = max_concurrent
+        self.max_per_device = max_per_device
+        self.breakers = breakers
+        self._lock = threading.Lock()
+        self._devices: Dict[Optional[str], _DeviceQueue] = {}
+        self._running = 0
+        self._running_by_user: Dict[str, int] = {}
+        self._seq = itertools.count()
+        self._grants = itertools.count()
+        self._last_grant_by_user: Dict[str, int] = {}
+
+    @contextmanager
+    def slot(self, device_id: Optional[str], priority: int = ADB_PRIORITY_BACKGROUND, user: Optional[str] = None):
+        """Block the calling thread until a slot is granted; release it on exit."""
+        event = threading.Event()
+        waiter = self._enqueue(device_id, priority, user, event.set)
+        event.wait()
+        try:
+            yield
+        finally:
+            self._release(waiter)
+
+    @asynccontextmanager
+    async def slot_async(self, device_id: Optional[str], priority: int = ADB_PRIORITY_USER, user: Optional[str] = None):
+        """Await a slot without blocking the event loop; release it on exit."""
+        release = await self.acquire_async(device_id, priority, user)
+        try:
+            yield
+        finally:
+            release()
+
+    async def acquire_async(
+        self, device_id: Optional[str], priority: int = ADB_PRIORITY_USER, user: Optional[str] = None
+    ) -> Callable[[], None]:
+        """Await a slot; returns a function releasing it, which may be called more than once.
+
+        For commands that only need the slot to start, such as streams that
+        run until the user stops them, and give it back once they are running.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def notify() -> None:
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None))
+
+        waiter = self._enqueue(device_id, priority, user, notify)
+        try:
+            await future
+        except BaseException:
+            with self._lock:
+                granted = waiter.granted
+                if not granted:
+                    self._devices[device_id].waiters.remove(waiter)
+            if granted:
+                self._release(waiter)
+            raise
+
+        released = threading.Event()
+
+        def release() -> None:
+            with self._lock:
+                if released.is_set():
+                    return
+                released.set()
+            self._release(waiter)
+
+        return release
+
+    def run(
+        self,
+        command_tokens: List[str],
+        priority: int = ADB_PRIORITY_BACKGROUND,
+        user: Optional[str] = None,
+        timeout: Optional[float] = None,
+        check: bool = False,
+        **kwargs: Any,
+    ) -> subprocess.CompletedProcess:
+        """`subprocess.run` for an adb command once the scheduler grants it a slot.
+
+        The command is routed to the agent or adb server owning the device, killed
+        after its operation deadline (`subprocess.TimeoutExpired`), and raises
+        DeviceUnavailableError without running while the device's circuit
+        breaker is open.
+        """
+        command_tokens = adb_shards.route(command_tokens)
+        device_id = adb_target(command_tokens)
+        deadline = timeout if timeout is not None else adb_timeout(command_tokens)
+        operation = adb_metric_operation(command_tokens)
+        self._check_breaker(device_id, operation)
+        agent_id = agent_hub.owner(device_id)
+        try:
+            with self.slot(device_id, priority, user):
+                started = time.perf_counter()
+                try:
+                    if agent_id is not None:
+                        result = self._run_on_agent(
+                            agent_id, device_id, command_tokens, deadline, priority, user, kwargs
+                        )
+                    else:
+                        kwargs.setdefault("env", adb_shards.env_for(command_tokens))
+                        result = subprocess.run(command_tokens, timeout=deadline, **kwargs)
+                finally:
+                    _observe_command(operation, started)
+        except subprocess.TimeoutExpired:
+            self._record(device_id, None, f"{adb_operation(command_tokens)} timed out after {deadline:g}s", operation)
+            raise
+        except BaseException:
+            ADB_COMMAND_FAILURES.inc(operation, "error")
+            if device_id is not None:
+                self.breakers.abandon(device_id)
+            raise
+
+        self._record(device_id, result.returncode, result.stderr, operation)
+        if check:
+            result.check_returncode()
+        return result
+
+    async def run_async(
+        self,
+        command_tokens: List[str],
+        priority: int = ADB_PRIORITY_USER,
+        user: Optional[str] = None,
+        timeout: Optional[float] = None,
+    ) -> Dict[str, Any]:
+        """Coroutine variant of `run` returning returncode/stdout/stderr as text."""
+        command_tokens = adb_shards.route(command_tokens)
+        device_id = adb_target(command_tokens)
+        deadline = timeout if timeout is not None else adb_timeout(command_tokens)
+        operation = adb_metric_operation(command_tokens)
+        self._check_breaker(device_id, operation)
+        agent_id = agent_hub.owner(device_id)
+        started = None
+        try:
+            async with self.slot_async(device_id, priority, user):
+                started = time.perf_counter()
+                if agent_id is not None:
+                    upload, download = agent_file_arguments(command_tokens)
+                    try:
+                        output = await agent_hub.execute(
+                            agent_id, command_tokens, deadline, priority, user, upload, download
+                        )
+                    except AgentCommandError as exc:
+                        raise _agent_error(device_id, exc) from exc
+                    _observe_command(operation, started)
+                    self._record(device_id, output["returncode"], output["stderr"], operation)
+                    return output
+                process = await asyncio.create_subprocess_exec(
+                    *command_tokens,
+                    stdout=aio_subprocess.PIPE,
+                    stderr=aio_subprocess.PIPE,
+                    start_new_session=os.name == "posix",
+                    env=adb_shards.env_for(command_tokens),
+                )
+                try:
+                    stdout_bytes, stderr_bytes = await asyncio.wait_for(process.communicate(), deadline)
+                except BaseException:
+                    _kill_process_group(process)
+                    await process.wait()
+                    raise
+        except (asyncio.TimeoutError, subprocess.TimeoutExpired) as exc:
+            # subprocess.TimeoutExpired: deadline enforced by the owning agent
+            if started is not None:
+                _observe_command(operation, started)
+            self._record(device_id, None, f"{adb_operation(command_tokens)} timed out after {deadline:g}s", operation)
+            if isinstance(exc, subprocess.TimeoutExpired):
+                raise
+            raise subprocess.TimeoutExpired(command_tokens, deadline)
+        except BaseException:
+            if started is not None:
+                _observe_command(operation, started)
+            ADB_COMMAND_FAILURES.inc(operation, "error")
+            if device_id is not None:
+                self.breakers.abandon(device_id)
+            raise
+
+        _observe_command(operation, started)
+        stderr = stderr_bytes.decode("utf-8", errors="replace")
+        self._record(device_id, process.returncode, stderr, operation)
+        return {
+            "returncode": process.returncode,
+            "stdout": stdout_bytes.decode("utf-8", errors="replace"),
+            "stderr": stderr,
+        }
+
+    @staticmethod
+    def _run_on_agent(
+        agent_id: str,
+        device_id: str,
+        command_tokens: List[str],
+        deadline: float,
+        priority: int,
+        user: Optional[str],
+        kwargs: Dict[str, Any],
+    ) -> subprocess.CompletedProcess:
+        upload, download = agent_file_arguments(command_tokens)
+        try:
+            output = agent_hub.execute_sync(agent_id, command_tokens, deadline, priority, user, upload, download)
+        except AgentCommandError as exc:
+            raise _agent_error(device_id, exc) from exc
+        stdout, stderr = output["stdout"], output["stderr"]
+        if not (kwargs.get("text") or kwargs.get("universal_newlines")):
+            stdout, stderr = stdout.encode("utf-8"), stderr.encode("utf-8")
+        return subprocess.CompletedProcess(command_tokens, output["returncode"], stdout, stderr)
+
+    def _check_breaker(self, device_id: Optional[str], operation: str) -> None:
+        if device_id is not None and not self.breakers.allow(device_id):
+            ADB_COMMAND_FAILURES.inc(operation, "unavailable")
+            raise DeviceUnavailableError(device_id, self.breakers.retry_in(device_id))
+
+    def _record(self, device_id: Optional[str], returncode: Optional[int], stderr: Any, operation: str) -> None:
+        if returncode is None:
+            ADB_COMMAND_FAILURES.inc(operation, "timeout")
+        elif _is_transport_error(returncode, stderr):
+            ADB_COMMAND_FAILURES.inc(operation, "transport")
+        elif returncode != 0:
+            ADB_COMMAND_FAILURES.inc(operation, "exit_code")
+        if device_id is None:
+            return
+        if returncode is None:
+            self.breakers.record_failure(device_id, str(stderr))
+        elif _is_transport_error(returncode, stderr):
+            if isinstance(stderr, bytes):
+                stderr = stderr.decode("utf-8", errors="replace")
+            self.breakers.record_failure(device_id, stderr.strip())
+        else:
+            self.breakers.record_success(device_id)
+
+    def stats(self, device_id: Optional[str] = None) -> Dict[str, Any]:
+        now = time.monotonic()
+        with self._lock:
+            devices = {}
+            for key, queue in self._devices.items():
+                if device_id is not None and key != device_id:
+                    continue
+                devices[key if key is not None else "(host)"] = self._queue_stats(queue, now)
+            return {
+                "max_concurrent": self.max_concurrent,
+                "max_per_device": self.max_per_device,
+                "running": self._running,
+                "queued": sum(len(q.waiters) for q in self._devices.values()),
+                "running_by_user": dict(self._running_by_user),
+                "devices": devices,
+            }
+
+    @staticmethod
+    def _queue_stats(queue: _DeviceQueue, now: float) -> Dict[str, Any]:
+        depth = {name: 0 for name in ADB_PRIORITY_NAMES.values()}
+        for waiter in queue.waiters:
+            depth[ADB_PRIORITY_NAMES[waiter.priority]] += 1
+        waits = sorted(queue.waits)
+        oldest = max((now - w.enqueued_at for w in queue.waiters), default=0.0)
+        return {
+            "running": queue.running,
+            "queue_depth": len(queue.waiters),
+            "queue_depth_by_priority": depth,
+            "oldest_wait_ms": round(oldest * 1000, 3),
+            "granted_total": queue.granted_total,
+            "wait_ms_avg": round(sum(waits) / len(waits) * 1000, 3) if waits else None,
+            "wait_ms_p95": round(waits[min(len(waits) - 1, int(len(waits) * 0.95))] * 1000, 3) if waits else None,
+            "wait_ms_max": round(waits[-1] * 1000, 3) if waits else None,
+        }
+
+    def _enqueue(self, device_id: Optional[str], priority: int, user: Optional[str], notify: Callable[[], None]) -> _Waiter:
+        waiter = _Waiter(device_id, priority, user or SYSTEM_USER, next(self._seq), notify)
+        with self._lock:
+            queue = self._devices.get(device_id)
+            if queue is None:
+                queue = self._devices[device_id] = _DeviceQueue()
+            queue.waiters.append(waiter)
+            self._dispatch()
+        return waiter
+
+    def _release(self, waiter: _Waiter) -> None:
+        with self._lock:
+            self._running -= 1
+            self._devices[waiter.device_id].running -= 1
+            remaining = self._running_by_user[waiter.user] - 1
+            if remaining:
+                self._running_by_user[waiter.user] = remaining
+            else:
+                del self._running_by_user[waiter.user]
+            self._dispatch()
+
+    def _dispatch(self) -> None:
+        """Grant slots to the best eligible waiters. Caller holds the lock."""
+        while self._running < self.max_concurrent:
+            now = time.monotonic()
+            best: Optional[_Waiter] = None
+            best_key = None
+            for key, queue in self._devices.items():
+                if not queue.waiters or (key is not None and queue.running >= self.max_per_device):
+                    continue
+                for waiter in queue.waiters:
+                    aged = waiter.priority - int((now - waiter.enqueued_at) / ADB_PRIORITY_AGING_SECONDS)
+                    rank = (aged, self._last_grant_by_user.get(waiter.user, -1), waiter.seq)
+                    if best_key is None or rank < best_key:
+                        best, best_key = waiter, rank
+            if best is None:
+                return
+
+            queue = self._devices[best.device_id]
+            queue.waiters.remove(best)
+            queue.running += 1
+            queue.granted_total += 1
+            queue.waits.append(now - best.enqueued_at)
+            ADB_SLOT_WAIT_SECONDS.observe(now - best.enqueued_at, ADB_PRIORITY_NAMES.get(best.priority, "other"))
+            self._running += 1
+            self._running_by_user[best.user] = self._running_by_user.get(best.user, 0) + 1
+            self._last_grant_by_user[best.user] = next(self._grants)
+            best.granted = True
+            best.notify()
+
+
+def _kill_process_group(process: asyncio.subprocess.Process) -> None:
+    if process.returncode is not None:
+        return
+    try:
+        if os.name == "posix":
+            os.killpg(process.pid, signal.SIGKILL)
+        else:
+            process.kill()
+    except ProcessLookupError:
+        pass
+
+
+adb_scheduler = AdbScheduler()
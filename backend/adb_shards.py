@@ -0,0 +1,257 @@
+"""Multiple adb server instances sharing the device fleet's command load.
+
+Every adb server enumerates every USB device on the host; adb has no way to
+make a server ignore some of them. A shard therefore "owns" a device only in
+the sense that commands for it are routed there (and run with that shard's
+environment); devices reached over `adb connect` exist on one server only.
+Serials are spread over the shards by a stable hash, so the USB fleet's
+command load is partitioned even though every server sees every device.
+"""
+import json
+import logging
+import os
+import subprocess
+import threading
+import time
+import zlib
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+ADB_DEFAULT_SERVER_PORT = int(os.environ.get("ANDROID_ADB_SERVER_PORT", "5037"))
+# e.g. ADB_SERVER_SHARDS='[{"port": 5037}, {"port": 5038, "env": {"ADB_LIBUSB": "1"}}]'
+ADB_SERVER_SHARDS = os.environ.get("ADB_SERVER_SHARDS", "")
+ADB_SHARD_HEALTH_INTERVAL_SECONDS = 15
+ADB_SHARD_HEALTH_TIMEOUT_SECONDS = 5.0
+ADB_SHARD_START_TIMEOUT_SECONDS = 15.0
+# Consecutive failed health checks before a server is restarted
+ADB_SHARD_RESTART_AFTER_FAILURES = 2
+
+SHARD_HEALTHY = "healthy"
+SHARD_FAILING = "failing"
+SHARD_RESTARTING = "restarting"
+
+
+class AdbShard:
+    """One adb server listening on its own port, started with an optional extra environment."""
+
+    def __init__(self, port: int, env: Optional[Dict[str, str]] = None) -> None:
+        self.port = port
+        self.env = env or {}
+        self.state = SHARD_HEALTHY
+        self.failures = 0
+        self.restarts = 0
+        self.last_check: Optional[datetime] = None
+        self.last_error: Optional[str] = None
+        self.device_count = 0
+        self.lock = threading.Lock()
+
+    def command(self, *args: str) -> List[str]:
+        if self.port == ADB_DEFAULT_SERVER_PORT:
+            return ["adb", *args]
+        return ["adb", "-P", str(self.port), *args]
+
+    def process_env(self) -> Dict[str, str]:
+        return {**os.environ, **self.env, "ANDROID_ADB_SERVER_PORT": str(self.port)}
+
+
+class AdbShardManager:
+    """Route device commands to the adb server that owns the device and keep servers alive.
+
+    Ownership is decided by the presence scan from the servers that list a
+    serial online (state `device`): its home shard, picked by a stable hash
+    of the serial over all shards, when that one is healthy and has it
+    online; otherwise the shard it was recorded on, if it still has it
+    online; otherwise a hash over the healthy shards that do. A serial that
+    no server lists online stays on its recorded shard. With the default
+    single shard on ANDROID_ADB_SERVER_PORT, commands are left untouched.
+    """
+
+    def __init__(self, shards: Sequence[AdbShard]) -> None:
+        self.shards: Dict[int, AdbShard] = {shard.port: shard for shard in shards}
+        self._routes: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config: str = ADB_SERVER_SHARDS) -> "AdbShardManager":
+        if not config.strip():
+            return cls([AdbShard(ADB_DEFAULT_SERVER_PORT)])
+        return cls([AdbShard(int(item["port"]), item.get("env")) for item in json.loads(config)])
+
+    @property
+    def sharded(self) -> bool:
+        return len(self.shards) > 1 or ADB_DEFAULT_SERVER_PORT not in self.shards
+
+    def port_for(self, serial: str) -> Optional[int]:
+        with self._lock:
+            return self._routes.get(serial)
+
+    def assign(self, serial: str, port: int) -> None:
+        with self._lock:
+            self._routes[serial] = port
+
+    def route(self, command_tokens: Sequence[str]) -> List[str]:
+        """Insert `-P <port>` into an `adb -s SERIAL ...` command for sharded devices."""
+        tokens = list(command_tokens)
+        if not self.sharded or "-P" in tokens or "-s" not in tokens[:-1]:
+            return tokens
+        serial = tokens[tokens.index("-s") + 1]
+        port = self.port_for(serial)
+        if port is None or port == ADB_DEFAULT_SERVER_PORT:
+            return tokens
+        return [tokens[0], "-P", str(port), *tokens[1:]]
+
+    def env_for(self, command_tokens: Sequence[str]) -> Optional[Dict[str, str]]:
+        """Environment to run a routed adb command with: its shard's, or None to inherit ours."""
+        if not self.sharded:
+            return None
+        tokens = list(command_tokens)
+        port = ADB_DEFAULT_SERVER_PORT
+        if "-P" in tokens[:-1]:
+            try:
+                port = int(tokens[tokens.index("-P") + 1])
+            except ValueError:
+                return None
+        shard = self.shards.get(port)
+        return shard.process_env() if shard is not None else None
+
+    def resolve_owner(self, serial: str, listing_states: Dict[int, str], recorded_port: Optional[int]) -> int:
+        """Pick the owning shard for a serial from the `adb devices` state each listing server reported."""
+        online = [port for port, state in listing_states.items() if state == "device"]
+        home = self._hashed_port(serial, list(self.shards))
+        if home in online and self.shards[home].state == SHARD_HEALTHY:
+            port = home
+        elif recorded_port in online:
+            port = recorded_port
+        elif online:
+            healthy = [port for port in online if self.shards[port].state == SHARD_HEALTHY]
+            port = self._hashed_port(serial, healthy or online)
+        elif recorded_port is not None:
+            port = recorded_port
+        else:
+            port = self._hashed_port(serial, list(listing_states))
+        self.assign(serial, port)
+        return port
+
+    @staticmethod
+    def _hashed_port(serial: str, ports: Sequence[int]) -> int:
+        """The same port for the same serial and ports in every process and across restarts."""
+        ordered = sorted(ports)
+        return ordered[zlib.crc32(serial.encode("utf-8")) % len(ordered)]
+
+    def start_all(self) -> None:
+        for shard in self.shards.values():
+            self._start(shard)
+
+    def health_check(self) -> None:
+        """Ping every server; restart those that failed ADB_SHARD_RESTART_AFTER_FAILURES checks in a row."""
+        for shard in list(self.shards.values()):
+            if not shard.lock.acquire(blocking=False):
+                continue
+            try:
+                error = self._ping(shard)
+                shard.last_check = datetime.utcnow()
+                if error is None:
+                    shard.failures = 0
+                    shard.state = SHARD_HEALTHY
+                    continue
+                shard.failures += 1
+                shard.last_error = error
+                shard.state = SHARD_FAILING
+                if shard.failures >= ADB_SHARD_RESTART_AFTER_FAILURES:
+                    self._restart(shard)
+            finally:
+                shard.lock.release()
+
+    def restart(self, port: int) -> Dict[str, Any]:
+        shard = self.shards[port]
+        with shard.lock:
+            self._restart(shard)
+        return self._describe(shard)
+
+    def record_listing(self, port: int, device_count: int) -> None:
+        shard = self.shards.get(port)
+        if shard is not None:
+            shard.device_count = device_count
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            routes_by_port: Dict[int, int] = {}
+            for port in self._routes.values():
+                routes_by_port[port] = routes_by_port.get(port, 0) + 1
+        return {
+            "sharded": self.sharded,
+            "default_port": ADB_DEFAULT_SERVER_PORT,
+            "placement": "stable hash of the serial over healthy servers listing it online",
+            "routed_devices_total": sum(routes_by_port.values()),
+            "servers": [
+                {**self._describe(shard), "routed_devices": routes_by_port.get(shard.port, 0)}
+                for shard in self.shards.values()
+            ],
+        }
+
+    @staticmethod
+    def _describe(shard: AdbShard) -> Dict[str, Any]:
+        return {
+            "port": shard.port,
+            "state": shard.state,
+            "consecutive_failures": shard.failures,
+            "restarts": shard.restarts,
+            "device_count": shard.device_count,
+            "last_check": shard.last_check,
+            "last_error": shard.last_error,
+        }
+
+    def _ping(self, shard: AdbShard) -> Optional[str]:
+        try:
+            result = subprocess.run(
+                shard.command("devices"),
+                capture_output=True,
+                text=True,
+                timeout=ADB_SHARD_HEALTH_TIMEOUT_SECONDS,
+                env=shard.process_env(),
+            )
+        except subprocess.TimeoutExpired:
+            return f"health check timed out after {ADB_SHARD_HEALTH_TIMEOUT_SECONDS:g}s"
+        except OSError as exc:
+            return str(exc)
+        if result.returncode != 0:
+            return result.stderr.strip() or f"adb exited with code {result.returncode}"
+        return None
+
+    def _start(self, shard: AdbShard) -> None:
+        try:
+            subprocess.run(
+                shard.command("start-server"),
+                capture_output=True,
+                timeout=ADB_SHARD_START_TIMEOUT_SECONDS,
+                env=shard.process_env(),
+            )
+        except (subprocess.SubprocessError, OSError) as exc:
+            shard.last_error = str(exc)
+            logger.error("Failed to start adb server on port %d: %s", shard.port, exc)
+
+    def _restart(self, shard: AdbShard) -> None:
+        logger.warning("Restarting adb server on port %d after %d failed checks: %s",
+                       shard.port, shard.failures, shard.last_error)
+        shard.state = SHARD_RESTARTING
+        try:
+            subprocess.run(
+                shard.command("kill-server"),
+                capture_output=True,
+                timeout=ADB_SHARD_HEALTH_TIMEOUT_SECONDS,
+                env=shard.process_env(),
+            )
+        except (subprocess.SubprocessError, OSError):
+            pass
+        time.sleep(0.5)
+        self._start(shard)
+        shard.restarts += 1
+        error = self._ping(shard)
+        shard.failures = 0 if error is None else shard.failures
+        shard.state = SHARD_HEALTHY if error is None else SHARD_FAILING
+        shard.last_error = error or shard.last_error
+
+
+adb_shards = AdbShardManager.from_config()
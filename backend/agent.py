@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+"""Agent mode: scan and run adb on a remote rack for the central server.
+
+The agent keeps one WebSocket open to the central server's `/ws/agent`,
+pushes `adb devices -l` snapshots and runs the adb commands (deep probes,
+terminal, logcat, push/pull) the server routes to its devices, using the
+same adb scheduler and circuit breakers as the server itself.
+
+Usage:
+    AGENT_TOKEN=secret python agent.py --server ws://central:8000 --agent-id lab-a
+"""
+import argparse
+import asyncio
+import base64
+import json
+import logging
+import os
+import shutil
+import socket
+import subprocess
+import tempfile
+from typing import Any, Dict, Optional
+from urllib.parse import urlencode
+
+import websockets
+
+from adb_scheduler import (
+    ADB_PRIORITY_BACKGROUND,
+    ADB_PRIORITY_INTERACTIVE,
+    SYSTEM_USER,
+    DeviceUnavailableError,
+    adb_scheduler,
+    adb_target,
+    agent_file_arguments,
+)
+from adb_shards import adb_shards
+from agent_hub import (
+    AGENT_CHUNK_CHARS,
+    AGENT_ERROR_FAILED,
+    AGENT_ERROR_TIMEOUT,
+    AGENT_ERROR_UNAVAILABLE,
+)
+from terminal_session import stream_process_output
+
+logger = logging.getLogger("agent")
+
+AGENT_SNAPSHOT_INTERVAL_SECONDS = 5
+# An unchanged device list is resent this often so the server knows the agent is alive
+AGENT_SNAPSHOT_KEEPALIVE_SECONDS = 60
+AGENT_RECONNECT_MAX_SECONDS = 30
+# Pushed files arrive in AGENT_CHUNK_CHARS frames, so no frame comes close to this
+AGENT_MAX_MESSAGE_BYTES = 16 * 1024 * 1024
+
+
+class DeviceAgent:
+    """One rack's connection to the central server."""
+
+    def __init__(self, server_url: str, agent_id: str, token: str) -> None:
+        self.server_url = server_url.rstrip("/")
+        self.agent_id = agent_id
+        self.token = token
+        self._send_lock = asyncio.Lock()
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._cancel_events: Dict[str, asyncio.Event] = {}
+        # Scratch directories holding the files received for commands that have not run yet
+        self._workdirs: Dict[str, str] = {}
+
+    async def run_forever(self) -> None:
+        query = urlencode({"agent_id": self.agent_id, "token": self.token})
+        url = f"{self.server_url}/ws/agent?{query}"
+        backoff = 1.0
+        while True:
+            try:
+                async with websockets.connect(url, max_size=AGENT_MAX_MESSAGE_BYTES) as websocket:
+                    logger.info("Connected to %s as %s", self.server_url, self.agent_id)
+                    backoff = 1.0
+                    await self._session(websocket)
+            except (OSError, websockets.WebSocketException) as exc:
+                logger.warning("Connection to %s lost: %s; retrying in %.0fs", self.server_url, exc, backoff)
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, AGENT_RECONNECT_MAX_SECONDS)
+
+    async def _session(self, websocket: Any) -> None:
+        snapshots = asyncio.create_task(self._snapshot_loop(websocket))
+        try:
+            async for raw in websocket:
+                message = json.loads(raw)
+                kind = message.get("type")
+                if kind == "upload":
+                    await self._receive_upload(message)
+                elif kind in ("exec", "stream"):
+                    handler = self._exec if kind == "exec" else self._stream
+                    self._tasks[message["id"]] = asyncio.create_task(self._run(websocket, message, handler))
+                elif kind == "cancel":
+                    self._cancel(message.get("id"))
+        finally:
+            snapshots.cancel()
+            for command_id in list(self._tasks):
+                self._cancel(command_id)
+            for workdir in self._workdirs.values():
+                shutil.rmtree(workdir, ignore_errors=True)
+            self._workdirs.clear()
+
+    async def _send(self, websocket: Any, message: Dict[str, Any]) -> None:
+        async with self._send_lock:
+            await websocket.send(json.dumps(message))
+
+    async def _snapshot_loop(self, websocket: Any) -> None:
+        loop = asyncio.get_running_loop()
+        last_output: Optional[str] = None
+        last_sent = 0.0
+        while True:
+            try:
+                result = await adb_scheduler.run_async(["adb", "devices", "-l"], ADB_PRIORITY_BACKGROUND, SYSTEM_USER)
+            except (subprocess.SubprocessError, OSError) as exc:
+                logger.warning("adb devices -l failed: %s", exc)
+            else:
+                output = result["stdout"]
+                now = loop.time()
+                if output != last_output or now - last_sent >= AGENT_SNAPSHOT_KEEPALIVE_SECONDS:
+                    await self._send(websocket, {"type": "snapshot", "adb_devices": output})
+                    last_output, last_sent = output, now
+            await asyncio.sleep(AGENT_SNAPSHOT_INTERVAL_SECONDS)
+
+    @staticmethod
+    def _upload_path(workdir: str, index: int) -> str:
+        return os.path.join(workdir, f"upload-{index}")
+
+    async def _receive_upload(self, message: Dict[str, Any]) -> None:
+        """Append one frame of a pushed file to the command's scratch directory."""
+        workdir = self._workdirs.get(message["id"])
+        if workdir is None:
+            workdir = self._workdirs[message["id"]] = tempfile.mkdtemp(prefix="agent-")
+        path = self._upload_path(workdir, int(message["index"]))
+        data = base64.b64decode(message.get("data", ""))
+
+        def append() -> None:
+            with open(path, "ab") as handle:
+                handle.write(data)
+
+        await asyncio.get_running_loop().run_in_executor(None, append)
+
+    def _cancel(self, command_id: Optional[str]) -> None:
+        workdir = self._workdirs.pop(command_id, None)
+        if workdir is not None:
+            shutil.rmtree(workdir, ignore_errors=True)
+        event = self._cancel_events.get(command_id)
+        if event is not None:
+            event.set()
+            return
+        task = self._tasks.get(command_id)
+        if task is not None:
+            task.cancel()
+
+    async def _run(self, websocket: Any, message: Dict[str, Any], handler) -> None:
+        command_id = message["id"]
+        end: Dict[str, Any] = {"type": "end", "id": command_id}
+        try:
+            tokens = list(message.get("tokens") or [])
+            if not tokens or tokens[0] != "adb":
+                raise ValueError("agents only run adb commands")
+            end.update(await handler(websocket, message, tokens))
+        except asyncio.CancelledError:
+            return
+        except subprocess.TimeoutExpired as exc:
+            end.update(error=AGENT_ERROR_TIMEOUT, timeout=exc.timeout)
+        except DeviceUnavailableError as exc:
+            end.update(error=AGENT_ERROR_UNAVAILABLE, message=str(exc), retry_in=exc.retry_in)
+        except (subprocess.SubprocessError, OSError, ValueError) as exc:
+            end.update(error=AGENT_ERROR_FAILED, message=str(exc))
+        finally:
+            self._tasks.pop(command_id, None)
+            self._cancel_events.pop(command_id, None)
+        try:
+            await self._send(websocket, end)
+        except websockets.WebSocketException:
+            pass
+
+    async def _exec(self, websocket: Any, message: Dict[str, Any], tokens: list) -> Dict[str, Any]:
+        workdir = self._workdirs.pop(message["id"], None) or tempfile.mkdtemp(prefix="agent-")
+        try:
+            # Local paths of the server are replaced by files in our own scratch directory
+            upload, download = agent_file_arguments(tokens)
+            for index in upload:
+                # adb install goes by the file extension, so the file keeps its name
+                path = os.path.join(workdir, f"{index}-{os.path.basename(tokens[index])}")
+                received = self._upload_path(workdir, index)
+                if os.path.exists(received):
+                    os.replace(received, path)
+                else:
+                    # An empty file needs no upload frames
+                    open(path, "wb").close()
+                tokens[index] = path
+            for index in download:
+                tokens[index] = os.path.join(workdir, f"{index}-{os.path.basename(tokens[index])}")
+
+            result = await adb_scheduler.run_async(
+                tokens, message.get("priority", ADB_PRIORITY_BACKGROUND), message.get("user"), message.get("timeout")
+            )
+
+            for index in download:
+                if not os.path.exists(tokens[index]):
+                    continue
+                with open(tokens[index], "rb") as handle:
+                    while True:
+                        data = handle.read(AGENT_CHUNK_CHARS)
+                        if not data:
+                            break
+                        await self._send(websocket, {
+                            "type": "file", "id": message["id"], "index": index,
+                            "data": base64.b64encode(data).decode("ascii"),
+                        })
+            stdout = result["stdout"]
+            pieces = [stdout[i:i + AGENT_CHUNK_CHARS] for i in range(0, len(stdout), AGENT_CHUNK_CHARS)] or [""]
+            for piece in pieces[:-1]:
+                await self._send(websocket, {"type": "chunk", "id": message["id"], "stream": "stdout", "data": piece})
+            return {"returncode": result["returncode"], "stdout": pieces[-1], "stderr": result["stderr"]}
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    async def _stream(self, websocket: Any, message: Dict[str, Any], tokens: list) -> Dict[str, Any]:
+        cancel_event = self._cancel_events[message["id"]] = asyncio.Event()
+
+        async def on_chunk(stream_name: str, text: str) -> None:
+            await self._send(websocket, {"type": "chunk", "id": message["id"], "stream": stream_name, "data": text})
+
+        # Like the central server, hold the device's slot only until the stream is running
+        release_slot = await adb_scheduler.acquire_async(adb_target(tokens), ADB_PRIORITY_INTERACTIVE, message.get("user"))
+        try:
+            if cancel_event.is_set():
+                return {"returncode": None, "stdout": "", "stderr": "", "status": "cancelled", "output_bytes": 0}
+            routed = adb_shards.route(tokens)
+            return await stream_process_output(
+                routed, on_chunk, cancel_event, message["max_output_bytes"], adb_shards.env_for(routed),
+                on_started=release_slot,
+            )
+        finally:
+            release_slot()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Device manager rack agent")
+    parser.add_argument("--server", default=os.environ.get("AGENT_SERVER_URL", "ws://localhost:8000"),
+                        help="Central server base URL (ws:// or wss://)")
+    parser.add_argument("--agent-id", default=os.environ.get("AGENT_ID", socket.gethostname()))
+    args = parser.parse_args()
+
+    token = os.environ.get("AGENT_TOKEN")
+    if not token:
+        parser.error("AGENT_TOKEN must be set to the central server's agent token")
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    asyncio.run(DeviceAgent(args.server, args.agent_id, token).run_forever())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+"""Local multi-process stand-in for a multi-rack deployment.
+
+Starts a central server and several agents on this machine, each agent with
+its own fake `adb` that reports a distinct set of devices, then checks that
+devices show up centrally, that logcat, push and terminal commands reach
+the owning agent, and that an agent's devices go offline when it dies.
+
+Usage:
+    python agent_harness.py [--racks 3] [--devices-per-rack 4] [--port 8765]
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+from typing import Any, Dict, List, Optional
+
+import websockets
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+HARNESS_AGENT_TOKEN = "harness-agent-token"
+HARNESS_TIMEOUT_SECONDS = 60
+
+# adb stand-in for one rack: lists RACK-DEVn devices, runs `shell` locally and
+# keeps pushed files in a per-rack directory that `pull` reads back from.
+FAKE_ADB = """#!/bin/sh
+RACK_DIR="$(dirname "$0")"
+while [ "${1#-}" != "$1" ]; do shift 2; done
+case "$1" in
+  devices)
+    printf 'List of devices attached\\n'
+    for i in $(seq 1 %(devices)d); do printf '%(rack)s-DEV%%d device usb:1-%%d model:Harness transport_id:%%d\\n' $i $i $i; done;;
+  shell) shift; exec sh -c "$*";;
+  logcat) echo "logcat from %(rack)s";;
+  push) mkdir -p "$RACK_DIR/fs"; cp "$2" "$RACK_DIR/fs/$(basename "$3")" && echo "$2: 1 file pushed";;
+  pull) cp "$RACK_DIR/fs/$(basename "$2")" "$3" && echo "$2: 1 file pulled";;
+  *) echo "ok";;
+esac
+"""
+
+
+def _write_fake_adb(directory: str, rack: str, devices: int) -> str:
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, "adb")
+    with open(path, "w") as handle:
+        handle.write(FAKE_ADB % {"rack": rack, "devices": devices})
+    os.chmod(path, 0o755)
+    return directory
+
+
+def _request(url: str, token: str, method: str = "GET", body: Optional[bytes] = None,
+             content_type: str = "application/json") -> Any:
+    request = urllib.request.Request(url, data=body, method=method)
+    request.add_header("Authorization", f"Bearer {token}")
+    if body is not None:
+        request.add_header("Content-Type", content_type)
+    with urllib.request.urlopen(request, timeout=30) as response:
+        payload = response.read()
+    try:
+        return json.loads(payload)
+    except ValueError:
+        return payload.decode("utf-8", errors="replace")
+
+
+def _wait_until(predicate, timeout: float = HARNESS_TIMEOUT_SECONDS, interval: float = 0.5) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if predicate():
+                return True
+        except (urllib.error.URLError, ConnectionError):
+            pass
+        time.sleep(interval)
+    return False
+
+
+def _admin_token(central_dir: str) -> str:
+    """Create the admin user in the central server's database and mint a token for it."""
+    sys.path.insert(0, BACKEND_DIR)
+    os.chdir(central_dir)
+    from auth import create_access_token
+    from database import SessionLocal, User, create_tables
+
+    create_tables()
+    db = SessionLocal()
+    try:
+        if not db.query(User).filter(User.username == "admin").first():
+            # The harness only uses tokens, so the account gets no usable password
+            db.add(User(username="admin", email="admin@example.com", hashed_password="!", role="admin"))
+            db.commit()
+    finally:
+        db.close()
+    return create_access_token({"sub": "admin"})
+
+
+async def _terminal_command(base_ws: str, device_id: str, token: str, command: str) -> Dict[str, Any]:
+    url = f"{base_ws}/ws/devices/{device_id}/terminal?token={token}"
+    async with websockets.connect(url) as websocket:
+        output = []
+        await websocket.send(json.dumps({"type": "command", "command": command}))
+        while True:
+            message = json.loads(await websocket.recv())
+            if message["type"] == "chunk":
+                output.append(message.get("data", ""))
+            elif message["type"] in ("output", "error"):
+                return {**message, "text": "".join(output)}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--racks", type=int, default=3)
+    parser.add_argument("--devices-per-rack", type=int, default=4)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="agent-harness-")
+    central_dir = os.path.join(workdir, "central")
+    os.makedirs(central_dir)
+    base_url = f"http://127.0.0.1:{args.port}"
+    base_ws = f"ws://127.0.0.1:{args.port}"
+    token = _admin_token(central_dir)
+
+    env = {**os.environ, "AGENT_TOKEN": HARNESS_AGENT_TOKEN, "PYTHONPATH": BACKEND_DIR}
+    # The central host has no devices of its own
+    central_adb = _write_fake_adb(os.path.join(workdir, "central-adb"), "CENTRAL", 0)
+    processes: List[subprocess.Popen] = []
+    results: Dict[str, Any] = {"racks": args.racks, "devices_per_rack": args.devices_per_rack, "checks": {}}
+    checks = results["checks"]
+    try:
+        processes.append(subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main_enhanced:app", "--port", str(args.port), "--log-level", "warning"],
+            cwd=central_dir, env={**env, "PATH": f"{central_adb}:{env['PATH']}"},
+        ))
+        agents: Dict[str, subprocess.Popen] = {}
+        for index in range(args.racks):
+            rack = f"RACK{index}"
+            rack_adb = _write_fake_adb(os.path.join(workdir, rack), rack, args.devices_per_rack)
+            agents[rack] = subprocess.Popen(
+                [sys.executable, os.path.join(BACKEND_DIR, "agent.py"), "--server", base_ws, "--agent-id", rack],
+                cwd=os.path.join(workdir, rack), env={**env, "PATH": f"{rack_adb}:{env['PATH']}"},
+            )
+            processes.append(agents[rack])
+
+        expected = args.racks * args.devices_per_rack
+        started = time.monotonic()
+
+        def online_devices() -> List[Dict[str, Any]]:
+            devices = _request(f"{base_url}/api/devices", token)
+            return [d for d in devices if d["device_type"] == "adb" and d["status"] == "online"]
+
+        checks["all_devices_online"] = _wait_until(lambda: len(online_devices()) == expected)
+        results["seconds_until_online"] = round(time.monotonic() - started, 2)
+        owners = {d["device_id"]: d["connection_info"].get("agent_id") for d in online_devices()}
+        checks["devices_routed_to_their_rack"] = all(
+            agent_id == device_id.split("-")[0] for device_id, agent_id in owners.items()
+        ) and len(owners) == expected
+
+        for rack in agents:
+            device_id = f"{rack}-DEV1"
+            logcat = _request(f"{base_url}/api/devices/{device_id}/actions/logcat", token, "POST", b"{}")
+            checks[f"{rack}_logcat"] = logcat.strip() == f"logcat from {rack}"
+            terminal = asyncio.run(_terminal_command(base_ws, device_id, token, "shell echo $PWD"))
+            checks[f"{rack}_terminal"] = (
+                terminal.get("status") == "success" and terminal["text"].strip().endswith(rack)
+            )
+
+        boundary = "harnessboundary"
+        body = (
+            f"--{boundary}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"hello.txt\"\r\n"
+            f"Content-Type: text/plain\r\n\r\nhello rack\r\n"
+            f"--{boundary}\r\nContent-Disposition: form-data; name=\"remote_dir\"\r\n\r\n/data\r\n--{boundary}--\r\n"
+        ).encode()
+        push = _request(f"{base_url}/api/devices/RACK0-DEV2/filesystem/push", token, "POST", body,
+                        f"multipart/form-data; boundary={boundary}")
+        checks["push_reaches_agent"] = os.path.exists(os.path.join(workdir, "RACK0", "fs", "hello.txt")) \
+            and isinstance(push, dict) and push.get("remote_path") == "/data/hello.txt"
+
+        victim = sorted(agents)[-1]
+        agents[victim].terminate()
+        agents[victim].wait()
+        checks["dead_agent_devices_offline"] = _wait_until(
+            lambda: not any(d["device_id"].startswith(victim) for d in online_devices()), timeout=15
+        )
+        try:
+            _request(f"{base_url}/api/devices/{victim}-DEV1/actions/logcat", token, "POST", b"{}")
+            checks["dead_agent_commands_fail_fast"] = False
+        except urllib.error.HTTPError as exc:
+            checks["dead_agent_commands_fail_fast"] = exc.code == 503
+        results["agents"] = _request(f"{base_url}/api/admin/agents", token)
+    finally:
+        for process in processes:
+            if process.poll() is None:
+                process.terminate()
+        for process in processes:
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+    results["ok"] = all(checks.values())
+    print(json.dumps(results, indent=2, default=str))
+    return 0 if results["ok"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
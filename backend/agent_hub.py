@@ -0,0 +1,702 @@
+"""Central-side registry of device agents that run adb on remote racks."""
+import asyncio
+import base64
+import hmac
+import itertools
+import json
+import logging
+import os
+import socket
+import subprocess
+import threading
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+from database import AgentHeartbeat, Device, SessionLocal
+from event_bus import EventBus, event_bus
+
+logger = logging.getLogger(__name__)
+
+# Shared secret agents present when connecting to /ws/agent; agent mode is disabled while unset
+AGENT_TOKEN = os.environ.get("AGENT_TOKEN", "")
+# Extra time the central server waits beyond a command's own deadline before giving up on an agent
+AGENT_RESULT_GRACE_SECONDS = 10.0
+# Retry hint for commands addressed to a device whose agent is disconnected
+AGENT_RECONNECT_RETRY_SECONDS = 30.0
+# Output and files larger than this are sent in several frames, in either direction
+AGENT_CHUNK_CHARS = 256 * 1024
+# Agents resend their snapshot at least once a minute; one not heard from for three of those is gone
+AGENT_HEARTBEAT_TTL_SECONDS = 180.0
+# How often a central process re-reads device owners and agent heartbeats from the database
+AGENT_ROUTES_REFRESH_SECONDS = 5.0
+# Event bus event carrying commands for agents attached to another worker, and their output
+AGENT_RELAY_EVENT = "agent_relay"
+
+# Fields of a stream's end frame that make up its result
+AGENT_STREAM_END_KEYS = ("returncode", "stdout", "stderr", "status", "output_bytes", "error", "message")
+
+AGENT_ERROR_TIMEOUT = "timeout"
+AGENT_ERROR_UNAVAILABLE = "unavailable"
+AGENT_ERROR_DISCONNECTED = "disconnected"
+AGENT_ERROR_FAILED = "failed"
+
+
+class AgentCommandError(subprocess.SubprocessError):
+    """A command routed to an agent could not be run there."""
+
+    def __init__(self, kind: str, message: str, retry_in: float = AGENT_RECONNECT_RETRY_SECONDS) -> None:
+        super().__init__(message)
+        self.kind = kind
+        self.retry_in = retry_in
+
+
+class _PendingCommand:
+    __slots__ = ("tokens", "future", "stdout", "stderr", "files", "on_chunk")
+
+    def __init__(self, tokens: Sequence[str], future: "asyncio.Future[Dict[str, Any]]",
+                 on_chunk: Optional[Callable[[str, str], Awaitable[None]]] = None) -> None:
+        self.tokens = list(tokens)
+        self.future = future
+        self.stdout: List[str] = []
+        self.stderr: List[str] = []
+        self.files: Dict[int, List[bytes]] = {}
+        self.on_chunk = on_chunk
+
+
+class _PendingRelay:
+    __slots__ = ("events", "stdout", "stderr")
+
+    def __init__(self) -> None:
+        self.events: "asyncio.Queue[Dict[str, Any]]" = asyncio.Queue()
+        self.stdout: List[str] = []
+        self.stderr: List[str] = []
+
+
+class AgentConnection:
+    """One connected agent and the commands it is currently running for us."""
+
+    def __init__(self, agent_id: str, websocket: Any, host: Optional[str]) -> None:
+        self.agent_id = agent_id
+        self.websocket = websocket
+        self.host = host
+        self.connected_at = datetime.utcnow()
+        self.last_snapshot_at: Optional[datetime] = None
+        self.device_count = 0
+        self.commands_total = 0
+        self.pending: Dict[str, _PendingCommand] = {}
+        self.send_lock = asyncio.Lock()
+        self._latest_snapshot: Optional[Dict[str, Any]] = None
+        self._snapshot_task: Optional[asyncio.Task] = None
+
+    async def send(self, message: Dict[str, Any]) -> None:
+        async with self.send_lock:
+            await self.websocket.send_json(message)
+
+
+class AgentHub:
+    """Route adb commands for agent-owned devices over the agents' persistent connections.
+
+    Agents connect to `/ws/agent`, push `adb devices -l` snapshots and run
+    the commands the central server sends them. Ownership is learned from
+    snapshots: a serial belongs to the agent that last reported it, as
+    recorded in its connection_info. An agent is connected to one worker
+    only; that worker keeps a heartbeat row for it in `agent_heartbeats`,
+    so every process can tell which agents are alive and where. Commands
+    for an agent attached to another worker are relayed to that worker over
+    the event bus (the workers share a host and its temporary files), and
+    commands for a device whose agent is gone fail fast instead of running
+    against the local adb server, where the device is not attached.
+
+    Protocol (JSON text frames):
+      central -> agent: {"type": "upload", "id", "index", "data": base64},
+                        {"type": "exec" | "stream", "id", "tokens", "timeout",
+                         "priority", "user", "max_output_bytes",
+                         "upload": [index], "download": [index]},
+                        {"type": "cancel", "id"}
+      agent -> central: {"type": "snapshot", "adb_devices": str},
+                        {"type": "chunk", "id", "stream", "data"},
+                        {"type": "file", "id", "index", "data": base64},
+                        {"type": "end", "id", "returncode", "stdout", "stderr",
+                         "status", "output_bytes", "error", "retry_in"}
+
+    Relay (AGENT_RELAY_EVENT events, addressed by worker id):
+      requester -> owner: {"op": "exec" | "stream", "id", "agent_id", "tokens", ...},
+                          {"op": "cancel", "id"}
+      owner -> requester: {"op": "chunk", "id", "stream", "data"},
+                          {"op": "end", "id", "returncode", ..., "error", "message", "retry_in"}
+    """
+
+    def __init__(self, session_factory: Callable[[], Any] = SessionLocal, bus: EventBus = event_bus) -> None:
+        self.session_factory = session_factory
+        self.bus = bus
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self._agents: Dict[str, AgentConnection] = {}
+        self._owners: Dict[str, str] = {}
+        # agent_id -> worker_id of every agent with a live heartbeat
+        self._live: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._refresh_thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._ids = itertools.count(1)
+        self._relays: Dict[str, _PendingRelay] = {}
+        self._served: Dict[Tuple[str, str], Tuple[asyncio.Task, asyncio.Event]] = {}
+
+    @staticmethod
+    def authenticate(token: Optional[str]) -> bool:
+        return bool(AGENT_TOKEN) and token is not None and hmac.compare_digest(token, AGENT_TOKEN)
+
+    def owner(self, serial: Optional[str]) -> Optional[str]:
+        if serial is None:
+            return None
+        with self._lock:
+            return self._owners.get(serial)
+
+    def assign(self, serial: str, agent_id: str) -> None:
+        with self._lock:
+            self._owners[serial] = agent_id
+
+    def release(self, serial: str) -> None:
+        with self._lock:
+            self._owners.pop(serial, None)
+
+    def connected(self, agent_id: str) -> bool:
+        return agent_id in self._agents
+
+    def alive(self, agent_id: str) -> bool:
+        """Whether the agent is connected to any worker, as of the last `refresh_routes`; never blocks on the database."""
+        with self._lock:
+            return agent_id in self._agents or agent_id in self._live
+
+    def start(self) -> None:
+        """Read the routes now, then every AGENT_ROUTES_REFRESH_SECONDS on a dedicated thread; blocking.
+
+        Only central processes start this: `owner` and `alive` just read
+        what the thread last loaded, so they never touch the database on the
+        event loop, and an agent, which has no central database, never reads it.
+        """
+        if self._refresh_thread is not None:
+            return
+        self._stop.clear()
+        self.refresh_routes()
+
+        def loop() -> None:
+            while not self._stop.wait(AGENT_ROUTES_REFRESH_SECONDS):
+                self.refresh_routes()
+
+        self._refresh_thread = threading.Thread(target=loop, name="agent-routes", daemon=True)
+        self._refresh_thread.start()
+
+    def stop(self) -> None:
+        if self._refresh_thread is not None:
+            self._stop.set()
+            self._refresh_thread.join(timeout=AGENT_ROUTES_REFRESH_SECONDS)
+            self._refresh_thread = None
+
+    def refresh_routes(self) -> None:
+        """Re-read device owners and live agents from the database; blocking. A failed read keeps the previous routes."""
+        with self._refresh_lock:
+            cutoff = datetime.utcnow() - timedelta(seconds=AGENT_HEARTBEAT_TTL_SECONDS)
+            db = self.session_factory()
+            try:
+                rows = db.query(Device.device_id, Device.connection_info).filter(
+                    Device.device_type == "adb", Device.connection_info.like("%agent_id%")
+                ).all()
+                live = dict(
+                    db.query(AgentHeartbeat.agent_id, AgentHeartbeat.worker_id)
+                    .filter(AgentHeartbeat.last_seen_at >= cutoff)
+                    .all()
+                )
+            except Exception as exc:
+                logger.warning("Could not read agent routes, keeping the previous ones: %s", exc)
+                return
+            finally:
+                db.close()
+            owners = {}
+            for device_id, connection_info in rows:
+                agent_id = json.loads(connection_info).get("agent_id")
+                if agent_id:
+                    owners[device_id] = agent_id
+            with self._lock:
+                self._owners = owners
+                self._live = live
+
+    def record_heartbeat(self, connection: AgentConnection) -> None:
+        """Mark the agent as alive and connected to this worker; blocking."""
+        db = self.session_factory()
+        try:
+            db.merge(AgentHeartbeat(
+                agent_id=connection.agent_id,
+                worker_id=self.worker_id,
+                host=connection.host,
+                connected_at=connection.connected_at,
+                last_seen_at=datetime.utcnow(),
+            ))
+            db.commit()
+        finally:
+            db.close()
+        with self._lock:
+            self._live[connection.agent_id] = self.worker_id
+
+    def clear_heartbeat(self, agent_id: str) -> bool:
+        """Drop the agent's heartbeat unless it has already reconnected to another worker; blocking.
+
+        Returns whether the heartbeat was this worker's, i.e. whether the
+        agent is now gone everywhere.
+        """
+        db = self.session_factory()
+        try:
+            cleared = db.query(AgentHeartbeat).filter(
+                AgentHeartbeat.agent_id == agent_id, AgentHeartbeat.worker_id == self.worker_id
+            ).delete()
+            db.commit()
+        finally:
+            db.close()
+        if cleared:
+            with self._lock:
+                self._live.pop(agent_id, None)
+        return bool(cleared)
+
+    def attach(self, agent_id: str, websocket: Any, host: Optional[str] = None) -> AgentConnection:
+        """Register a freshly accepted agent connection, replacing a stale one with the same id."""
+        self.loop = asyncio.get_running_loop()
+        previous = self._agents.get(agent_id)
+        if previous is not None:
+            self._fail_pending(previous, AGENT_ERROR_DISCONNECTED, f"Agent {agent_id} reconnected")
+        connection = AgentConnection(agent_id, websocket, host)
+        self._agents[agent_id] = connection
+        logger.info("Agent %s connected from %s", agent_id, host)
+        return connection
+
+    def detach(self, connection: AgentConnection) -> bool:
+        """Forget a closed connection; returns False if the agent already reconnected."""
+        self._fail_pending(connection, AGENT_ERROR_DISCONNECTED, f"Agent {connection.agent_id} disconnected")
+        if self._agents.get(connection.agent_id) is not connection:
+            return False
+        del self._agents[connection.agent_id]
+        logger.warning("Agent %s disconnected", connection.agent_id)
+        return True
+
+    def submit_snapshot(
+        self,
+        connection: AgentConnection,
+        message: Dict[str, Any],
+        apply: Callable[[str, Dict[str, Any]], int],
+    ) -> None:
+        """Apply snapshots in a worker thread, coalescing ones that arrive while the last is applied."""
+        connection._latest_snapshot = message
+        if connection._snapshot_task is not None and not connection._snapshot_task.done():
+            return
+
+        async def drain() -> None:
+            loop = asyncio.get_running_loop()
+            while connection._latest_snapshot is not None:
+                snapshot, connection._latest_snapshot = connection._latest_snapshot, None
+                try:
+                    await loop.run_in_executor(None, self.record_heartbeat, connection)
+                except Exception:
+                    logger.exception("Failed to record heartbeat of agent %s", connection.agent_id)
+                try:
+                    connection.device_count = await loop.run_in_executor(None, apply, connection.agent_id, snapshot)
+                    connection.last_snapshot_at = datetime.utcnow()
+                except Exception:
+                    logger.exception("Failed to apply snapshot from agent %s", connection.agent_id)
+
+        connection._snapshot_task = asyncio.create_task(drain())
+
+    async def handle_message(self, connection: AgentConnection, message: Dict[str, Any]) -> None:
+        pending = connection.pending.get(message.get("id"))
+        if pending is None:
+            return
+        kind = message.get("type")
+        if kind == "chunk":
+            stream_name = "stderr" if message.get("stream") == "stderr" else "stdout"
+            if pending.on_chunk is not None:
+                await pending.on_chunk(stream_name, message.get("data", ""))
+            else:
+                getattr(pending, stream_name).append(message.get("data", ""))
+        elif kind == "file":
+            pending.files.setdefault(int(message["index"]), []).append(base64.b64decode(message.get("data", "")))
+        elif kind == "end":
+            connection.pending.pop(message["id"], None)
+            if not pending.future.done():
+                pending.future.set_result(message)
+
+    async def execute(
+        self,
+        agent_id: str,
+        command_tokens: Sequence[str],
+        timeout: float,
+        priority: int,
+        user: Optional[str],
+        upload: Sequence[int] = (),
+        download: Sequence[int] = (),
+    ) -> Dict[str, Any]:
+        """Run an adb command on an agent; returns returncode/stdout/stderr like `run_async`.
+
+        Tokens at the `upload` indexes are local files sent ahead of the
+        command in `upload` frames; those at the `download` indexes are local
+        paths the agent's output files are written to.
+        """
+        if agent_id not in self._agents:
+            pending, end = await self._relay(agent_id, command_tokens, timeout, {
+                "op": "exec",
+                "timeout": timeout,
+                "priority": priority,
+                "user": user,
+                "upload": list(upload),
+                "download": list(download),
+            })
+            self._raise_for_error(command_tokens, end)
+            return {
+                "returncode": end.get("returncode"),
+                "stdout": "".join(pending.stdout),
+                "stderr": "".join(pending.stderr),
+            }
+        return await self._execute_local(agent_id, command_tokens, timeout, priority, user, upload, download)
+
+    async def _execute_local(
+        self,
+        agent_id: str,
+        command_tokens: Sequence[str],
+        timeout: float,
+        priority: int,
+        user: Optional[str],
+        upload: Sequence[int] = (),
+        download: Sequence[int] = (),
+    ) -> Dict[str, Any]:
+        connection = self._agents.get(agent_id)
+        if connection is None:
+            raise AgentCommandError(AGENT_ERROR_DISCONNECTED, f"Agent {agent_id} is not connected")
+        command_id = f"c{next(self._ids)}"
+        try:
+            for index in upload:
+                await self._send_file(connection, command_id, index, command_tokens[index])
+        except BaseException:
+            # Let the agent drop what it received so far
+            try:
+                await connection.send({"type": "cancel", "id": command_id})
+            except Exception:
+                pass
+            raise
+        pending, end = await self._request(agent_id, command_tokens, timeout, {
+            "type": "exec",
+            "timeout": timeout,
+            "priority": priority,
+            "user": user,
+            "upload": list(upload),
+            "download": list(download),
+        }, command_id=command_id)
+        self._raise_for_error(command_tokens, end)
+        for index in download:
+            with open(command_tokens[index], "wb") as handle:
+                handle.write(b"".join(pending.files.get(index, [])))
+        return {
+            "returncode": end.get("returncode"),
+            "stdout": "".join(pending.stdout) + end.get("stdout", ""),
+            "stderr": "".join(pending.stderr) + end.get("stderr", ""),
+        }
+
+    def execute_sync(self, agent_id: str, command_tokens: Sequence[str], timeout: float, priority: int,
+                     user: Optional[str], upload: Sequence[int] = (), download: Sequence[int] = ()) -> Dict[str, Any]:
+        """Blocking `execute` for worker threads; must not be called on the event loop thread."""
+        loop = self.loop or self.bus.loop
+        if loop is None or not self.alive(agent_id):
+            raise AgentCommandError(AGENT_ERROR_DISCONNECTED, f"Agent {agent_id} is not connected")
+        future = asyncio.run_coroutine_threadsafe(
+            self.execute(agent_id, command_tokens, timeout, priority, user, upload, download), loop
+        )
+        return future.result()
+
+    async def stream(
+        self,
+        agent_id: str,
+        command_tokens: Sequence[str],
+        on_chunk: Callable[[str, str], Awaitable[None]],
+        cancel_event: asyncio.Event,
+        max_output_bytes: int,
+        priority: int,
+        user: Optional[str],
+    ) -> Dict[str, Any]:
+        """Streaming terminal command on an agent, with the same result shape as `stream_process_output`."""
+        if agent_id not in self._agents:
+            _, end = await self._relay(agent_id, command_tokens, None, {
+                "op": "stream",
+                "priority": priority,
+                "user": user,
+                "max_output_bytes": max_output_bytes,
+            }, on_chunk=on_chunk, cancel_event=cancel_event)
+        else:
+            end = await self._stream_local(
+                agent_id, command_tokens, on_chunk, cancel_event, max_output_bytes, priority, user
+            )
+        if end.get("error"):
+            raise AgentCommandError(end["error"], end.get("message") or end["error"])
+        return {key: end.get(key) for key in ("returncode", "stdout", "stderr", "status", "output_bytes")}
+
+    async def _stream_local(
+        self,
+        agent_id: str,
+        command_tokens: Sequence[str],
+        on_chunk: Callable[[str, str], Awaitable[None]],
+        cancel_event: asyncio.Event,
+        max_output_bytes: int,
+        priority: int,
+        user: Optional[str],
+    ) -> Dict[str, Any]:
+        connection = self._agents.get(agent_id)
+        if connection is None:
+            raise AgentCommandError(AGENT_ERROR_DISCONNECTED, f"Agent {agent_id} is not connected")
+        command_id = f"c{next(self._ids)}"
+
+        async def forward_cancel() -> None:
+            await cancel_event.wait()
+            if command_id in connection.pending:
+                await connection.send({"type": "cancel", "id": command_id})
+
+        watcher = asyncio.create_task(forward_cancel())
+        try:
+            _, end = await self._request(agent_id, command_tokens, None, {
+                "type": "stream",
+                "priority": priority,
+                "user": user,
+                "max_output_bytes": max_output_bytes,
+            }, command_id=command_id, on_chunk=on_chunk)
+        finally:
+            watcher.cancel()
+        return end
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            owned: Dict[str, int] = {}
+            for agent_id in self._owners.values():
+                owned[agent_id] = owned.get(agent_id, 0) + 1
+        agents = [
+            {
+                "agent_id": connection.agent_id,
+                "host": connection.host,
+                "connected_at": connection.connected_at,
+                "last_snapshot_at": connection.last_snapshot_at,
+                "device_count": connection.device_count,
+                "commands_total": connection.commands_total,
+                "commands_in_flight": len(connection.pending),
+            }
+            for connection in self._agents.values()
+        ]
+        db = self.session_factory()
+        try:
+            heartbeats = db.query(AgentHeartbeat).order_by(AgentHeartbeat.agent_id).all()
+        finally:
+            db.close()
+        cutoff = datetime.utcnow() - timedelta(seconds=AGENT_HEARTBEAT_TTL_SECONDS)
+        return {
+            "enabled": bool(AGENT_TOKEN),
+            "worker_id": self.worker_id,
+            "agents": agents,
+            "heartbeats": [
+                {
+                    "agent_id": heartbeat.agent_id,
+                    "worker_id": heartbeat.worker_id,
+                    "host": heartbeat.host,
+                    "connected_at": heartbeat.connected_at,
+                    "last_seen_at": heartbeat.last_seen_at,
+                    "alive": heartbeat.last_seen_at is not None and heartbeat.last_seen_at >= cutoff,
+                }
+                for heartbeat in heartbeats
+            ],
+            "owned_devices": owned,
+            "relays_in_flight": len(self._relays),
+            "relays_served_in_flight": len(self._served),
+        }
+
+    async def handle_relay(self, event: Dict[str, Any]) -> None:
+        """Event bus handler for AGENT_RELAY_EVENT events; ignores those addressed to other workers."""
+        if event.get("to") != self.worker_id:
+            return
+        op = event.get("op")
+        if op in ("chunk", "end"):
+            pending = self._relays.get(event.get("id"))
+            if pending is not None:
+                # Queued without awaiting, so output is consumed in the order it was published
+                pending.events.put_nowait(event)
+        elif op in ("exec", "stream"):
+            key = (event["from"], event["id"])
+            cancel_event = asyncio.Event()
+            task = asyncio.create_task(self._serve_relay(event, cancel_event))
+            self._served[key] = (task, cancel_event)
+            task.add_done_callback(lambda _: self._served.pop(key, None))
+        elif op == "cancel":
+            served = self._served.get((event.get("from"), event.get("id")))
+            if served is not None:
+                task, cancel_event = served
+                # A stream ends itself on cancel and still reports what ran; a one-shot command is just abandoned
+                if event.get("stream"):
+                    cancel_event.set()
+                else:
+                    task.cancel()
+
+    async def _relay(
+        self,
+        agent_id: str,
+        command_tokens: Sequence[str],
+        timeout: Optional[float],
+        request: Dict[str, Any],
+        on_chunk: Optional[Callable[[str, str], Awaitable[None]]] = None,
+        cancel_event: Optional[asyncio.Event] = None,
+    ) -> Tuple[_PendingRelay, Dict[str, Any]]:
+        """Run a command on an agent attached to another worker through that worker."""
+        with self._lock:
+            worker_id = self._live.get(agent_id)
+        if worker_id is None or worker_id == self.worker_id:
+            raise AgentCommandError(AGENT_ERROR_DISCONNECTED, f"Agent {agent_id} is not connected")
+        if self.bus.backend == "memory":
+            raise AgentCommandError(
+                AGENT_ERROR_UNAVAILABLE,
+                f"Agent {agent_id} is connected to worker {worker_id}, which this process cannot reach "
+                "over an in-process event bus; set EVENT_BUS_BACKEND=unix",
+            )
+        relay_id = f"r{next(self._ids)}"
+        pending = self._relays[relay_id] = _PendingRelay()
+        streaming = request["op"] == "stream"
+
+        async def forward_cancel() -> None:
+            await cancel_event.wait()
+            self._publish_relay(worker_id, relay_id, op="cancel", stream=True)
+
+        async def drain() -> Dict[str, Any]:
+            while True:
+                event = await pending.events.get()
+                if event["op"] == "end":
+                    return event
+                stream_name = "stderr" if event.get("stream") == "stderr" else "stdout"
+                if on_chunk is not None:
+                    await on_chunk(stream_name, event.get("data", ""))
+                else:
+                    getattr(pending, stream_name).append(event.get("data", ""))
+
+        watcher = asyncio.create_task(forward_cancel()) if cancel_event is not None else None
+        try:
+            self._publish_relay(worker_id, relay_id, agent_id=agent_id, tokens=list(command_tokens), **request)
+            # The owning worker answers within the agent's grace period; allow it the same again for the hop
+            wait_for = timeout + 2 * AGENT_RESULT_GRACE_SECONDS if timeout is not None else None
+            end = await asyncio.wait_for(drain(), wait_for)
+        except BaseException as exc:
+            self._publish_relay(worker_id, relay_id, op="cancel", stream=streaming)
+            if isinstance(exc, asyncio.TimeoutError):
+                raise AgentCommandError(
+                    AGENT_ERROR_DISCONNECTED, f"Agent {agent_id} did not answer in time through worker {worker_id}"
+                ) from None
+            raise
+        finally:
+            self._relays.pop(relay_id, None)
+            if watcher is not None:
+                watcher.cancel()
+        return pending, end
+
+    async def _serve_relay(self, event: Dict[str, Any], cancel_event: asyncio.Event) -> None:
+        """Run a relayed command on the local agent connection and publish its output back."""
+        requester, relay_id, tokens = event["from"], event["id"], event["tokens"]
+
+        async def forward_chunk(stream_name: str, data: str) -> None:
+            self._publish_relay(requester, relay_id, op="chunk", stream=stream_name, data=data)
+
+        try:
+            if event["op"] == "exec":
+                output = await self._execute_local(
+                    event["agent_id"], tokens, event["timeout"], event["priority"], event.get("user"),
+                    event.get("upload", ()), event.get("download", ()),
+                )
+                # Sent in pieces: a single event the size of a large listing could exceed the bus's line limit
+                for stream_name in ("stdout", "stderr"):
+                    text = output[stream_name]
+                    for start in range(0, len(text), AGENT_CHUNK_CHARS):
+                        await forward_chunk(stream_name, text[start:start + AGENT_CHUNK_CHARS])
+                end = {"returncode": output["returncode"]}
+            else:
+                result = await self._stream_local(
+                    event["agent_id"], tokens, forward_chunk, cancel_event,
+                    event["max_output_bytes"], event["priority"], event.get("user"),
+                )
+                end = {key: result.get(key) for key in AGENT_STREAM_END_KEYS}
+        except asyncio.CancelledError:
+            return
+        except subprocess.TimeoutExpired as exc:
+            end = {"error": AGENT_ERROR_TIMEOUT, "timeout": exc.timeout}
+        except AgentCommandError as exc:
+            end = {"error": exc.kind, "message": str(exc), "retry_in": exc.retry_in}
+        except Exception as exc:
+            logger.exception("Relayed command for agent %s failed", event.get("agent_id"))
+            end = {"error": AGENT_ERROR_FAILED, "message": str(exc)}
+        self._publish_relay(requester, relay_id, **{**end, "op": "end"})
+
+    def _publish_relay(self, worker_id: str, relay_id: str, **fields: Any) -> None:
+        self.bus.publish({"type": AGENT_RELAY_EVENT, "to": worker_id, "from": self.worker_id, "id": relay_id, **fields})
+
+    async def _request(
+        self,
+        agent_id: str,
+        command_tokens: Sequence[str],
+        timeout: Optional[float],
+        message: Dict[str, Any],
+        command_id: Optional[str] = None,
+        on_chunk: Optional[Callable[[str, str], Awaitable[None]]] = None,
+    ):
+        connection = self._agents.get(agent_id)
+        if connection is None:
+            raise AgentCommandError(AGENT_ERROR_DISCONNECTED, f"Agent {agent_id} is not connected")
+        command_id = command_id or f"c{next(self._ids)}"
+        pending = _PendingCommand(command_tokens, asyncio.get_running_loop().create_future(), on_chunk)
+        connection.pending[command_id] = pending
+        connection.commands_total += 1
+        try:
+            await connection.send({**message, "id": command_id, "tokens": list(command_tokens)})
+            wait_for = timeout + AGENT_RESULT_GRACE_SECONDS if timeout is not None else None
+            end = await asyncio.wait_for(asyncio.shield(pending.future), wait_for)
+        except BaseException as exc:
+            if connection.pending.pop(command_id, None) is not None and self._agents.get(agent_id) is connection:
+                try:
+                    await connection.send({"type": "cancel", "id": command_id})
+                except Exception:
+                    pass
+            if isinstance(exc, asyncio.TimeoutError):
+                raise AgentCommandError(AGENT_ERROR_DISCONNECTED, f"Agent {agent_id} did not answer in time") from None
+            raise
+        return pending, end
+
+    @staticmethod
+    async def _send_file(connection: AgentConnection, command_id: str, index: int, path: str) -> None:
+        """Stream a local file to an agent in AGENT_CHUNK_CHARS pieces, reading it on a worker thread."""
+        loop = asyncio.get_running_loop()
+        handle = await loop.run_in_executor(None, open, path, "rb")
+        try:
+            while True:
+                data = await loop.run_in_executor(None, handle.read, AGENT_CHUNK_CHARS)
+                if not data:
+                    break
+                await connection.send({
+                    "type": "upload", "id": command_id, "index": index,
+                    "data": base64.b64encode(data).decode("ascii"),
+                })
+        finally:
+            handle.close()
+
+    @staticmethod
+    def _raise_for_error(command_tokens: Sequence[str], end: Dict[str, Any]) -> None:
+        error = end.get("error")
+        if not error:
+            return
+        if error == AGENT_ERROR_TIMEOUT:
+            raise subprocess.TimeoutExpired(list(command_tokens), end.get("timeout") or 0)
+        raise AgentCommandError(error, end.get("message") or error, end.get("retry_in") or AGENT_RECONNECT_RETRY_SECONDS)
+
+    @staticmethod
+    def _fail_pending(connection: AgentConnection, kind: str, message: str) -> None:
+        for pending in connection.pending.values():
+            if not pending.future.done():
+                pending.future.set_exception(AgentCommandError(kind, message))
+        connection.pending.clear()
+
+
+agent_hub = AgentHub()
@@ -0,0 +1,214 @@
+"""Background writer that batches device usage-log inserts."""
+import logging
+import queue
+import threading
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+from database import SessionLocal, DeviceUsageLog as DBDeviceUsageLog
+
+logger = logging.getLogger(__name__)
+
+AUDIT_BATCH_SIZE = 200
+AUDIT_FLUSH_INTERVAL_SECONDS = 1.0
+AUDIT_QUEUE_MAX_ROWS = 10000
+AUDIT_RETRY_BACKOFF_SECONDS = (0.5, 1.0, 2.0, 5.0)
+AUDIT_SHUTDOWN_TIMEOUT_SECONDS = 10.0
+
+
+class AuditLogWriter:
+    """Queue usage-log rows in memory and insert them in batched transactions.
+
+    Rows are committed when AUDIT_BATCH_SIZE rows are pending or
+    AUDIT_FLUSH_INTERVAL_SECONDS have passed, whichever comes first. Failed
+    batches are retried with backoff and never dropped while the writer runs;
+    `stop()` drains everything still queued before returning. When the writer
+    thread is not running (scripts, tests), rows are written synchronously.
+    """
+
+    def __init__(
+        self,
+        session_factory: Callable = SessionLocal,
+        batch_size: int = AUDIT_BATCH_SIZE,
+        flush_interval: float = AUDIT_FLUSH_INTERVAL_SECONDS,
+        max_queue_rows: int = AUDIT_QUEUE_MAX_ROWS,
+    ) -> None:
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue: "queue.Queue[Dict[str, Any]]" = queue.Queue(maxsize=max_queue_rows)
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+        self._flush_requested = threading.Event()
+        self._written_cond = threading.Condition()
+        self._stats_lock = threading.Lock()
+        # Rows handed to the writer thread; synchronous inserts are counted in _sync_writes once committed
+        self._enqueued = 0
+        self._written = 0
+        self._batches = 0
+        self._failures = 0
+        self._sync_writes = 0
+        self._last_flush_ms: Optional[float] = None
+        self._max_flush_ms = 0.0
+        self._total_flush_ms = 0.0
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> None:
+        if self.running:
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="audit-log-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = AUDIT_SHUTDOWN_TIMEOUT_SECONDS) -> None:
+        """Stop the writer after every queued row has been committed."""
+        if not self.running:
+            return
+        self._stopping.set()
+        self._flush_requested.set()
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            logger.error("Audit log writer did not finish within %.1fs; %d rows pending",
+                         timeout, self._queue.qsize())
+        self._thread = None
+
+    def enqueue(
+        self,
+        device_id: int,
+        user_id: int,
+        action: str,
+        notes: Optional[str] = None,
+        timestamp: Optional[datetime] = None,
+    ) -> None:
+        row = {
+            "device_id": device_id,
+            "user_id": user_id,
+            "action": action,
+            "notes": notes,
+            "timestamp": timestamp or datetime.utcnow(),
+        }
+        if not self.running:
+            self._write_sync([row])
+            return
+
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            # Backpressure instead of loss: the caller pays for the insert itself
+            self._write_sync([row])
+            return
+        # Counted only once queued, so a failed synchronous insert never leaves flush() waiting for it
+        with self._stats_lock:
+            self._enqueued += 1
+
+        if self._queue.qsize() >= self.batch_size:
+            self._flush_requested.set()
+
+    def flush(self, timeout: float = 2.0) -> bool:
+        """Block until rows enqueued so far are committed. Returns False on timeout."""
+        if not self.running:
+            return True
+        with self._stats_lock:
+            target = self._enqueued
+        deadline = time.monotonic() + timeout
+        self._flush_requested.set()
+        with self._written_cond:
+            while self._written < target:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._written_cond.wait(remaining)
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            return {
+                "running": self.running,
+                "queue_depth": self._queue.qsize(),
+                "queue_capacity": self._queue.maxsize,
+                "enqueued_total": self._enqueued + self._sync_writes,
+                "written_total": self._written,
+                "sync_writes_total": self._sync_writes,
+                "batches_total": self._batches,
+                "failed_batches_total": self._failures,
+                "last_flush_ms": self._last_flush_ms,
+                "max_flush_ms": round(self._max_flush_ms, 3),
+                "avg_flush_ms": round(self._total_flush_ms / self._batches, 3) if self._batches else None,
+            }
+
+    def _write_sync(self, rows: List[Dict[str, Any]]) -> None:
+        self._insert(rows)
+        with self._stats_lock:
+            self._sync_writes += len(rows)
+
+    def _insert(self, rows: List[Dict[str, Any]]) -> None:
+        db = self.session_factory()
+        try:
+            db.bulk_insert_mappings(DBDeviceUsageLog, rows)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def _drain(self) -> List[Dict[str, Any]]:
+        rows: List[Dict[str, Any]] = []
+        while len(rows) < self.batch_size:
+            try:
+                rows.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return rows
+
+    def _commit_batch(self, rows: List[Dict[str, Any]]) -> None:
+        attempt = 0
+        while True:
+            started = time.perf_counter()
+            try:
+                self._insert(rows)
+            except Exception as exc:
+                with self._stats_lock:
+                    self._failures += 1
+                if self._stopping.is_set() and attempt >= len(AUDIT_RETRY_BACKOFF_SECONDS):
+                    logger.error("Dropping %d audit log rows after repeated failures: %s", len(rows), exc)
+                    return
+                delay = AUDIT_RETRY_BACKOFF_SECONDS[min(attempt, len(AUDIT_RETRY_BACKOFF_SECONDS) - 1)]
+                logger.warning("Audit log flush failed (%s); retrying in %.1fs", exc, delay)
+                attempt += 1
+                time.sleep(delay)
+                continue
+
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            with self._stats_lock:
+                self._batches += 1
+                self._last_flush_ms = round(elapsed_ms, 3)
+                self._max_flush_ms = max(self._max_flush_ms, elapsed_ms)
+                self._total_flush_ms += elapsed_ms
+            with self._written_cond:
+                self._written += len(rows)
+                self._written_cond.notify_all()
+            return
+
+    def _run(self) -> None:
+        while True:
+            self._flush_requested.wait(self.flush_interval)
+            self._flush_requested.clear()
+
+            while True:
+                rows = self._drain()
+                if not rows:
+                    break
+                self._commit_batch(rows)
+                if len(rows) < self.batch_size:
+                    break
+
+            if self._stopping.is_set() and self._queue.empty():
+                return
+
+
+audit_writer = AuditLogWriter()
@@ -0,0 +1,582 @@
+#!/usr/bin/env python3
+"""Benchmarks of the scan and API hot paths against a simulated adb fleet.
+
+A fake `adb` stands in for N devices with configurable per-call latency,
+Bluetooth peers, offline devices and failing devices. The suite times full
+scans (`update_devices_in_db`) in this process, then starts the API under
+uvicorn on the scanned database and load-tests `/api/devices` (full and
+summary views), `/api/devices/stats`, usage log paging and the terminal
+WebSocket. Finally it grows the devices table to 1k and 10k rows and times
+building the device list body, with and without cached device fragments.
+
+Results are printed (or written with --output) as JSON with throughput and
+latency percentiles; --compare prints the change against an earlier result,
+so runs on two commits can be compared with the same fleet settings.
+
+Usage:
+    python benchmark.py [--devices 50] [--latency-ms 20] [--bt-peers 4] [--failure-rate 0.05]
+                        [--list-sizes 1000,10000]
+                        [--output results.json] [--compare baseline.json]
+"""
+import argparse
+import asyncio
+import http.client
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional
+
+import websockets
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+BENCHMARK_TIMEOUT_SECONDS = 60
+BENCHMARK_PERCENTILES = (50, 90, 99)
+
+# adb stand-in for the whole fleet; the settings and the offline and failing
+# device indexes are read from fleet.json next to it.
+FAKE_ADB = r'''#!%(python)s -S
+import json, os, random, re, subprocess, sys, time
+
+with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "fleet.json")) as handle:
+    FLEET = json.load(handle)
+OFFLINE = set(FLEET["offline"])
+FAILING = set(FLEET["failing"])
+
+
+def serial(index):
+    return f"BENCH-{index:05d}"
+
+
+def peer_mac(index, peer):
+    return f"B7:{index >> 16 & 255:02X}:{index >> 8 & 255:02X}:{index & 255:02X}:00:{peer:02X}"
+
+
+def peer_info(index, peer):
+    connected = "yes" if peer %% 2 == 0 else "no"
+    return (
+        f"Device {peer_mac(index, peer)} (public)\n\tName: Bench Remote {peer}\n\tAlias: Bench Remote {peer}\n"
+        f"\tClass: 0x00240404\n\tIcon: audio-card\n\tPaired: yes\n\tTrusted: yes\n\tBlocked: no\n"
+        f"\tConnected: {connected}\n\tLegacyPairing: no\n"
+        f"\tUUID: Audio Sink                (0000110b-0000-1000-8000-00805f9b34fb)\n"
+        f"\tUUID: A/V Remote Control        (0000110e-0000-1000-8000-00805f9b34fb)\n"
+        f"\tModalias: bluetooth:v004Cp2010d0100\n\tRSSI: -{40 + peer}\n\tTxPower: 4\n"
+    )
+
+
+def shell(index, command):
+    peers = FLEET["bt_peers"]
+    if command.startswith("bluetoothctl show"):
+        return f"Controller 00:1A:7D:{index >> 8 & 255:02X}:{index & 255:02X}:01 (public)\n\tName: bench\n\tAlias: Bench {index}\n\tPowered: yes\n\tDiscoverable: no\n"
+    if command.startswith("bluetoothctl devices"):
+        wanted = range(0, peers, 2) if "Connected" in command else range(peers)
+        return "".join(f"Device {peer_mac(index, peer)} Bench Remote {peer}\n" for peer in wanted)
+    if command.startswith("bluetoothctl info"):
+        # One or several `bluetoothctl info <mac>` separated by `;`
+        macs = [part.split()[-1] for part in command.split(";")]
+        return "".join(peer_info(index, peer) for mac in macs for peer in range(peers) if peer_mac(index, peer) == mac)
+    if command.startswith("cat /data/misc/wifi/"):
+        return f"interface=wlan0\nssid=BENCH_AP_{index}\nwpa_passphrase=bench-{index}\n"
+    if command == "cat /proc/uptime":
+        return f"{3600 + index}.42 1234.56\n"
+    if command == "ql-getversion":
+        return (
+            "build info start\nbuild info version 1.0.0\nbuild info branch master\nbuild info end\n"
+            "getallversion version:camera_soc:1.0.0,camera_mcu:2.0.0,cabin_soc:3.0.0,cabin_mcu:4.0.0\n"
+        )
+    sections = re.findall(r"echo (\S+) '?([^;']+?)'?; df -k", command)
+    if sections:
+        output = "/dev/block/dm-0 / ext4 ro 0 0\n/dev/block/dm-5 /data ext4 rw 0 0\n" if command.startswith("mount;") else ""
+        for marker, path in sections:
+            output += f"{marker} {path}\nFilesystem 1K-blocks Used Available Use%% Mounted on\n"
+            output += f"/dev/block/dm-{len(path)} 8388608 {1048576 + index * 997 %% 4194304} 4194304 40%% {path}\n"
+        return output
+    return None
+
+
+args = sys.argv[1:]
+device = None
+while args and args[0].startswith("-"):
+    if args[0] == "-s":
+        device = args[1]
+    args = args[2:]
+
+latency = FLEET["latency_ms"] + random.uniform(-FLEET["jitter_ms"], FLEET["jitter_ms"])
+time.sleep(max(0.0, latency) / 1000)
+
+if not args or args[0] != "shell" or device is None:
+    if args[:1] == ["devices"]:
+        print("List of devices attached")
+        for index in range(1, FLEET["devices"] + 1):
+            state = "offline" if index in OFFLINE else "device"
+            print(f"{serial(index)} {state} usb:1-{index} product:bench model:Bench_{index %% 4} device:bench transport_id:{index}")
+    sys.exit(0)
+
+index = int(device.rsplit("-", 1)[-1])
+if index in FAILING:
+    sys.stderr.write("error: closed\n")
+    sys.exit(1)
+
+command = " ".join(args[1:])
+output = shell(index, command)
+if output is None:
+    sys.exit(subprocess.call(["sh", "-c", command]))
+sys.stdout.write(output)
+'''
+
+
+def _device_sample(index: int, salt: str) -> float:
+    """Stable pseudo-random fraction per device, so equal settings always simulate the same fleet."""
+    return zlib.crc32(f"{salt}:{index}".encode()) % 10000 / 10000
+
+
+def _simulated_fleet(fleet: Dict[str, Any]) -> Dict[str, Any]:
+    """Fleet settings plus the indexes of the devices that are listed offline and that fail."""
+    indexes = range(1, fleet["devices"] + 1)
+    return {
+        **fleet,
+        "offline": [index for index in indexes if _device_sample(index, "offline") < fleet["offline_rate"]],
+        "failing": [index for index in indexes if _device_sample(index, "fail") < fleet["failure_rate"]],
+    }
+
+
+def _write_fake_adb(directory: str, simulated: Dict[str, Any]) -> str:
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, "fleet.json"), "w") as handle:
+        json.dump(simulated, handle)
+    path = os.path.join(directory, "adb")
+    with open(path, "w") as handle:
+        handle.write(FAKE_ADB % {"python": sys.executable})
+    os.chmod(path, 0o755)
+    return directory
+
+
+def _percentile(ordered: List[float], percentile: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not ordered:
+        return 0.0
+    rank = max(0, min(len(ordered) - 1, int(round(percentile / 100 * len(ordered))) - 1))
+    return ordered[rank]
+
+
+def _summarize(latencies: List[float], wall_seconds: float, errors: int = 0, **extra: Any) -> Dict[str, Any]:
+    """Throughput and latency percentiles (milliseconds) of one benchmark."""
+    ordered = sorted(latencies)
+    summary: Dict[str, Any] = {
+        **extra,
+        "count": len(ordered),
+        "errors": errors,
+        "wall_seconds": round(wall_seconds, 3),
+        "throughput_per_second": round(len(ordered) / wall_seconds, 2) if wall_seconds > 0 else None,
+        "latency_ms": {
+            **{f"p{p}": round(_percentile(ordered, p) * 1000, 3) for p in BENCHMARK_PERCENTILES},
+            "mean": round(sum(ordered) / len(ordered) * 1000, 3) if ordered else 0.0,
+            "max": round(ordered[-1] * 1000, 3) if ordered else 0.0,
+        },
+    }
+    return summary
+
+
+def _prepare_database() -> str:
+    """Create the admin user in this directory's database and mint a token for it."""
+    from auth import create_access_token
+    from database import SessionLocal, User, create_tables
+
+    create_tables()
+    db = SessionLocal()
+    try:
+        if not db.query(User).filter(User.username == "admin").first():
+            # The benchmark only uses tokens, so the account gets no usable password
+            db.add(User(username="admin", email="admin@example.com", hashed_password="!", role="admin"))
+            db.commit()
+    finally:
+        db.close()
+    return create_access_token({"sub": "admin"})
+
+
+def _seed_usage_logs(device_id: str, rows: int) -> None:
+    """Give one device `rows` usage log entries to page through."""
+    from database import Device, DeviceUsageLog, SessionLocal, User
+
+    db = SessionLocal()
+    try:
+        device = db.query(Device).filter(Device.device_id == device_id).one()
+        admin = db.query(User).filter(User.username == "admin").one()
+        start = datetime.utcnow() - timedelta(days=7)
+        db.bulk_insert_mappings(DeviceUsageLog, [
+            {
+                "device_id": device.id,
+                "user_id": admin.id,
+                "action": "occupy" if row % 2 == 0 else "release",
+                "timestamp": start + timedelta(seconds=row * 30),
+                "notes": f"benchmark entry {row}",
+            }
+            for row in range(rows)
+        ])
+        db.commit()
+    finally:
+        db.close()
+
+
+def bench_scan(runs: int) -> Dict[str, Any]:
+    """Time full scans in this process; the first run populates the database and is not counted."""
+    from main_enhanced import update_devices_in_db
+
+    update_devices_in_db()
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(runs):
+        run_started = time.perf_counter()
+        update_devices_in_db()
+        latencies.append(time.perf_counter() - run_started)
+    return _summarize(latencies, time.perf_counter() - started, runs=runs)
+
+
+# `bluetoothctl info` of one seeded peer, as a real scan stores it
+SEEDED_PEER_INFO = (
+    "Device {mac} (public)\n\tName: {name}\n\tAlias: {name}\n\tClass: 0x00240404\n\tIcon: audio-card\n"
+    "\tPaired: yes\n\tTrusted: yes\n\tBlocked: no\n\tConnected: {connected}\n\tLegacyPairing: no\n"
+    "\tUUID: Audio Sink                (0000110b-0000-1000-8000-00805f9b34fb)\n"
+    "\tUUID: A/V Remote Control Target (0000110c-0000-1000-8000-00805f9b34fb)\n"
+    "\tUUID: A/V Remote Control        (0000110e-0000-1000-8000-00805f9b34fb)\n"
+    "\tUUID: Handsfree                 (0000111e-0000-1000-8000-00805f9b34fb)\n"
+    "\tManufacturerData Key: 0x004c\n\tManufacturerData Value:\n"
+    "  07 19 01 0f 20 2b 77 8f 01 00 05 5a 1d 4c 8a 3b  .... +w....Z.L.;\n"
+    "\tModalias: bluetooth:v004Cp2010d0100\n\tRSSI: -58\n\tTxPower: 4\n"
+)
+
+
+def _seed_devices(total: int) -> None:
+    """Top the devices table up to `total` rows shaped like scanned ones: each ADB host with four Bluetooth peers."""
+    from database import Device, SessionLocal, User
+    from parsers import parse_bluetoothctl_info
+
+    db = SessionLocal()
+    try:
+        admin = db.query(User).filter(User.username == "admin").one()
+        now = datetime.utcnow()
+        rows = []
+        for index in range(db.query(Device).count(), total):
+            host = f"LIST-{index - index % 5:06d}"
+            row = {"status": "online", "last_seen": now, "created_at": now, "tags": json.dumps(["bench"])}
+            if index % 5 == 0:
+                row.update(device_id=host, device_type="adb", name=f"Camera Device {host}", connection_info=json.dumps({
+                    "adb_status": "device",
+                    "bluetooth_info": {"name": host, "alias": host, "powered": True},
+                    "wifi_ap_info": {"config_found": True, "ap_name": f"AP-{host}", "ap_password": "benchmark"},
+                }))
+                if index % 10 == 0:
+                    row.update(status="occupied", occupied_by=admin.id, occupied_at=now)
+            else:
+                mac = f"B8:{index >> 16 & 255:02X}:{index >> 8 & 255:02X}:{index & 255:02X}:00:01"
+                raw_output = SEEDED_PEER_INFO.format(mac=mac, name=f"Remote {index}", connected="yes")
+                row.update(device_id=mac, device_type="bluetooth", name=f"Remote {index}", connection_info=json.dumps({
+                    "adb_host": host,
+                    "bluetooth_info": parse_bluetoothctl_info(raw_output),
+                    "raw_output": raw_output,
+                }))
+            rows.append(row)
+        db.bulk_insert_mappings(Device, rows)
+        db.commit()
+    finally:
+        db.close()
+
+
+def bench_device_list(sizes: List[int], runs: int) -> Dict[str, Dict[str, Any]]:
+    """Time building the /api/devices body for the whole fleet at each size, in this process.
+
+    `cold` drops every device fragment first (each device changed since the
+    last list); `warm` lists an unchanged fleet. The fleet response cache
+    in front of this (ETag / 304) is not involved.
+    """
+    from database import SessionLocal
+    from device_fragments import device_fragments
+    from main_enhanced import _build_device_list, _device_list_fields, fleet_freshness
+
+    results = {}
+    freshness = fleet_freshness()
+    for size in sizes:
+        _seed_devices(size)
+        for view in ("full", "summary"):
+            fields = _device_list_fields(view, None)
+            for state in ("cold", "warm"):
+                latencies = []
+                body = b""
+                started = time.perf_counter()
+                for _ in range(runs):
+                    if state == "cold":
+                        device_fragments.clear()
+                    db = SessionLocal()
+                    try:
+                        run_started = time.perf_counter()
+                        body = _build_device_list(db, None, None, None, None, None, 0, size, fields, freshness)
+                        latencies.append(time.perf_counter() - run_started)
+                    finally:
+                        db.close()
+                results[f"device list {view}, {size} devices ({state})"] = _summarize(
+                    latencies, time.perf_counter() - started, devices=len(json.loads(body)), response_bytes=len(body)
+                )
+    return results
+
+
+def bench_http(
+    base_url: str,
+    token: str,
+    paths: Callable[[int], str],
+    requests: int,
+    concurrency: int,
+) -> Dict[str, Any]:
+    """Issue `requests` GETs over `concurrency` keep-alive connections; `paths(n)` gives the n-th path."""
+    host, port = base_url.split("//", 1)[1].split(":")
+    headers = {"Authorization": f"Bearer {token}"}
+    latencies: List[float] = []
+    errors = [0]
+    sizes: List[int] = []
+    lock = threading.Lock()
+    counter = iter(range(requests))
+
+    def worker() -> None:
+        connection = http.client.HTTPConnection(host, int(port), timeout=BENCHMARK_TIMEOUT_SECONDS)
+        try:
+            while True:
+                with lock:
+                    number = next(counter, None)
+                if number is None:
+                    return
+                request_started = time.perf_counter()
+                connection.request("GET", paths(number), headers=headers)
+                response = connection.getresponse()
+                body = response.read()
+                elapsed = time.perf_counter() - request_started
+                with lock:
+                    latencies.append(elapsed)
+                    sizes.append(len(body))
+                    if response.status != 200:
+                        errors[0] += 1
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return _summarize(
+        latencies, time.perf_counter() - started, errors[0],
+        concurrency=concurrency,
+        response_bytes=round(sum(sizes) / len(sizes)) if sizes else 0,
+    )
+
+
+async def _terminal_session(base_ws: str, token: str, device_id: str, commands: int, latencies: List[float]) -> int:
+    errors = 0
+    async with websockets.connect(f"{base_ws}/ws/devices/{device_id}/terminal?token={token}") as websocket:
+        ready = json.loads(await websocket.recv())
+        if ready.get("type") != "ready":
+            return commands
+        for _ in range(commands):
+            started = time.perf_counter()
+            await websocket.send(json.dumps({"type": "command", "command": "shell echo benchmark"}))
+            while True:
+                message = json.loads(await websocket.recv())
+                if message["type"] in ("output", "error"):
+                    break
+            latencies.append(time.perf_counter() - started)
+            if message["type"] == "error" or message.get("status") != "success":
+                errors += 1
+    return errors
+
+
+def bench_terminal(base_ws: str, token: str, device_ids: List[str], commands: int) -> Dict[str, Any]:
+    """Round trip of one-shot terminal commands, one WebSocket session per device in parallel."""
+    latencies: List[float] = []
+
+    async def run() -> int:
+        results = await asyncio.gather(*(
+            _terminal_session(base_ws, token, device_id, commands, latencies) for device_id in device_ids
+        ))
+        return sum(results)
+
+    started = time.perf_counter()
+    errors = asyncio.run(run())
+    return _summarize(latencies, time.perf_counter() - started, errors, sessions=len(device_ids))
+
+
+def _wait_for_server(base_url: str, token: str) -> bool:
+    host, port = base_url.split("//", 1)[1].split(":")
+    deadline = time.monotonic() + BENCHMARK_TIMEOUT_SECONDS
+    while time.monotonic() < deadline:
+        try:
+            connection = http.client.HTTPConnection(host, int(port), timeout=5)
+            connection.request("GET", "/api/devices/stats", headers={"Authorization": f"Bearer {token}"})
+            if connection.getresponse().status == 200:
+                return True
+        except OSError:
+            pass
+        time.sleep(0.2)
+    return False
+
+
+def _git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (subprocess.SubprocessError, FileNotFoundError):
+        return None
+
+
+def compare(baseline: Dict[str, Any], current: Dict[str, Any]) -> List[str]:
+    """Lines describing how each benchmark's p50, p99 and throughput moved against `baseline`."""
+    lines = []
+    if baseline.get("fleet") != current.get("fleet"):
+        lines.append("warning: fleet settings differ from the baseline")
+    for name, result in current["benchmarks"].items():
+        before = baseline.get("benchmarks", {}).get(name)
+        if not before:
+            continue
+        changes = []
+        for label, old, new in (
+            ("p50", before["latency_ms"]["p50"], result["latency_ms"]["p50"]),
+            ("p99", before["latency_ms"]["p99"], result["latency_ms"]["p99"]),
+            ("throughput", before["throughput_per_second"], result["throughput_per_second"]),
+        ):
+            if old and new is not None:
+                changes.append(f"{label} {old} -> {new} ({(new - old) / old * 100:+.1f}%)")
+        lines.append(f"{name}: " + ", ".join(changes))
+    return lines
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--devices", type=int, default=50)
+    parser.add_argument("--latency-ms", type=float, default=20, help="mean latency of every fake adb call")
+    parser.add_argument("--jitter-ms", type=float, default=5)
+    parser.add_argument("--bt-peers", type=int, default=4, help="Bluetooth peers per device, half of them connected")
+    parser.add_argument("--offline-rate", type=float, default=0.05, help="fraction of devices listed as offline")
+    parser.add_argument("--failure-rate", type=float, default=0.05, help="fraction of devices whose shell calls fail")
+    parser.add_argument("--scan-runs", type=int, default=3)
+    parser.add_argument("--requests", type=int, default=200, help="requests per HTTP benchmark")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--log-rows", type=int, default=5000)
+    parser.add_argument("--terminal-sessions", type=int, default=4)
+    parser.add_argument("--terminal-commands", type=int, default=20, help="commands per terminal session")
+    parser.add_argument("--list-sizes", default="1000,10000", help="fleet sizes to time device list building at")
+    parser.add_argument("--list-runs", type=int, default=5, help="timed device list builds per size, view and state")
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--output", help="write the JSON results here instead of stdout")
+    parser.add_argument("--compare", help="earlier results JSON to compare against")
+    args = parser.parse_args()
+
+    fleet = {
+        "devices": args.devices,
+        "latency_ms": args.latency_ms,
+        "jitter_ms": args.jitter_ms,
+        "bt_peers": args.bt_peers,
+        "offline_rate": args.offline_rate,
+        "failure_rate": args.failure_rate,
+    }
+    output = os.path.abspath(args.output) if args.output else None
+    baseline = os.path.abspath(args.compare) if args.compare else None
+    workdir = tempfile.mkdtemp(prefix="benchmark-")
+    simulated = _simulated_fleet(fleet)
+    fake_adb = _write_fake_adb(os.path.join(workdir, "adb"), simulated)
+    # The API process only serves requests; the scans under test run here
+    os.environ["PATH"] = f"{fake_adb}:{os.environ['PATH']}"
+    os.environ["SCANNER_MODE"] = "external"
+    os.chdir(workdir)
+    sys.path.insert(0, BACKEND_DIR)
+
+    token = _prepare_database()
+    results: Dict[str, Any] = {
+        "revision": _git_revision(),
+        "started_at": datetime.utcnow().isoformat(),
+        "python": platform.python_version(),
+        "fleet": fleet,
+        "benchmarks": {},
+    }
+    benchmarks = results["benchmarks"]
+    benchmarks["update_devices_in_db"] = bench_scan(args.scan_runs)
+
+    from database import Device, SessionLocal
+
+    db = SessionLocal()
+    try:
+        results["devices_in_db"] = db.query(Device).count()
+        # The terminal and log benchmarks measure the success path, so they skip failing devices
+        healthy = [
+            device.device_id
+            for device in db.query(Device).filter(Device.device_type == "adb", Device.status == "online")
+            if int(device.device_id.rsplit("-", 1)[-1]) not in simulated["failing"]
+        ]
+    finally:
+        db.close()
+    if not healthy:
+        print("No healthy online device to benchmark against", file=sys.stderr)
+        return 1
+    log_device = healthy[0]
+    _seed_usage_logs(log_device, args.log_rows)
+
+    base_url = f"http://127.0.0.1:{args.port}"
+    base_ws = f"ws://127.0.0.1:{args.port}"
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main_enhanced:app", "--port", str(args.port), "--log-level", "warning"],
+        cwd=workdir, env={**os.environ, "PYTHONPATH": BACKEND_DIR},
+    )
+    try:
+        if not _wait_for_server(base_url, token):
+            print("API server did not start", file=sys.stderr)
+            return 1
+        page_size = 50
+        pages = max(1, args.log_rows // page_size)
+        device_limit = results["devices_in_db"]
+        benchmarks["GET /api/devices"] = bench_http(
+            base_url, token, lambda n: f"/api/devices?limit={device_limit}", args.requests, args.concurrency
+        )
+        benchmarks["GET /api/devices?view=summary"] = bench_http(
+            base_url, token, lambda n: f"/api/devices?limit={device_limit}&view=summary", args.requests, args.concurrency
+        )
+        benchmarks["GET /api/devices/stats"] = bench_http(
+            base_url, token, lambda n: "/api/devices/stats", args.requests, args.concurrency
+        )
+        benchmarks["GET /api/devices/{id}/logs"] = bench_http(
+            base_url, token,
+            lambda n: f"/api/devices/{log_device}/logs?skip={n % pages * page_size}&limit={page_size}",
+            args.requests, args.concurrency,
+        )
+        benchmarks["WS /ws/devices/{id}/terminal"] = bench_terminal(
+            base_ws, token, healthy[:args.terminal_sessions], args.terminal_commands
+        )
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            server.kill()
+
+    # Last, since it grows the devices table the API benchmarks above run against
+    list_sizes = [int(size) for size in args.list_sizes.split(",") if size.strip()]
+    benchmarks.update(bench_device_list(list_sizes, args.list_runs))
+
+    report = json.dumps(results, indent=2, default=str)
+    if output:
+        with open(output, "w") as handle:
+            handle.write(report + "\n")
+    else:
+        print(report)
+    if baseline:
+        with open(baseline) as handle:
+            for line in compare(json.load(handle), results):
+                print(line, file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,147 @@
+"""Per-device circuit breakers that stop hammering unresponsive devices."""
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+BREAKER_FAILURE_THRESHOLD = int(os.environ.get("BREAKER_FAILURE_THRESHOLD", "3"))
+BREAKER_BASE_BACKOFF_SECONDS = 5.0
+BREAKER_MAX_BACKOFF_SECONDS = 300.0
+
+BREAKER_CLOSED = "closed"
+BREAKER_OPEN = "open"
+BREAKER_HALF_OPEN = "half_open"
+
+
+class _Breaker:
+    __slots__ = ("state", "failures", "backoff", "opened_at", "retry_at", "probing", "last_error")
+
+    def __init__(self) -> None:
+        self.state = BREAKER_CLOSED
+        self.failures = 0
+        self.backoff = BREAKER_BASE_BACKOFF_SECONDS
+        self.opened_at: Optional[float] = None
+        self.retry_at: Optional[float] = None
+        self.probing = False
+        self.last_error: Optional[str] = None
+
+
+class DeviceCircuitBreakers:
+    """Track consecutive adb failures per device serial.
+
+    After BREAKER_FAILURE_THRESHOLD consecutive failures (timeouts or
+    transport errors) the breaker opens and calls fail fast. Once the backoff
+    has elapsed a single trial call is let through (half-open): success closes
+    the breaker, failure reopens it with the backoff doubled up to
+    BREAKER_MAX_BACKOFF_SECONDS.
+    """
+
+    def __init__(self, failure_threshold: int = BREAKER_FAILURE_THRESHOLD) -> None:
+        self.failure_threshold = failure_threshold
+        self._breakers: Dict[str, _Breaker] = {}
+        self._lock = threading.Lock()
+        # Bumped whenever a snapshot() could come out different, so cached API bodies know to rebuild
+        self.version = 0
+
+    def allow(self, device_id: str) -> bool:
+        """Return True if a call may go to the device now; claims the half-open trial."""
+        with self._lock:
+            breaker = self._breakers.get(device_id)
+            if breaker is None or breaker.state == BREAKER_CLOSED:
+                return True
+            if breaker.probing or time.monotonic() < breaker.retry_at:
+                return False
+            breaker.state = BREAKER_HALF_OPEN
+            breaker.probing = True
+            self.version += 1
+            return True
+
+    def retry_in(self, device_id: str) -> float:
+        with self._lock:
+            breaker = self._breakers.get(device_id)
+            if breaker is None or breaker.retry_at is None:
+                return 0.0
+            return max(0.0, breaker.retry_at - time.monotonic())
+
+    def record_success(self, device_id: str) -> None:
+        with self._lock:
+            breaker = self._breakers.get(device_id)
+            if breaker is None:
+                return
+            if breaker.state != BREAKER_CLOSED:
+                logger.info("Circuit breaker for %s closed", device_id)
+            del self._breakers[device_id]
+            self.version += 1
+
+    def record_failure(self, device_id: str, error: str) -> None:
+        with self._lock:
+            breaker = self._breakers.get(device_id)
+            if breaker is None:
+                breaker = self._breakers[device_id] = _Breaker()
+            breaker.failures += 1
+            breaker.last_error = error
+            self.version += 1
+
+            if breaker.state == BREAKER_HALF_OPEN:
+                breaker.backoff = min(breaker.backoff * 2, BREAKER_MAX_BACKOFF_SECONDS)
+            elif breaker.state == BREAKER_CLOSED and breaker.failures < self.failure_threshold:
+                return
+            elif breaker.state == BREAKER_OPEN:
+                # A call that was already running when the breaker opened
+                return
+
+            now = time.monotonic()
+            breaker.state = BREAKER_OPEN
+            breaker.probing = False
+            breaker.opened_at = breaker.opened_at or now
+            breaker.retry_at = now + breaker.backoff
+            logger.warning("Circuit breaker for %s open for %.0fs after %d failures: %s",
+                           device_id, breaker.backoff, breaker.failures, error)
+
+    def abandon(self, device_id: str) -> None:
+        """Give up a half-open trial whose outcome says nothing about the device."""
+        with self._lock:
+            breaker = self._breakers.get(device_id)
+            if breaker is not None:
+                breaker.probing = False
+
+    def reset(self, device_id: str) -> None:
+        with self._lock:
+            if self._breakers.pop(device_id, None) is not None:
+                self.version += 1
+
+    def snapshot(self, device_id: str) -> Dict[str, Any]:
+        """Breaker state for API payloads, with wall-clock timestamps."""
+        with self._lock:
+            breaker = self._breakers.get(device_id)
+            if breaker is None:
+                return {"state": BREAKER_CLOSED, "consecutive_failures": 0}
+            return self._describe(breaker, time.monotonic())
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            now = time.monotonic()
+            return {device_id: self._describe(breaker, now) for device_id, breaker in self._breakers.items()}
+
+    @staticmethod
+    def _describe(breaker: _Breaker, now: float) -> Dict[str, Any]:
+        wall_now = datetime.utcnow()
+
+        def to_wall(value: Optional[float]) -> Optional[datetime]:
+            return wall_now + timedelta(seconds=value - now) if value is not None else None
+
+        return {
+            "state": breaker.state,
+            "consecutive_failures": breaker.failures,
+            "opened_at": to_wall(breaker.opened_at),
+            "retry_at": to_wall(breaker.retry_at),
+            "backoff_seconds": breaker.backoff,
+            "last_error": breaker.last_error,
+        }
+
+
+device_breakers = DeviceCircuitBreakers()
@@ -6,7 +6,11 @@ from sqlalchemy import (
     Boolean,
     DateTime,
     Text,
+    Float,
+    LargeBinary,
+    Index,
     ForeignKey,
+    UniqueConstraint,
     text,
 )
 from sqlalchemy.ext.declarative import declarative_base
@@ -46,6 +50,7 @@ class Device(Base):
     connection_info = Column(Text)  # JSON string with detailed info
     last_seen = Column(DateTime, default=datetime.utcnow)
     created_at = Column(DateTime, default=datetime.utcnow)
+    row_version = Column(Integer, nullable=False, default=0, server_default="0")  # bumped on changes clients see
     
     # Device occupation
     occupied_by = Column(Integer, ForeignKey("users.id"), nullable=True)
@@ -73,6 +78,90 @@ class DeviceUsageLog(Base):
     device = relationship("Device", back_populates="usage_logs")
     user = relationship("User", back_populates="usage_logs")
 
+class DeviceUsageRollup(Base):
+    """Per-device daily action counts for usage logs moved out of the hot table."""
+    __tablename__ = "device_usage_rollups"
+    __table_args__ = (
+        UniqueConstraint("device_id", "day", "action", "user_id", name="uq_usage_rollup_key"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    device_id = Column(Integer, ForeignKey("devices.id"), index=True)
+    day = Column(String, index=True)  # YYYY-MM-DD (UTC)
+    action = Column(String)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=True)
+    count = Column(Integer, default=0)
+
+
+class UsageLogArchiveSegment(Base):
+    """Index entry pointing at archived usage-log rows of one device in a segment file."""
+    __tablename__ = "usage_log_archive_segments"
+
+    id = Column(Integer, primary_key=True, index=True)
+    device_id = Column(Integer, ForeignKey("devices.id"), index=True)
+    file_name = Column(String)
+    first_timestamp = Column(DateTime)
+    last_timestamp = Column(DateTime)
+    row_count = Column(Integer)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class DeviceVersionSnapshot(Base):
+    """Latest parsed ql-getversion result per device."""
+    __tablename__ = "device_version_snapshots"
+
+    id = Column(Integer, primary_key=True, index=True)
+    device_id = Column(Integer, ForeignKey("devices.id"), unique=True, index=True)
+    collected_at = Column(DateTime, default=datetime.utcnow)
+    versions = Column(Text)  # JSON of parse_version_output()
+
+
+class TelemetryChunk(Base):
+    """A sealed run of samples for one device metric, stored column-wise as packed arrays."""
+    __tablename__ = "telemetry_chunks"
+    __table_args__ = (
+        Index("ix_telemetry_chunks_series", "device_id", "metric", "start_ts"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    device_id = Column(Integer, ForeignKey("devices.id"))
+    metric = Column(String)
+    resolution = Column(Integer, default=0)  # 0 for raw samples, otherwise bucket seconds
+    start_ts = Column(Float)  # epoch seconds (UTC)
+    end_ts = Column(Float)
+    sample_count = Column(Integer)
+    timestamps = Column(LargeBinary)  # uint32 second offsets from start_ts
+    values = Column(LargeBinary)  # float32 values, or mean/min/max rows for downsampled chunks
+
+class LeaderLease(Base):
+    """Time-limited claim that makes one process the deployment's scanner."""
+    __tablename__ = "leader_leases"
+
+    name = Column(String, primary_key=True)
+    holder = Column(String)  # hostname:pid:nonce of the current leader
+    acquired_at = Column(DateTime)
+    renewed_at = Column(DateTime)
+    expires_at = Column(DateTime)
+    last_scan_at = Column(DateTime)  # last presence sweep reported by the leader
+    last_scan_duration_ms = Column(Float)
+    scan_requested_at = Column(DateTime)  # manual full scan asked for by a non-leader worker
+
+class AgentHeartbeat(Base):
+    """Which worker holds a rack agent's connection, and when the agent was last heard from."""
+    __tablename__ = "agent_heartbeats"
+
+    agent_id = Column(String, primary_key=True)
+    worker_id = Column(String, nullable=False)  # hostname:pid:nonce of the worker holding the connection
+    host = Column(String)
+    connected_at = Column(DateTime)
+    last_seen_at = Column(DateTime, index=True)
+
+class FleetRevision(Base):
+    """Single-row counter bumped by every transaction that changes what device lists and stats show."""
+    __tablename__ = "fleet_revision"
+
+    id = Column(Integer, primary_key=True)
+    revision = Column(Integer, nullable=False, default=0)
+
 # Add back references
 User.occupied_devices = relationship("Device", back_populates="user")
 User.usage_logs = relationship("DeviceUsageLog", back_populates="user")
@@ -93,6 +182,17 @@ def ensure_schema():
         if "model" not in columns:
             conn.execute(text("ALTER TABLE devices ADD COLUMN model TEXT"))
 
+        if "row_version" not in columns:
+            conn.execute(text("ALTER TABLE devices ADD COLUMN row_version INTEGER NOT NULL DEFAULT 0"))
+
+        # Log paging and retention both scan usage logs by device and time
+        conn.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_device_usage_logs_device_ts "
+            "ON device_usage_logs (device_id, timestamp)"
+        ))
+
+        conn.execute(text("INSERT OR IGNORE INTO fleet_revision (id, revision) VALUES (1, 0)"))
+
 def get_db():
     db = SessionLocal()
     try:
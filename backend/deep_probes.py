@@ -0,0 +1,188 @@
+"""Registry and adaptive schedule for per-device deep probes."""
+import hashlib
+import json
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+# Stable devices are probed up to this many times less often than the base interval
+DEEP_PROBE_MAX_STRETCH = 8.0
+# Weight of the latest observation in the per-device change-rate average
+DEEP_PROBE_CHANGE_ALPHA = 0.5
+DEEP_PROBE_INITIAL_COST_SECONDS = 1.0
+
+ScheduleKey = Tuple[str, str]
+
+
+class DeepProbe:
+    """One kind of expensive per-device probe run by the deep scan tier.
+
+    `run(target)` does the adb work and must not touch the database;
+    `apply(db, target, result)` stores the result and returns True if the
+    stored state changed. `fingerprint(result)` picks the fields that count
+    as a change for scheduling (defaults to the whole result).
+    `budget_seconds` bounds the estimated adb time spent on this probe per
+    scan tick.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        run: Callable[[str], Any],
+        apply: Callable[[Any, str, Any], bool],
+        interval_seconds: float,
+        budget_seconds: float,
+        fingerprint: Optional[Callable[[Any], Any]] = None,
+    ) -> None:
+        self.name = name
+        self.run = run
+        self.apply = apply
+        self.interval_seconds = interval_seconds
+        self.budget_seconds = budget_seconds
+        self.fingerprint = fingerprint or (lambda result: result)
+        self.avg_cost_seconds = DEEP_PROBE_INITIAL_COST_SECONDS
+        self.runs = 0
+        self.failures = 0
+        self.deferred = 0
+
+
+class _Schedule:
+    __slots__ = ("last_run", "next_due", "digest", "change_rate", "changes")
+
+    def __init__(self) -> None:
+        self.last_run: Optional[float] = None
+        self.next_due = 0.0
+        self.digest: Optional[str] = None
+        # Unknown devices start as "changing" and earn longer intervals by staying stable
+        self.change_rate = 1.0
+        self.changes = 0
+
+
+def result_digest(result: Any) -> str:
+    return hashlib.sha1(json.dumps(result, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+class DeepProbeRegistry:
+    """Decide which (device, probe) pairs are due and learn how often they change.
+
+    A probe's effective interval is `interval_seconds * DEEP_PROBE_MAX_STRETCH **
+    (1 - change_rate)`, where change_rate is an exponential average of whether
+    consecutive results differed. A device whose Bluetooth peers never change
+    drifts towards the maximum stretch; one change pulls it back towards the
+    base interval.
+    """
+
+    def __init__(self) -> None:
+        self.probes: Dict[str, DeepProbe] = {}
+        self._schedules: Dict[ScheduleKey, _Schedule] = {}
+        self._lock = threading.Lock()
+
+    def register(self, probe: DeepProbe) -> DeepProbe:
+        self.probes[probe.name] = probe
+        return probe
+
+    def force(self, device_id: str, probes: Optional[Iterable[str]] = None) -> None:
+        """Make probes of a device due immediately (new device, reconnect, user action)."""
+        with self._lock:
+            for name in probes if probes is not None else self.probes:
+                self._schedule(device_id, name).next_due = 0.0
+
+    def forget(self, device_id: str) -> None:
+        with self._lock:
+            for key in [key for key in self._schedules if key[0] == device_id]:
+                del self._schedules[key]
+
+    def select_due(
+        self,
+        probe: DeepProbe,
+        device_ids: Iterable[str],
+        within_budget: bool = True,
+        now: Optional[float] = None,
+    ) -> List[str]:
+        """Due devices for a probe, most overdue first, trimmed to the probe's cost budget."""
+        now = now if now is not None else time.monotonic()
+        with self._lock:
+            due = []
+            for device_id in device_ids:
+                schedule = self._schedule(device_id, probe.name)
+                if schedule.next_due <= now:
+                    due.append((schedule.next_due, device_id))
+        due.sort()
+        if not within_budget:
+            return [device_id for _, device_id in due]
+
+        affordable = max(1, int(probe.budget_seconds / max(probe.avg_cost_seconds, 0.001)))
+        probe.deferred += max(0, len(due) - affordable)
+        return [device_id for _, device_id in due[:affordable]]
+
+    def record(self, probe: DeepProbe, device_id: str, result: Any, cost_seconds: float) -> bool:
+        """Record a successful run; returns True if the fingerprint changed since the last one."""
+        digest = result_digest(probe.fingerprint(result))
+        now = time.monotonic()
+        with self._lock:
+            schedule = self._schedule(device_id, probe.name)
+            first = schedule.digest is None
+            changed = not first and schedule.digest != digest
+            if not first:
+                schedule.change_rate = (
+                    DEEP_PROBE_CHANGE_ALPHA * (1.0 if changed else 0.0)
+                    + (1 - DEEP_PROBE_CHANGE_ALPHA) * schedule.change_rate
+                )
+            schedule.changes += int(changed)
+            schedule.digest = digest
+            schedule.last_run = now
+            stretch = DEEP_PROBE_MAX_STRETCH ** (1.0 - schedule.change_rate)
+            schedule.next_due = now + probe.interval_seconds * stretch
+            probe.runs += 1
+            probe.avg_cost_seconds = 0.8 * probe.avg_cost_seconds + 0.2 * cost_seconds
+        return changed
+
+    def record_failure(self, probe: DeepProbe, device_id: str) -> None:
+        """Retry a failed probe after its base interval without touching the change rate."""
+        with self._lock:
+            schedule = self._schedule(device_id, probe.name)
+            schedule.next_due = time.monotonic() + probe.interval_seconds
+            probe.failures += 1
+
+    def device_stats(self, device_id: str) -> Dict[str, Any]:
+        now = time.monotonic()
+        with self._lock:
+            result = {}
+            for (schedule_device, name), schedule in self._schedules.items():
+                if schedule_device != device_id:
+                    continue
+                result[name] = {
+                    "change_rate": round(schedule.change_rate, 3),
+                    "changes": schedule.changes,
+                    "last_run_seconds_ago": round(now - schedule.last_run, 1) if schedule.last_run else None,
+                    "next_due_in_seconds": round(max(0.0, schedule.next_due - now), 1),
+                }
+            return result
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        with self._lock:
+            probes = {}
+            for name, probe in self.probes.items():
+                schedules = [s for (_, probe_name), s in self._schedules.items() if probe_name == name]
+                probes[name] = {
+                    "interval_seconds": probe.interval_seconds,
+                    "budget_seconds": probe.budget_seconds,
+                    "avg_cost_seconds": round(probe.avg_cost_seconds, 3),
+                    "devices": len(schedules),
+                    "due": sum(1 for s in schedules if s.next_due <= now),
+                    "runs_total": probe.runs,
+                    "failures_total": probe.failures,
+                    "deferred_total": probe.deferred,
+                }
+            return probes
+
+    def _schedule(self, device_id: str, name: str) -> _Schedule:
+        key = (device_id, name)
+        schedule = self._schedules.get(key)
+        if schedule is None:
+            schedule = self._schedules[key] = _Schedule()
+        return schedule
+
+
+deep_probes = DeepProbeRegistry()
@@ -0,0 +1,116 @@
+"""Pre-serialized JSON of each device's row for assembling `/api/devices` responses.
+
+A device's fields are encoded once, the first time it is listed after it
+changed, and every later list, whatever its view or fields, joins those
+bytes instead of decoding connection_info and tags and validating a
+DeviceWithUser per row. Each fragment carries the `row_version` of the row
+it was encoded from; every change that clients see bumps that column, so a
+list, which reads the current versions anyway, never joins an outdated
+fragment, whichever process changed the device. `last_seen` moves on every
+presence sweep without a version bump and is added to each response from
+the column instead.
+"""
+import json
+import threading
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+# Fields read from the row, in response order; user, breaker and staleness are added per response
+DEVICE_ROW_FIELDS = (
+    "id", "device_id", "device_type", "name", "model", "status", "group_name", "tags",
+    "connection_info", "last_seen", "created_at", "occupied_by", "occupied_at",
+)
+# Row fields kept in fragments: all but last_seen, which is read per response
+DEVICE_FRAGMENT_FIELDS = tuple(field for field in DEVICE_ROW_FIELDS if field != "last_seen")
+# Bulky probe output kept in connection_info but only served by /api/devices/{device_id}/connection-info
+CONNECTION_INFO_RAW_KEYS = ("raw_output",)
+
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+_ENCODER = json.JSONEncoder(default=_json_default, ensure_ascii=False, separators=(",", ":"))
+_FIELD_KEYS = {field: _ENCODER.encode(field).encode() + b":" for field in DEVICE_ROW_FIELDS}
+
+
+def encode_json(value: Any) -> bytes:
+    """Compact UTF-8 JSON matching what FastAPI renders for the same values."""
+    # Row columns are mostly these; skipping the generic encoder makes first-time encoding of a fleet cheap
+    if value is None:
+        return b"null"
+    if isinstance(value, str):
+        return _ENCODER.encode(value).encode()
+    if isinstance(value, datetime):
+        return b'"' + value.isoformat().encode() + b'"'
+    if type(value) is int:
+        return str(value).encode()
+    return _ENCODER.encode(value).encode()
+
+
+class DeviceFragment:
+    """One device's encoded `"field":value` pairs, plus what the per-response fields are looked up by."""
+
+    __slots__ = ("pairs", "row_version", "occupied_by", "breaker_target", "_joined")
+
+    def __init__(self, device: Any) -> None:
+        """`device` is a devices row (entity or named tuple) with row_version and the DEVICE_FRAGMENT_FIELDS."""
+        connection_info = json.loads(device.connection_info) if device.connection_info else {}
+        values = {field: getattr(device, field) for field in DEVICE_FRAGMENT_FIELDS}
+        values["connection_info"] = {
+            key: value for key, value in connection_info.items() if key not in CONNECTION_INFO_RAW_KEYS
+        }
+        values["tags"] = json.loads(device.tags) if device.tags else []
+        self.pairs = {field: _FIELD_KEYS[field] + encode_json(value) for field, value in values.items()}
+        self.row_version: int = device.row_version
+        self.occupied_by: Optional[int] = device.occupied_by
+        # Bluetooth peers are reached through their ADB host, so they share its breaker
+        self.breaker_target: Optional[str] = (
+            connection_info.get("adb_host") if device.device_type == "bluetooth" else device.device_id
+        )
+        self._joined: Dict[Tuple[str, ...], bytes] = {}
+
+    def join(self, fields: Tuple[str, ...]) -> bytes:
+        """The pairs of `fields` (fragment fields only) joined with commas, memoized per field selection."""
+        joined = self._joined.get(fields)
+        if joined is None:
+            joined = self._joined[fields] = b",".join(self.pairs[field] for field in fields)
+        return joined
+
+
+class DeviceFragmentCache:
+    """The latest fragment built per device_id, used only while its row_version is current."""
+
+    def __init__(self) -> None:
+        self._fragments: Dict[str, DeviceFragment] = {}
+        self._lock = threading.Lock()
+
+    def get_many(self, versions: Iterable[Tuple[str, int]]) -> Tuple[Dict[str, DeviceFragment], List[str]]:
+        """(fragments matching the given (device_id, row_version) pairs, device_ids to build)."""
+        found: Dict[str, DeviceFragment] = {}
+        missing: List[str] = []
+        with self._lock:
+            fragments = self._fragments
+            for device_id, row_version in versions:
+                fragment = fragments.get(device_id)
+                if fragment is None or fragment.row_version != row_version:
+                    missing.append(device_id)
+                else:
+                    found[device_id] = fragment
+            return found, missing
+
+    def put(self, fragments: Dict[str, DeviceFragment]) -> None:
+        with self._lock:
+            self._fragments.update(fragments)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._fragments.clear()
+
+    def __len__(self) -> int:
+        return len(self._fragments)
+
+
+device_fragments = DeviceFragmentCache()
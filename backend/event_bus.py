@@ -0,0 +1,258 @@
+"""Pluggable event bus that fans device, occupancy and scan events out to every worker."""
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Set
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - the Unix socket backend is unavailable on Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# "memory" delivers within this process only; "unix" relays through a broker on a Unix socket
+EVENT_BUS_BACKEND = os.environ.get("EVENT_BUS_BACKEND", "memory")
+EVENT_BUS_SOCKET = os.environ.get("EVENT_BUS_SOCKET", "/tmp/device-manager-events.sock")
+EVENT_BUS_LATENCY_SAMPLES = 1024
+EVENT_BUS_RECONNECT_SECONDS = 1.0
+# A broker client whose unsent backlog exceeds this is disconnected rather than buffered forever
+EVENT_BUS_MAX_CLIENT_BACKLOG_BYTES = 8 * 1024 * 1024
+# Longest event line the broker and its clients accept; asyncio's 64 KiB default is below a full-scan device_update
+EVENT_BUS_MAX_EVENT_BYTES = 16 * 1024 * 1024
+
+EventHandler = Callable[[Dict[str, Any]], Awaitable[None]]
+
+
+def _percentile(samples: List[float], fraction: float) -> Optional[float]:
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class EventBus:
+    """In-process event bus; the base for cross-process backends.
+
+    `publish` may be called from any thread. Handlers run on the event loop
+    passed to `start` and receive the event dict. Every event is stamped with
+    its wall-clock publish time so delivery latency can be measured across
+    processes.
+    """
+
+    backend = "memory"
+
+    def __init__(self) -> None:
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self._handlers: List[EventHandler] = []
+        self._latencies: Deque[float] = deque(maxlen=EVENT_BUS_LATENCY_SAMPLES)
+        self._lock = threading.Lock()
+        self.published_total = 0
+        self.delivered_total = 0
+        self.dropped_total = 0
+
+    def subscribe(self, handler: EventHandler) -> None:
+        self._handlers.append(handler)
+
+    async def start(self) -> None:
+        self.loop = asyncio.get_running_loop()
+
+    async def stop(self) -> None:
+        self.loop = None
+
+    def publish(self, event: Dict[str, Any]) -> None:
+        """Queue an event for delivery; dropped (and counted) while the bus is not running."""
+        loop = self.loop
+        envelope = {"event": event, "published_at": time.time(), "origin": os.getpid()}
+        with self._lock:
+            self.published_total += 1
+        if loop is None or loop.is_closed():
+            with self._lock:
+                self.dropped_total += 1
+            logger.debug("Event bus not running, dropped %s event", event.get("type"))
+            return
+        try:
+            loop.call_soon_threadsafe(self._send, envelope)
+        except RuntimeError:
+            with self._lock:
+                self.dropped_total += 1
+
+    def _send(self, envelope: Dict[str, Any]) -> None:
+        self._dispatch(envelope)
+
+    def _dispatch(self, envelope: Dict[str, Any]) -> None:
+        latency_ms = (time.time() - envelope["published_at"]) * 1000
+        with self._lock:
+            self.delivered_total += 1
+            self._latencies.append(latency_ms)
+        for handler in self._handlers:
+            task = asyncio.ensure_future(handler(envelope["event"]))
+            task.add_done_callback(_log_handler_failure)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            samples = list(self._latencies)
+            return {
+                "backend": self.backend,
+                "published_total": self.published_total,
+                "delivered_total": self.delivered_total,
+                "dropped_total": self.dropped_total,
+                "delivery_latency_ms": {
+                    "p50": _percentile(samples, 0.5),
+                    "p95": _percentile(samples, 0.95),
+                    "max": max(samples) if samples else None,
+                    "samples": len(samples),
+                },
+            }
+
+
+def _log_handler_failure(task: "asyncio.Future[None]") -> None:
+    if not task.cancelled() and task.exception() is not None:
+        logger.error("Event handler failed: %s", task.exception())
+
+
+class UnixSocketEventBus(EventBus):
+    """Relay events between worker processes through a broker on a Unix socket.
+
+    Every worker connects to the broker and publishes by writing one JSON
+    line; the broker echoes each line to all connected workers, including
+    the sender, so local and remote clients see events in the same order.
+    The broker runs inside whichever worker holds the lock file next to the
+    socket; if that worker exits, another one takes over. While the broker
+    is unreachable events are delivered to local clients only.
+    """
+
+    backend = "unix"
+
+    def __init__(self, path: str = EVENT_BUS_SOCKET) -> None:
+        super().__init__()
+        self.path = path
+        self.is_broker = False
+        self.local_fallback_total = 0
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._task: Optional[asyncio.Task] = None
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._broker_clients: Set[asyncio.StreamWriter] = set()
+        self._lock_fd: Optional[int] = None
+
+    async def start(self) -> None:
+        await super().start()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+        if self._writer is not None:
+            self._writer.close()
+        if self._server is not None:
+            self._server.close()
+            for client in list(self._broker_clients):
+                client.close()
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = None
+            self.is_broker = False
+        await super().stop()
+
+    def _send(self, envelope: Dict[str, Any]) -> None:
+        writer = self._writer
+        if writer is None or writer.is_closing():
+            self.local_fallback_total += 1
+            self._dispatch(envelope)
+            return
+        line = json.dumps(envelope, default=str).encode("utf-8") + b"\n"
+        if len(line) > EVENT_BUS_MAX_EVENT_BYTES:
+            logger.error("Event %s is %d bytes, over the bus limit; delivered to this process only",
+                         envelope["event"].get("type"), len(line))
+            self.local_fallback_total += 1
+            self._dispatch(envelope)
+            return
+        writer.write(line)
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self._ensure_broker()
+                reader, self._writer = await asyncio.open_unix_connection(
+                    self.path, limit=EVENT_BUS_MAX_EVENT_BYTES
+                )
+                while True:
+                    line = await reader.readline()
+                    if not line:
+                        break
+                    self._dispatch(json.loads(line))
+            except asyncio.CancelledError:
+                raise
+            except (OSError, ValueError) as exc:
+                logger.debug("Event bus connection to %s failed: %s", self.path, exc)
+            finally:
+                if self._writer is not None:
+                    self._writer.close()
+                    self._writer = None
+            await asyncio.sleep(EVENT_BUS_RECONNECT_SECONDS)
+
+    async def _ensure_broker(self) -> None:
+        """Become the broker if no other worker holds the broker lock."""
+        if self.is_broker:
+            return
+        fd = os.open(self.path + ".lock", os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self._server = await asyncio.start_unix_server(
+            self._serve_client, self.path, limit=EVENT_BUS_MAX_EVENT_BYTES
+        )
+        self._lock_fd = fd
+        self.is_broker = True
+        logger.info("Event bus broker listening on %s (pid %d)", self.path, os.getpid())
+
+    async def _serve_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self._broker_clients.add(writer)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                for client in list(self._broker_clients):
+                    if client.transport.get_write_buffer_size() > EVENT_BUS_MAX_CLIENT_BACKLOG_BYTES:
+                        logger.warning("Dropping event bus client with a full backlog")
+                        self._broker_clients.discard(client)
+                        client.close()
+                        continue
+                    client.write(line)
+        except (OSError, ValueError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._broker_clients.discard(writer)
+            writer.close()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **super().stats(),
+            "socket": self.path,
+            "connected": self._writer is not None and not self._writer.is_closing(),
+            "is_broker": self.is_broker,
+            "broker_clients": len(self._broker_clients) if self.is_broker else None,
+            "local_fallback_total": self.local_fallback_total,
+        }
+
+
+def create_event_bus(backend: str = EVENT_BUS_BACKEND) -> EventBus:
+    if backend == "unix":
+        if fcntl is None:
+            raise RuntimeError("EVENT_BUS_BACKEND=unix requires a POSIX platform")
+        return UnixSocketEventBus()
+    if backend != "memory":
+        raise ValueError(f"Unknown EVENT_BUS_BACKEND {backend!r}")
+    return EventBus()
+
+
+event_bus = create_event_bus()
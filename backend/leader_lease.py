@@ -0,0 +1,183 @@
+"""Database-backed leader lease that elects one scanner per deployment."""
+import logging
+import os
+import socket
+import threading
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Optional
+
+from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError, OperationalError
+
+from database import LeaderLease as DBLeaderLease, SessionLocal
+
+logger = logging.getLogger(__name__)
+
+LEASE_TTL_SECONDS = float(os.environ.get("SCANNER_LEASE_TTL_SECONDS", "30"))
+LEASE_RENEW_SECONDS = LEASE_TTL_SECONDS / 3
+
+
+class LeaderLease:
+    """A named lease row that at most one process holds at a time.
+
+    Acquiring and renewing are the same conditional UPDATE: it only matches
+    while the row is held by us or has expired, so SQLite's write lock makes
+    the takeover atomic across processes. A leader that stops renewing
+    (crashed, hung, partitioned from the database) loses the lease after
+    LEASE_TTL_SECONDS and another process takes over.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        ttl_seconds: float = LEASE_TTL_SECONDS,
+        session_factory: Callable[[], Any] = SessionLocal,
+    ) -> None:
+        self.name = name
+        self.ttl_seconds = ttl_seconds
+        self.session_factory = session_factory
+        self.holder_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.is_leader = False
+        # When the lease we last wrote runs out; a renewal that errors keeps us leader until then
+        self._expires_at: Optional[datetime] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def start(
+        self,
+        on_tick: Callable[[bool], None],
+        heartbeat: Callable[[], Dict[str, Any]] = dict,
+    ) -> None:
+        """Renew (or compete for) the lease every LEASE_RENEW_SECONDS on a dedicated thread.
+
+        Renewal does not share a thread with the work the lease guards, so a
+        long scan cannot make the leader miss its renewals. `on_tick` receives
+        the outcome of every attempt and must return quickly.
+        """
+        if self._thread is not None:
+            return
+        self._stop.clear()
+
+        def loop() -> None:
+            while not self._stop.is_set():
+                try:
+                    on_tick(self.try_acquire(**heartbeat()))
+                except Exception:
+                    logger.exception("Lease %s tick failed", self.name)
+                self._stop.wait(LEASE_RENEW_SECONDS)
+
+        self._thread = threading.Thread(target=loop, name=f"{self.name}-lease", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop renewing and hand the lease over immediately."""
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join(timeout=LEASE_RENEW_SECONDS)
+            self._thread = None
+        self.release()
+
+    def try_acquire(self, **heartbeat: Any) -> bool:
+        """Acquire or renew the lease; `heartbeat` columns are stored along with a successful renewal."""
+        now = datetime.utcnow()
+        expires_at = now + timedelta(seconds=self.ttl_seconds)
+        db = self.session_factory()
+        try:
+            lease = db.get(DBLeaderLease, self.name)
+            if lease is None:
+                db.add(DBLeaderLease(
+                    name=self.name,
+                    holder=self.holder_id,
+                    acquired_at=now,
+                    renewed_at=now,
+                    expires_at=expires_at,
+                    **heartbeat,
+                ))
+                db.commit()
+                acquired = True
+            else:
+                values = {
+                    "holder": self.holder_id,
+                    "renewed_at": now,
+                    "expires_at": expires_at,
+                    **heartbeat,
+                }
+                if lease.holder != self.holder_id:
+                    values["acquired_at"] = now
+                updated = db.query(DBLeaderLease).filter(
+                    DBLeaderLease.name == self.name,
+                    or_(DBLeaderLease.holder == self.holder_id, DBLeaderLease.expires_at < now),
+                ).update(values, synchronize_session=False)
+                db.commit()
+                acquired = updated == 1
+        except IntegrityError as exc:
+            # Another process created the row first
+            db.rollback()
+            logger.debug("Lease %s contention: %s", self.name, exc)
+            acquired = False
+        except OperationalError as exc:
+            # A lock timeout or a database hiccup says nothing about who holds the lease: the row we
+            # last wrote is still ours until it expires, and stepping down early would re-run the scan
+            db.rollback()
+            logger.warning("Lease %s renewal failed: %s", self.name, exc)
+            acquired = self.is_leader and self._expires_at is not None and now < self._expires_at
+        else:
+            if acquired:
+                self._expires_at = expires_at
+        finally:
+            db.close()
+
+        if acquired != self.is_leader:
+            logger.warning("%s lease %s by %s", self.name, "acquired" if acquired else "lost", self.holder_id)
+        self.is_leader = acquired
+        return acquired
+
+    def release(self) -> None:
+        if not self.is_leader:
+            return
+        db = self.session_factory()
+        try:
+            db.query(DBLeaderLease).filter(
+                DBLeaderLease.name == self.name,
+                DBLeaderLease.holder == self.holder_id,
+            ).update({"expires_at": datetime.utcnow()}, synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+        self.is_leader = False
+        self._expires_at = None
+
+    def update(self, **values: Any) -> bool:
+        """Write columns of the lease row regardless of who holds it (e.g. a scan request)."""
+        db = self.session_factory()
+        try:
+            updated = db.query(DBLeaderLease).filter(DBLeaderLease.name == self.name).update(
+                values, synchronize_session=False
+            )
+            db.commit()
+            return updated == 1
+        finally:
+            db.close()
+
+    def status(self) -> Optional[Dict[str, Any]]:
+        db = self.session_factory()
+        try:
+            lease = db.get(DBLeaderLease, self.name)
+            if lease is None:
+                return None
+            return {
+                "holder": lease.holder,
+                "acquired_at": lease.acquired_at,
+                "renewed_at": lease.renewed_at,
+                "expires_at": lease.expires_at,
+                "expired": lease.expires_at is None or lease.expires_at < datetime.utcnow(),
+                "last_scan_at": lease.last_scan_at,
+                "last_scan_duration_ms": lease.last_scan_duration_ms,
+                "scan_requested_at": lease.scan_requested_at,
+            }
+        finally:
+            db.close()
+
+
+scanner_lease = LeaderLease("scanner")
@@ -0,0 +1,177 @@
+"""Retention for device usage logs: daily rollups plus gzip NDJSON archives."""
+import gzip
+import json
+import logging
+import os
+import uuid
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from database import (
+    SessionLocal,
+    DeviceUsageLog as DBDeviceUsageLog,
+    DeviceUsageRollup as DBDeviceUsageRollup,
+    UsageLogArchiveSegment as DBUsageLogArchiveSegment,
+)
+
+logger = logging.getLogger(__name__)
+
+USAGE_LOG_RETENTION_DAYS = int(os.environ.get("USAGE_LOG_RETENTION_DAYS", "30"))
+USAGE_LOG_ARCHIVE_DIR = os.environ.get("USAGE_LOG_ARCHIVE_DIR", "./log_archive")
+USAGE_LOG_COMPACTION_BATCH_ROWS = 5000
+
+
+def _serialize_row(row: DBDeviceUsageLog) -> Dict[str, Any]:
+    return {
+        "id": row.id,
+        "device_id": row.device_id,
+        "user_id": row.user_id,
+        "action": row.action,
+        "timestamp": row.timestamp.isoformat() if row.timestamp else None,
+        "notes": row.notes,
+    }
+
+
+def _write_segment(archive_dir: str, rows: List[DBDeviceUsageLog]) -> str:
+    """Write rows to a new compressed NDJSON segment and return its file name."""
+    os.makedirs(archive_dir, exist_ok=True)
+    first_day = rows[0].timestamp.strftime("%Y%m%d")
+    last_day = rows[-1].timestamp.strftime("%Y%m%d")
+    file_name = f"usage-{first_day}-{last_day}-{uuid.uuid4().hex[:8]}.ndjson.gz"
+    path = os.path.join(archive_dir, file_name)
+
+    ordered = sorted(rows, key=lambda r: (r.device_id or 0, r.timestamp))
+    with open(path, "wb") as raw:
+        with gzip.GzipFile(fileobj=raw, mode="wb") as gz:
+            for row in ordered:
+                gz.write(json.dumps(_serialize_row(row), ensure_ascii=False).encode("utf-8"))
+                gz.write(b"\n")
+        raw.flush()
+        os.fsync(raw.fileno())
+    return file_name
+
+
+def _apply_rollups(db: Session, rows: List[DBDeviceUsageLog]) -> None:
+    counts: Dict[Tuple[int, str, str, Optional[int]], int] = defaultdict(int)
+    for row in rows:
+        counts[(row.device_id, row.timestamp.strftime("%Y-%m-%d"), row.action, row.user_id)] += 1
+
+    for (device_id, day, action, user_id), count in counts.items():
+        rollup = db.query(DBDeviceUsageRollup).filter(
+            DBDeviceUsageRollup.device_id == device_id,
+            DBDeviceUsageRollup.day == day,
+            DBDeviceUsageRollup.action == action,
+            DBDeviceUsageRollup.user_id == user_id,
+        ).first()
+        if rollup:
+            rollup.count += count
+        else:
+            db.add(DBDeviceUsageRollup(
+                device_id=device_id,
+                day=day,
+                action=action,
+                user_id=user_id,
+                count=count,
+            ))
+
+
+def _index_segment(db: Session, file_name: str, rows: List[DBDeviceUsageLog]) -> None:
+    by_device: Dict[int, List[DBDeviceUsageLog]] = defaultdict(list)
+    for row in rows:
+        by_device[row.device_id].append(row)
+
+    for device_id, device_rows in by_device.items():
+        db.add(DBUsageLogArchiveSegment(
+            device_id=device_id,
+            file_name=file_name,
+            first_timestamp=min(r.timestamp for r in device_rows),
+            last_timestamp=max(r.timestamp for r in device_rows),
+            row_count=len(device_rows),
+        ))
+
+
+def compact_usage_logs(
+    now: Optional[datetime] = None,
+    retention_days: int = USAGE_LOG_RETENTION_DAYS,
+    archive_dir: str = USAGE_LOG_ARCHIVE_DIR,
+    batch_rows: int = USAGE_LOG_COMPACTION_BATCH_ROWS,
+) -> Dict[str, Any]:
+    """Move usage logs older than the retention window out of the hot table.
+
+    Each batch is written to a segment file first and then, in one
+    transaction, folded into daily rollups, indexed and deleted from
+    `device_usage_logs`. A crash between the two steps leaves an unindexed
+    segment file behind, never a lost or double-counted row.
+    """
+    cutoff = (now or datetime.utcnow()) - timedelta(days=retention_days)
+    summary = {"cutoff": cutoff.isoformat(), "archived_rows": 0, "segments": []}
+
+    db = SessionLocal()
+    try:
+        while True:
+            rows = db.query(DBDeviceUsageLog).filter(
+                DBDeviceUsageLog.timestamp < cutoff
+            ).order_by(DBDeviceUsageLog.timestamp, DBDeviceUsageLog.id).limit(batch_rows).all()
+            if not rows:
+                break
+
+            file_name = _write_segment(archive_dir, rows)
+            try:
+                _apply_rollups(db, rows)
+                _index_segment(db, file_name, rows)
+                db.query(DBDeviceUsageLog).filter(
+                    DBDeviceUsageLog.id.in_([row.id for row in rows])
+                ).delete(synchronize_session=False)
+                db.commit()
+            except Exception:
+                db.rollback()
+                try:
+                    os.unlink(os.path.join(archive_dir, file_name))
+                except OSError:
+                    pass
+                raise
+
+            summary["archived_rows"] += len(rows)
+            summary["segments"].append(file_name)
+            db.expunge_all()
+    finally:
+        db.close()
+
+    if summary["archived_rows"]:
+        logger.info("Archived %d usage log rows into %d segments",
+                    summary["archived_rows"], len(summary["segments"]))
+    return summary
+
+
+def _read_segment(archive_dir: str, file_name: str, device_id: int) -> List[Dict[str, Any]]:
+    path = os.path.join(archive_dir, file_name)
+    entries: List[Dict[str, Any]] = []
+    try:
+        with gzip.open(path, "rt", encoding="utf-8") as handle:
+            for line in handle:
+                entry = json.loads(line)
+                if entry.get("device_id") == device_id:
+                    entry["timestamp"] = datetime.fromisoformat(entry["timestamp"]) if entry.get("timestamp") else None
+                    entries.append(entry)
+    except OSError as exc:
+        logger.warning("Unable to read usage log archive %s: %s", path, exc)
+    return entries
+
+
+def iter_archived_logs(
+    db: Session,
+    device_id: int,
+    archive_dir: str = USAGE_LOG_ARCHIVE_DIR,
+) -> Iterator[Dict[str, Any]]:
+    """Yield archived log entries for a device, newest first."""
+    segments = db.query(DBUsageLogArchiveSegment).filter(
+        DBUsageLogArchiveSegment.device_id == device_id
+    ).order_by(DBUsageLogArchiveSegment.last_timestamp.desc()).all()
+
+    for segment in segments:
+        entries = _read_segment(archive_dir, segment.file_name, device_id)
+        entries.sort(key=lambda e: (e["timestamp"] or datetime.min, e["id"]), reverse=True)
+        yield from entries
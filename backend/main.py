@@ -1,104 +1,10 @@
 from fastapi import FastAPI, Query
 import subprocess
-from typing import List, Optional, Dict, Any
-import re
+from typing import List, Optional
 
-app = FastAPI()
-
-
-def parse_bluetoothctl_info(text: str) -> Dict[str, Any]:
-    """Parse `bluetoothctl info` output into structured fields."""
-    parsed: Dict[str, Any] = {
-        "mac": None,
-        "name": None,
-        "alias": None,
-        "class": None,
-        "icon": None,
-        "connected": None,
-        "paired": None,
-        "trusted": None,
-        "blocked": None,
-        "rssi": None,
-        "tx_power": None,
-        "modalias": None,
-        "services_resolved": None,
-        "uuids": [],  # list of {uuid, desc}
-        "manufacturer_data": {},
-    }
-
-    if not text:
-        return parsed
-
-    # Pre-compile regex
-    r_device = re.compile(r"^Device\s+([0-9A-Fa-f:]{17})")
-    r_kv = re.compile(r"^(\w[\w\s]+?):\s*(.*)$")
-    r_uuid = re.compile(r"^UUID:\s*([0-9a-fA-F\-]{4,})\s*(?:\((.*?)\))?$")
-
-    for raw in text.splitlines():
-        line = raw.strip()
-        if not line:
-            continue
+from parsers import parse_bluetoothctl_info, parse_bluetoothctl_info_blocks
 
-        m_dev = r_device.match(line)
-        if m_dev:
-            parsed["mac"] = m_dev.group(1)
-            continue
-
-        m_uuid = r_uuid.match(line)
-        if m_uuid:
-            parsed["uuids"].append({
-                "uuid": m_uuid.group(1),
-                "desc": m_uuid.group(2) or None,
-            })
-            continue
-
-        m = r_kv.match(line)
-        if not m:
-            continue
-        key = m.group(1).strip()
-        val = m.group(2).strip()
-
-        k = key.lower().replace(" ", "_")
-        if k == "name":
-            parsed["name"] = val or None
-        elif k == "alias":
-            parsed["alias"] = val or None
-        elif k == "class":
-            parsed["class"] = val or None
-        elif k == "icon":
-            parsed["icon"] = val or None
-        elif k == "connected":
-            parsed["connected"] = val.lower() == "yes"
-        elif k == "paired":
-            parsed["paired"] = val.lower() == "yes"
-        elif k == "trusted":
-            parsed["trusted"] = val.lower() == "yes"
-        elif k == "blocked":
-            parsed["blocked"] = val.lower() == "yes"
-        elif k == "rssi":
-            try:
-                parsed["rssi"] = int(val)
-            except ValueError:
-                parsed["rssi"] = None
-        elif k == "tx_power":
-            try:
-                parsed["tx_power"] = int(val)
-            except ValueError:
-                parsed["tx_power"] = None
-        elif k == "modalias":
-            parsed["modalias"] = val or None
-        elif k == "services_resolved":
-            parsed["services_resolved"] = val.lower() == "yes"
-        elif key.startswith("ManufacturerData") or key.startswith("Manufacturer Data"):
-            # Various formats observed, try to capture key-value pairs
-            # e.g. "ManufacturerData Key: 0x004C" OR "ManufacturerData: 0x004c 06 1a ..."
-            parts = val.split(None, 1)
-            md_key = parts[0] if parts else None
-            md_val = parts[1] if len(parts) > 1 else ""
-            if md_key:
-                parsed["manufacturer_data"][md_key] = md_val
-
-    return parsed
+app = FastAPI()
 
 
 @app.get("/devices")
@@ -140,7 +46,13 @@ def get_bluetooth_device_info(device_id: Optional[str] = Query(default=None, ali
         base_cmd += ["shell", "bluetoothctl", "info"]
         result = subprocess.run(base_cmd, capture_output=True, text=True, check=True)
         output = result.stdout
-        return {"device_id": device_id, "output": output, "parsed": parse_bluetoothctl_info(output)}
+        # Without a MAC bluetoothctl prints one block per connected device
+        return {
+            "device_id": device_id,
+            "output": output,
+            "parsed": parse_bluetoothctl_info(output),
+            "devices": parse_bluetoothctl_info_blocks(output),
+        }
     except (subprocess.CalledProcessError, FileNotFoundError) as e:
         return {"device_id": device_id, "error": "failed to execute bluetoothctl info", "detail": str(e)}
 
@@ -6,19 +6,21 @@ from fastapi import (
     Query,
     WebSocket,
     WebSocketDisconnect,
+    Request,
     UploadFile,
     File,
     Form,
     Body,
 )
-from fastapi.responses import PlainTextResponse
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, PlainTextResponse
 from fastapi.security import OAuth2PasswordRequestForm
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.websockets import WebSocketState
 from sqlalchemy.orm import Session
-from sqlalchemy import func
-from typing import List, Optional, Dict, Any
+from sqlalchemy import event as sa_event, func, inspect as sa_inspect
+from typing import Awaitable, Callable, List, Optional, Dict, Any, Tuple
 import subprocess
-import re
 import json
 import os
 import tempfile
@@ -26,18 +28,104 @@ import posixpath
 from datetime import datetime, timedelta
 from apscheduler.schedulers.background import BackgroundScheduler
 import asyncio
-import asyncio.subprocess as aio_subprocess
+import calendar
+import contextvars
 import logging
-import threading
 import time
 import shlex
+import shutil
+from concurrent.futures import ThreadPoolExecutor, wait as wait_futures
+from contextlib import asynccontextmanager
 
 # Import our modules
-from database import get_db, create_tables, Device as DBDevice, User as DBUser, DeviceUsageLog as DBDeviceUsageLog, SessionLocal
+from database import get_db, create_tables, Device as DBDevice, User as DBUser, DeviceUsageLog as DBDeviceUsageLog, SessionLocal, engine
 from models import *
 from auth import *
+from audit import audit_writer
+from database import DeviceUsageRollup as DBDeviceUsageRollup, DeviceVersionSnapshot as DBDeviceVersionSnapshot
+from database import FleetRevision as DBFleetRevision
+from log_retention import compact_usage_logs, iter_archived_logs
+from adb_scheduler import (
+    ADB_OPERATION_TIMEOUTS,
+    ADB_PRIORITY_BACKGROUND,
+    ADB_PRIORITY_INTERACTIVE,
+    ADB_PRIORITY_USER,
+    DeviceUnavailableError,
+    adb_scheduler,
+    adb_target,
+)
+from adb_shards import ADB_SHARD_HEALTH_INTERVAL_SECONDS, adb_shards
+from agent_hub import AGENT_RELAY_EVENT, AgentCommandError, agent_hub
+from circuit_breaker import device_breakers
+from deep_probes import DeepProbe, deep_probes
+from event_bus import event_bus
+from parsers import (
+    MODULE_VERSION_FIELDS,
+    parse_adb_devices_long,
+    parse_bluetoothctl_devices,
+    parse_bluetoothctl_info_blocks,
+    parse_bluetoothctl_show,
+    parse_df_output,
+    parse_mount_output,
+    parse_version_output,
+    split_bluetoothctl_info,
+)
+from profiling import ProfiledRoute, ProfilingMiddleware, profiler, span as profile_span
+from metrics import InstrumentedLock, MetricsMiddleware, boot_timer, instrument_engine, metrics_registry
+from ws_manager import ConnectionManager
+from leader_lease import scanner_lease
+from device_fragments import DEVICE_FRAGMENT_FIELDS, DEVICE_ROW_FIELDS, DeviceFragment, device_fragments, encode_json
+from probe_cache import probe_cache
+from response_cache import fleet_response_cache
+from telemetry import (
+    TELEMETRY_AGGREGATES,
+    TELEMETRY_METRICS,
+    TELEMETRY_SAMPLE_INTERVAL_SECONDS,
+    telemetry_store,
+)
+from terminal_session import (
+    CTRL_U,
+    DEFAULT_PTY_COLS,
+    DEFAULT_PTY_ROWS,
+    PTY_HIGH_WATERMARK_BYTES,
+    TERMINAL_LOG_PREVIEW,
+    PtyTerminalSession,
+    ShellLineTracker,
+    pty_supported,
+    pump_pty_output,
+    stream_process_output,
+)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Start background services, serve, then shut them down.
+
+    Nothing here waits for a scan: the devices table still holds the fleet as
+    the last scanner left it, so requests are answered from that snapshot
+    (flagged stale, see fleet_freshness) while the first scan runs in the
+    background once this process wins the scanner lease.
+    """
+    create_tables()
+    app.state.event_loop = asyncio.get_running_loop()
+    await event_bus.start()
+    audit_writer.start()
+    await asyncio.get_running_loop().run_in_executor(None, agent_hub.start)
+    if SCANNER_MODE == "lease":
+        start_scanner()
+    boot_timer.mark("ready")
+    yield
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, stop_scanner)
+    await loop.run_in_executor(None, agent_hub.stop)
+    await event_bus.stop()
+    # Commit every queued usage-log row and open telemetry chunk before the process exits
+    await loop.run_in_executor(None, audit_writer.stop)
+    await loop.run_in_executor(None, telemetry_store.flush)
 
-app = FastAPI(title="Device Management System", version="1.0.0")
+
+app = FastAPI(title="Device Management System", version="1.0.0", lifespan=lifespan)
+# Lets armed profiles tell endpoint time from response serialization
+app.router.route_class = ProfiledRoute
 
 logger = logging.getLogger(__name__)
 
@@ -49,37 +137,80 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(ProfilingMiddleware)
+instrument_engine(engine)
 
 # WebSocket connection manager
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections: List[WebSocket] = []
+manager = ConnectionManager()
 
-    async def connect(self, websocket: WebSocket):
-        await websocket.accept()
-        self.active_connections.append(websocket)
 
-    def disconnect(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)
+async def _dispatch_event(event: Dict[str, Any]) -> None:
+    # Relayed agent commands are addressed to one worker and never reach WebSocket clients
+    if event.get("type") == AGENT_RELAY_EVENT:
+        await agent_hub.handle_relay(event)
+    else:
+        await manager.broadcast(event)
 
-    async def broadcast(self, message: dict):
-        for connection in self.active_connections:
-            try:
-                await connection.send_json(message)
-            except:
-                pass
 
-manager = ConnectionManager()
+event_bus.subscribe(_dispatch_event)
+metrics_registry.gauge("ws_connections", "Open /ws client connections", function=lambda: len(manager.connections))
+metrics_registry.gauge(
+    "device_fragments_cached", "Devices whose /api/devices JSON is pre-serialized", function=lambda: len(device_fragments)
+)
 
 # Global state managed during application lifecycle
 scheduler: Optional[BackgroundScheduler] = None
-event_loop: Optional[asyncio.AbstractEventLoop] = None
-update_lock = threading.Lock()
+# Fire-and-forget follow-up work triggered by scans (e.g. version refresh on reconnect)
+background_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="device-bg")
+# Serializes writers of device rows; wait/hold times and skipped sweeps show up in /metrics
+update_lock = InstrumentedLock("update_lock")
+presence_scan_stats: Dict[str, Any] = {"last_run": None, "duration_ms": None, "adb_devices": 0, "runs_total": 0}
+SCAN_PHASE_SECONDS = metrics_registry.histogram(
+    "device_scan_phase_seconds", "Duration of scan phases: presence sweep, deep probe run, full scan", ["phase"]
+)
+SCAN_ERRORS_TOTAL = metrics_registry.counter("device_scan_errors_total", "Scan phases that failed", ["phase"])
+DEEP_PROBE_SECONDS = metrics_registry.histogram(
+    "device_deep_probe_seconds", "Per-device run time of each deep probe", ["probe"]
+)
+DEEP_PROBE_FAILURES = metrics_registry.counter(
+    "device_deep_probe_failures_total", "Deep probe runs that failed or hit a failing device", ["probe"]
+)
 
 TERMINAL_TIMEOUT_SECONDS = 600
 MAX_TERMINAL_COMMAND_CHARS = 512
-MAX_TERMINAL_RESPONSE_CHARS = 8000
-TERMINAL_LOG_PREVIEW = 800
+MAX_TERMINAL_OUTPUT_BYTES = 4 * 1024 * 1024
+UPLOAD_COPY_CHUNK_BYTES = 1024 * 1024
+USAGE_LOG_COMPACTION_INTERVAL_HOURS = 6
+# Terminal operations after which cached device probes can no longer be trusted
+CACHE_INVALIDATING_ADB_COMMANDS = {"reboot", "install", "uninstall", "push", "reconnect"}
+TELEMETRY_SAMPLER_WORKERS = 8
+SCAN_PROBE_WORKERS = 8
+# A scan never waits longer than this for one device's probes
+SCAN_PROBE_BUDGET_SECONDS = 25
+# "lease": every worker competes for the scanner lease and only the holder scans;
+# "external": this process only serves requests and a separate scanner.py scans
+SCANNER_MODE = os.environ.get("SCANNER_MODE", "lease")
+if SCANNER_MODE not in ("lease", "external"):
+    raise ValueError(f"Unknown SCANNER_MODE {SCANNER_MODE!r}")
+# /api/health/scanner reports unhealthy once the last presence sweep is older than this
+SCANNER_MAX_LAG_SECONDS = float(os.environ.get("SCANNER_MAX_LAG_SECONDS", "60"))
+# How long request handlers reuse the lease row's last_scan_at before reading it again
+FLEET_FRESHNESS_CACHE_SECONDS = 2
+PRESENCE_SCAN_INTERVAL_SECONDS = 5
+DEEP_PROBE_TICK_SECONDS = 5
+FLEET_VERSION_WORKERS = 8
+DF_SECTION_MARKER = "__DM_DF__"
+MOUNT_PROBE_ATTEMPTS = 3
+MOUNT_PROBE_BACKOFF_SECONDS = 0.5
+DEFAULT_MOUNT_POINTS = ["/", "/data", "/data/zhuimi"]
+# Per device group overrides, e.g. FILESYSTEM_MOUNT_POINTS='{"lab-b": ["/", "/data", "/mnt/media"]}'
+MOUNT_POINTS_BY_GROUP: Dict[str, List[str]] = json.loads(os.environ.get("FILESYSTEM_MOUNT_POINTS", "{}"))
+TELEMETRY_DISK_METRICS = {
+    "/": "disk.root.used_percent",
+    "/data": "disk.data.used_percent",
+    "/data/zhuimi": "disk.zhuimi.used_percent",
+}
 ALLOWED_ADB_BASE_COMMANDS = {
     "shell",
     "logcat",
@@ -127,20 +258,18 @@ def _truncate(text: Optional[str], limit: int) -> Optional[str]:
 
 
 def _record_device_log(
-    db: Session,
     device: DBDevice,
     current_user: DBUser,
     action: str,
     notes: Optional[str] = None,
 ) -> None:
-    log_entry = DBDeviceUsageLog(
+    """Queue a usage-log row; the audit writer commits it in the background."""
+    audit_writer.enqueue(
         device_id=device.id,
         user_id=current_user.id,
         action=action,
         notes=notes,
     )
-    db.add(log_entry)
-    db.commit()
 
 
 def _ensure_device_control_permission(device: DBDevice, current_user: DBUser) -> None:
@@ -165,7 +294,11 @@ def _prepare_adb_command(device_id: str, command: str) -> List[str]:
     if any(delimiter in command for delimiter in ["\\n", "\r", "&&", "||"]):
         raise HTTPException(status_code=400, detail="Chained commands are not allowed")
 
-    original_tokens = shlex.split(command)
+    try:
+        original_tokens = shlex.split(command)
+    except ValueError:
+        # Unbalanced quotes or a trailing backslash
+        original_tokens = []
     if not original_tokens:
         raise HTTPException(status_code=400, detail="Unable to parse command")
 
@@ -191,38 +324,103 @@ def _prepare_adb_command(device_id: str, command: str) -> List[str]:
         raise HTTPException(status_code=400, detail=f"Command '{base_command}' is not permitted")
 
     if normalized_base not in ALLOWED_ADB_BASE_COMMANDS:
-        shell_payload = " ".join(original_tokens).lower()
-        for pattern in DISALLOWED_SHELL_PATTERNS:
-            if shell_payload.startswith(pattern) or pattern in shell_payload:
-                raise HTTPException(status_code=400, detail=f"Shell command containing '{pattern}' is not permitted")
-
+        _check_shell_payload(original_tokens)
         return ["adb", "-s", device_id, "shell", *original_tokens]
 
     if normalized_base == "shell" and len(tokens) > 1:
-        shell_payload = " ".join(tokens[1:]).lower()
-        for pattern in DISALLOWED_SHELL_PATTERNS:
-            if shell_payload.startswith(pattern) or pattern in shell_payload:
-                raise HTTPException(status_code=400, detail=f"Shell command containing '{pattern}' is not permitted")
+        _check_shell_payload(tokens[1:])
 
     return ["adb", "-s", device_id, *tokens]
 
 
-async def _execute_adb_command(command_tokens: List[str]) -> Dict[str, Any]:
-    process = await asyncio.create_subprocess_exec(
-        *command_tokens,
-        stdout=aio_subprocess.PIPE,
-        stderr=aio_subprocess.PIPE,
-    )
+def _check_shell_payload(tokens: List[str]) -> None:
+    shell_payload = " ".join(tokens).lower()
+    for pattern in DISALLOWED_SHELL_PATTERNS:
+        if shell_payload.startswith(pattern) or pattern in shell_payload:
+            raise HTTPException(status_code=400, detail=f"Shell command containing '{pattern}' is not permitted")
 
-    stdout_bytes, stderr_bytes = await process.communicate()
-    stdout = stdout_bytes.decode("utf-8", errors="replace")
-    stderr = stderr_bytes.decode("utf-8", errors="replace")
 
-    return {
-        "returncode": process.returncode,
-        "stdout": stdout,
-        "stderr": stderr,
-    }
+def _check_shell_line(device_id: str, line: str) -> None:
+    """Apply the terminal command policy to a line typed into a persistent shell.
+
+    A foreground program reading raw keystrokes (top, an editor) can consume
+    the start of a line, leaving the shell a suffix of it, so the line and
+    every suffix of it that parses are checked against the shell patterns,
+    whatever adb command the line would be in command mode.
+    """
+    _prepare_adb_command(device_id, line)
+    for start in range(len(line)):
+        try:
+            tokens = shlex.split(line[start:])
+        except ValueError:
+            continue
+        _check_shell_payload(tokens)
+
+
+def _adb_http_error(exc: Exception, action: str) -> HTTPException:
+    """Map scheduler failures to 503 (breaker open) and 504 (deadline exceeded)."""
+    if isinstance(exc, DeviceUnavailableError):
+        return HTTPException(
+            status_code=503,
+            detail=str(exc),
+            headers={"Retry-After": str(max(1, int(exc.retry_in)))},
+        )
+    if isinstance(exc, subprocess.TimeoutExpired):
+        return HTTPException(status_code=504, detail=f"{action} timed out after {exc.timeout:g}s")
+    return HTTPException(status_code=500, detail=f"{action} failed: {exc}")
+
+
+async def _execute_adb_command(
+    command_tokens: List[str],
+    priority: int = ADB_PRIORITY_USER,
+    user: Optional[str] = None,
+) -> Dict[str, Any]:
+    try:
+        return await adb_scheduler.run_async(command_tokens, priority, user)
+    except (DeviceUnavailableError, subprocess.TimeoutExpired, AgentCommandError) as exc:
+        raise _adb_http_error(exc, " ".join(command_tokens[3:4]) or "adb command")
+
+
+async def _stream_adb_command(
+    command_tokens: List[str],
+    on_chunk: Callable[[str, str], Awaitable[None]],
+    cancel_event: asyncio.Event,
+    max_output_bytes: int = MAX_TERMINAL_OUTPUT_BYTES,
+    user: Optional[str] = None,
+) -> Dict[str, Any]:
+    """Run an adb command and hand stdout/stderr chunks to `on_chunk` as they arrive.
+
+    The command waits for an interactive slot from the adb scheduler and
+    gives it back once the process is running, so a long `logcat` or `top`
+    does not keep probes and other users off the device. The
+    process is killed once the combined output exceeds `max_output_bytes`,
+    when `cancel_event` is set or after TERMINAL_COMMAND_TIMEOUT_SECONDS.
+    Only the first TERMINAL_LOG_PREVIEW characters of each stream are kept in
+    the returned result. Terminal commands bypass the circuit breaker: a
+    person typing at the device is exactly how a wedged one gets diagnosed.
+    Devices attached to an agent are streamed from that agent.
+    """
+    device_id = adb_target(command_tokens)
+    release_slot = await adb_scheduler.acquire_async(device_id, ADB_PRIORITY_INTERACTIVE, user)
+    try:
+        if cancel_event.is_set():
+            return {"returncode": None, "stdout": "", "stderr": "", "status": "cancelled", "output_bytes": 0}
+        agent_id = agent_hub.owner(device_id)
+        if agent_id is None:
+            routed = adb_shards.route(command_tokens)
+            return await stream_process_output(
+                routed, on_chunk, cancel_event, max_output_bytes, adb_shards.env_for(routed), on_started=release_slot
+            )
+        # The agent schedules the process against its own slots
+        release_slot()
+        try:
+            return await agent_hub.stream(
+                agent_id, command_tokens, on_chunk, cancel_event, max_output_bytes, ADB_PRIORITY_INTERACTIVE, user
+            )
+        except AgentCommandError as exc:
+            return {"returncode": None, "stdout": "", "stderr": str(exc), "status": "error", "output_bytes": 0}
+    finally:
+        release_slot()
 
 
 def _build_command_log(command: str, result: Dict[str, Any], status: str) -> str:
@@ -236,121 +434,34 @@ def _build_command_log(command: str, result: Dict[str, Any], status: str) -> str
     return json.dumps(payload, ensure_ascii=False)
 
 
-def _broadcast_device_update(timestamp: datetime) -> None:
-    """Send device update notifications to connected WebSocket clients."""
-    loop = getattr(app.state, "event_loop", None)
-    if not loop or not loop.is_running():
-        logger.debug("Event loop is not available for WebSocket broadcast")
-        return
-
-    future = asyncio.run_coroutine_threadsafe(
-        manager.broadcast({
-            "type": "device_update",
-            "timestamp": timestamp.isoformat(),
-        }),
-        loop,
+def get_bluetoothctl_infos(
+    device_id: str,
+    macs: List[str],
+    priority: int = ADB_PRIORITY_BACKGROUND,
+    user: Optional[str] = None,
+) -> Dict[str, Tuple[Dict[str, Any], str]]:
+    """`bluetoothctl info` of several peers in one adb round trip, as mac -> (parsed, raw output).
+
+    Peers bluetoothctl has no information about are left out.
+    """
+    if not macs:
+        return {}
+    script = "; ".join(f"bluetoothctl info {shlex.quote(mac)}" for mac in macs)
+    # The exit status is that of the last peer only; each block speaks for itself
+    result = adb_scheduler.run(
+        ["adb", "-s", device_id, "shell", script], priority, user, capture_output=True, text=True, check=False
     )
+    raw_blocks = split_bluetoothctl_info(result.stdout)
+    infos = {}
+    for parsed in parse_bluetoothctl_info_blocks(result.stdout):
+        mac = parsed["mac"]
+        # `Device <mac> not available` is a header without any fields
+        if mac in raw_blocks and parsed["connected"] is not None:
+            infos[mac] = (parsed, raw_blocks[mac])
+    return infos
 
-    def _log_future_result(fut: asyncio.Future) -> None:
-        try:
-            fut.result()
-        except Exception as exc:  # pragma: no cover - log unexpected broadcast errors
-            logger.error("WebSocket broadcast failed: %s", exc)
-
-    future.add_done_callback(_log_future_result)
-
-def parse_bluetoothctl_info(text: str) -> Dict[str, Any]:
-    """Parse `bluetoothctl info` output into structured fields."""
-    parsed: Dict[str, Any] = {
-        "mac": None,
-        "name": None,
-        "alias": None,
-        "class": None,
-        "icon": None,
-        "connected": None,
-        "paired": None,
-        "trusted": None,
-        "blocked": None,
-        "rssi": None,
-        "tx_power": None,
-        "modalias": None,
-        "services_resolved": None,
-        "uuids": [],
-        "manufacturer_data": {},
-    }
-
-    if not text:
-        return parsed
-
-    r_device = re.compile(r"^Device\s+([0-9A-Fa-f:]{17})")
-    r_kv = re.compile(r"^(\w[\w\s]+?):\s*(.*)$")
-    r_uuid = re.compile(r"^UUID:\s*([0-9a-fA-F\-]{4,})\s*(?:\((.*?)\))?$")
-
-    for raw in text.splitlines():
-        line = raw.strip()
-        if not line:
-            continue
-
-        m_dev = r_device.match(line)
-        if m_dev:
-            parsed["mac"] = m_dev.group(1)
-            continue
-
-        m_uuid = r_uuid.match(line)
-        if m_uuid:
-            parsed["uuids"].append({
-                "uuid": m_uuid.group(1),
-                "desc": m_uuid.group(2) or None,
-            })
-            continue
 
-        m = r_kv.match(line)
-        if not m:
-            continue
-        key = m.group(1).strip()
-        val = m.group(2).strip()
-
-        k = key.lower().replace(" ", "_")
-        if k == "name":
-            parsed["name"] = val or None
-        elif k == "alias":
-            parsed["alias"] = val or None
-        elif k == "class":
-            parsed["class"] = val or None
-        elif k == "icon":
-            parsed["icon"] = val or None
-        elif k == "connected":
-            parsed["connected"] = val.lower() == "yes"
-        elif k == "paired":
-            parsed["paired"] = val.lower() == "yes"
-        elif k == "trusted":
-            parsed["trusted"] = val.lower() == "yes"
-        elif k == "blocked":
-            parsed["blocked"] = val.lower() == "yes"
-        elif k == "rssi":
-            try:
-                parsed["rssi"] = int(val)
-            except ValueError:
-                parsed["rssi"] = None
-        elif k == "tx_power":
-            try:
-                parsed["tx_power"] = int(val)
-            except ValueError:
-                parsed["tx_power"] = None
-        elif k == "modalias":
-            parsed["modalias"] = val or None
-        elif k == "services_resolved":
-            parsed["services_resolved"] = val.lower() == "yes"
-        elif key.startswith("ManufacturerData") or key.startswith("Manufacturer Data"):
-            parts = val.split(None, 1)
-            md_key = parts[0] if parts else None
-            md_val = parts[1] if len(parts) > 1 else ""
-            if md_key:
-                parsed["manufacturer_data"][md_key] = md_val
-
-    return parsed
-
-def get_adb_bluetooth_info(device_id: str) -> Dict[str, Any]:
+def get_adb_bluetooth_info(device_id: str, priority: int = ADB_PRIORITY_BACKGROUND, user: Optional[str] = None) -> Dict[str, Any]:
     """Get Bluetooth information for an ADB device."""
     bluetooth_info = {
         "bluetooth_name": None,
@@ -361,54 +472,31 @@ def get_adb_bluetooth_info(device_id: str) -> Dict[str, Any]:
     try:
         # Get Bluetooth controller info using bluetoothctl show
         show_cmd = ["adb", "-s", device_id, "shell", "bluetoothctl", "show"]
-        show_result = subprocess.run(show_cmd, capture_output=True, text=True, check=True)
-        
-        # Parse bluetooth controller info
-        controller_name = None
-        controller_alias = None
-        
-        for line in show_result.stdout.split('\n'):
-            line = line.strip()
-            if line.startswith('Name:'):
-                controller_name = line.split(':', 1)[1].strip()
-            elif line.startswith('Alias:'):
-                controller_alias = line.split(':', 1)[1].strip()
-            elif line.startswith('Powered:'):
-                bluetooth_info["bluetooth_enabled"] = 'yes' in line.lower()
-        
+        show_result = adb_scheduler.run(show_cmd, priority, user, capture_output=True, text=True, check=True)
+        controller = parse_bluetoothctl_show(show_result.stdout)
+        bluetooth_info["bluetooth_enabled"] = controller["powered"]
         # Use Alias if available, otherwise use Name
-        bluetooth_info["bluetooth_name"] = controller_alias or controller_name
+        bluetooth_info["bluetooth_name"] = controller["alias"] or controller["name"]
         
         # Get connected devices using bluetoothctl devices Connected
         devices_cmd = ["adb", "-s", device_id, "shell", "bluetoothctl", "devices", "Connected"]
-        devices_result = subprocess.run(devices_cmd, capture_output=True, text=True, check=True)
-        
-        # Parse connected devices
-        for line in devices_result.stdout.split('\n'):
-            line = line.strip()
-            if line.startswith('Device '):
-                parts = line.split(' ', 2)
-                if len(parts) >= 2:
-                    mac_addr = parts[1]
-                    device_name = parts[2] if len(parts) > 2 else "Unknown"
-                    
-                    # Get detailed info for this connected device
-                    info_cmd = ["adb", "-s", device_id, "shell", "bluetoothctl", "info", mac_addr]
-                    info_result = subprocess.run(info_cmd, capture_output=True, text=True, check=True)
-                    parsed_info = parse_bluetoothctl_info(info_result.stdout)
-                    
-                    bluetooth_info["connected_devices"].append({
-                        "mac": mac_addr,
-                        "name": device_name,
-                        "detailed_info": parsed_info
-                    })
+        devices_result = adb_scheduler.run(devices_cmd, priority, user, capture_output=True, text=True, check=True)
+        connected = parse_bluetoothctl_devices(devices_result.stdout)
+        infos = get_bluetoothctl_infos(device_id, [mac for mac, _ in connected], priority, user)
+        for mac_addr, device_name in connected:
+            if mac_addr in infos:
+                bluetooth_info["connected_devices"].append({
+                    "mac": mac_addr,
+                    "name": device_name,
+                    "detailed_info": infos[mac_addr][0]
+                })
     
-    except (subprocess.CalledProcessError, FileNotFoundError):
+    except (subprocess.SubprocessError, FileNotFoundError):
         pass
     
     return bluetooth_info
 
-def get_adb_wifi_ap_info(device_id: str) -> Dict[str, Any]:
+def get_adb_wifi_ap_info(device_id: str, priority: int = ADB_PRIORITY_BACKGROUND, user: Optional[str] = None) -> Dict[str, Any]:
     """Get WiFi AP information for an ADB device."""
     wifi_ap_info = {
         "ap_name": None,
@@ -419,7 +507,7 @@ def get_adb_wifi_ap_info(device_id: str) -> Dict[str, Any]:
     try:
         # Try to read the hostapd configuration file
         config_cmd = ["adb", "-s", device_id, "shell", "cat", "/data/misc/wifi/hostapd_ac40-wpa2.conf"]
-        config_result = subprocess.run(config_cmd, capture_output=True, text=True, check=True)
+        config_result = adb_scheduler.run(config_cmd, priority, user, capture_output=True, text=True, check=True)
         
         if config_result.stdout.strip():
             wifi_ap_info["config_found"] = True
@@ -432,7 +520,7 @@ def get_adb_wifi_ap_info(device_id: str) -> Dict[str, Any]:
                 elif line.startswith('wpa_passphrase='):
                     wifi_ap_info["ap_password"] = line.split('=', 1)[1].strip()
     
-    except (subprocess.CalledProcessError, FileNotFoundError):
+    except (subprocess.SubprocessError, FileNotFoundError):
         pass
     
     return wifi_ap_info
@@ -442,17 +530,10 @@ def get_adb_device_alias(device_id: str) -> str:
     try:
         # Get Bluetooth controller info to extract alias
         show_cmd = ["adb", "-s", device_id, "shell", "bluetoothctl", "show"]
-        show_result = subprocess.run(show_cmd, capture_output=True, text=True, check=True)
-        
-        alias_name = None
-        controller_name = None
-        
-        for line in show_result.stdout.split('\n'):
-            line = line.strip()
-            if line.startswith('Alias:'):
-                alias_name = line.split(':', 1)[1].strip()
-            elif line.startswith('Name:'):
-                controller_name = line.split(':', 1)[1].strip()
+        show_result = adb_scheduler.run(show_cmd, capture_output=True, text=True, check=True)
+        controller = parse_bluetoothctl_show(show_result.stdout)
+        alias_name = controller["alias"]
+        controller_name = controller["name"]
         
         # Prefer Alias over Name, but avoid generic names
         if alias_name and not alias_name.startswith('BlueZ'):
@@ -460,453 +541,961 @@ def get_adb_device_alias(device_id: str) -> str:
         elif controller_name and not controller_name.startswith('BlueZ'):
             return controller_name
     
-    except (subprocess.CalledProcessError, FileNotFoundError):
+    except (subprocess.SubprocessError, FileNotFoundError):
         pass
     
     return None
 
 
-
-def parse_mount_output(mount_output: str) -> Dict[str, Dict[str, Any]]:
-    """Parse `mount` command output into a dictionary keyed by mount point."""
-    mounts: Dict[str, Dict[str, Any]] = {}
-    pattern = re.compile(r"^(?P<source>\S+) on (?P<mountpoint>\S+) type (?P<fstype>\S+) \((?P<options>[^)]*)\)")
-
-    for raw_line in mount_output.splitlines():
-        line = raw_line.strip()
-        if not line:
+def _build_df_script(paths: List[str]) -> str:
+    """Shell snippet printing a marker line followed by `df -k` output for each path."""
+    parts = []
+    for path in paths:
+        quoted = shlex.quote(path)
+        parts.append(f"echo {DF_SECTION_MARKER} {quoted}; df -k {quoted} 2>&1")
+    # Exit 0 so a missing path is reported per section instead of failing the probe
+    parts.append("true")
+    return "; ".join(parts)
+
+
+def _split_df_sections(output: str) -> Tuple[str, Dict[str, str]]:
+    """Split combined probe output into the text before the first marker and per-path df output."""
+    preamble: List[str] = []
+    sections: Dict[str, List[str]] = {}
+    current: Optional[List[str]] = None
+
+    for line in output.splitlines():
+        if line.startswith(DF_SECTION_MARKER + " "):
+            current = sections.setdefault(line[len(DF_SECTION_MARKER) + 1:].strip(), [])
             continue
+        (current if current is not None else preamble).append(line)
 
-        match = pattern.match(line)
-        if not match:
-            continue
+    return "\n".join(preamble), {path: "\n".join(lines) for path, lines in sections.items()}
 
-        options = [opt.strip() for opt in match.group("options").split(',') if opt.strip()]
-        mounts[match.group("mountpoint")] = {
-            "source": match.group("source"),
-            "fstype": match.group("fstype"),
-            "options": options,
-            "writable": any(opt.startswith("rw") for opt in options)
+
+def _build_path_usage(path: str, df_output: Optional[str]) -> Dict[str, Any]:
+    parsed = parse_df_output(df_output or "")
+    # stderr is merged into each section, so "df: <path>: No such file" parses as a row without sizes
+    if not parsed or parsed.get("size_kb") is None:
+        return {
+            "path": path,
+            "success": False,
+            "error": (df_output or "").strip() or "Unable to parse df output",
+            "raw_output": df_output,
         }
 
-    return mounts
+    if parsed.get("used_percent") is None:
+        size_kb = parsed.get("size_kb")
+        used_kb = parsed.get("used_kb")
+        if size_kb and used_kb is not None and size_kb > 0:
+            parsed["used_percent"] = (used_kb / size_kb) * 100
 
+    return {
+        "path": path,
+        "success": True,
+        **parsed,
+        "raw_output": df_output,
+    }
 
-def _parse_int(value: str) -> Optional[int]:
-    """Convert numeric strings that may include commas into integers."""
-    if value is None:
-        return None
-    stripped = value.replace(',', '').strip()
-    if not stripped:
-        return None
+
+def collect_path_usage(device_id: str, paths: List[str]) -> Dict[str, Dict[str, Any]]:
+    """Gather filesystem usage statistics for the given paths with one `adb shell` call."""
+    cmd = ["adb", "-s", device_id, "shell", _build_df_script(paths)]
     try:
-        return int(stripped)
-    except ValueError:
-        return None
+        result = adb_scheduler.run(
+            cmd,
+            capture_output=True,
+            text=True,
+            check=False,
+        )
+    except (subprocess.SubprocessError, FileNotFoundError) as exc:
+        return {
+            path: {"path": path, "success": False, "error": str(exc), "raw_output": None}
+            for path in paths
+        }
 
+    _, sections = _split_df_sections(result.stdout)
+    usage: Dict[str, Dict[str, Any]] = {}
+    for path in paths:
+        if path in sections:
+            usage[path] = _build_path_usage(path, sections[path])
+        else:
+            usage[path] = {
+                "path": path,
+                "success": False,
+                "error": result.stderr.strip() or "No df output for path",
+                "raw_output": None,
+            }
+    return usage
 
-def _parse_percent(value: str) -> Optional[float]:
-    """Parse percentage strings such as '45%' into float values."""
-    if value is None:
-        return None
-    stripped = value.strip().rstrip('%')
-    if not stripped:
-        return None
-    try:
-        return float(stripped)
-    except ValueError:
-        return None
 
+def _map_within_budget(fn: Callable[[Any], Any], items: List[Any], budget: float) -> List[Any]:
+    """Run `fn` over items in parallel; items not finished within `budget` seconds yield None.
 
-def parse_df_output(df_output: str) -> Optional[Dict[str, Any]]:
-    """Parse `df` command output (single path) into structured usage details."""
-    if not df_output:
-        return None
+    Stragglers keep running in the background until their own adb deadline
+    fires, but the caller is not held up by them.
+    """
+    if not items:
+        return []
+    pool = ThreadPoolExecutor(max_workers=min(SCAN_PROBE_WORKERS, len(items)), thread_name_prefix="scan-probe")
+    try:
+        # Each task runs in a copy of the caller's context so an armed scan profile sees its SQL and adb time
+        futures = [pool.submit(contextvars.copy_context().run, fn, item) for item in items]
+        wait_futures(futures, timeout=budget)
+        results = []
+        for item, future in zip(items, futures):
+            if not future.done():
+                logger.warning("Scan probe for %s exceeded the %.0fs budget", item, budget)
+                results.append(None)
+            elif future.exception() is not None:
+                logger.warning("Scan probe for %s failed: %s", item, future.exception())
+                results.append(None)
+            else:
+                results.append(future.result())
+        return results
+    finally:
+        pool.shutdown(wait=False)
 
-    data_lines = []
-    for raw_line in df_output.splitlines():
-        line = raw_line.strip()
-        if not line:
-            continue
-        if line.lower().startswith("filesystem"):
-            continue
-        data_lines.append(line)
 
-    if not data_lines:
-        return None
+def _probe_adb_device(device_id: str) -> Dict[str, Any]:
+    """Collect alias, Bluetooth and Wi-Fi AP details of one online ADB device."""
+    device_alias = get_adb_device_alias(device_id)
+    bluetooth_info = get_adb_bluetooth_info(device_id)
+    wifi_ap_info = get_adb_wifi_ap_info(device_id)
+    return {
+        "name": device_alias or f"Camera Device {device_id}",
+        "bluetooth_info": bluetooth_info,
+        "wifi_ap_info": wifi_ap_info,
+    }
 
-    last_line = data_lines[-1]
-    parts = re.split(r"\s+", last_line)
-    if len(parts) < 6:
-        return None
 
-    filesystem = parts[0]
-    size_kb = _parse_int(parts[-5])
-    used_kb = _parse_int(parts[-4])
-    available_kb = _parse_int(parts[-3])
-    used_percent = _parse_percent(parts[-2])
-    mounted_on = parts[-1]
+def scan_adb_devices() -> List[Dict[str, Any]]:
+    """Scan for ADB devices and return structured data.
 
-    used_ratio = None
-    if size_kb and used_kb is not None and size_kb > 0:
-        used_ratio = used_kb / size_kb
+    Online devices are probed in parallel. A device whose probes time out,
+    hit an open circuit breaker or overrun SCAN_PROBE_BUDGET_SECONDS is
+    returned with `degraded: True` so the last good details are kept.
+    """
+    devices = []
+    try:
+        result = adb_scheduler.run(["adb", "devices"], capture_output=True, text=True, check=True)
+    except (subprocess.SubprocessError, FileNotFoundError):
+        return devices
+
+    listed = []
+    for line in result.stdout.strip().split("\n")[1:]:
+        if line and "\t" in line:
+            parts = line.split("\t")
+            listed.append((parts[0], parts[1] if len(parts) > 1 else "unknown"))
+
+    online_ids = [device_id for device_id, adb_state in listed if adb_state == "device"]
+    probes = dict(zip(online_ids, _map_within_budget(_probe_adb_device, online_ids, SCAN_PROBE_BUDGET_SECONDS)))
+
+    for device_id, adb_state in listed:
+        probe = probes.get(device_id)
+        degraded = adb_state == "device" and (
+            probe is None or device_breakers.snapshot(device_id)["consecutive_failures"] > 0
+        )
+        devices.append({
+            "device_id": device_id,
+            "device_type": "adb",
+            "name": probe["name"] if probe else f"Camera Device {device_id}",
+            "status": "online" if adb_state == "device" else "offline",
+            "degraded": degraded,
+            "connection_info": {
+                "adb_status": adb_state,
+                "bluetooth_info": probe["bluetooth_info"] if probe else {},
+                "wifi_ap_info": probe["wifi_ap_info"] if probe else {},
+            },
+        })
+    return devices
 
-    return {
-        "filesystem": filesystem,
-        "mounted_on": mounted_on,
-        "size_kb": size_kb,
-        "used_kb": used_kb,
-        "available_kb": available_kb,
-        "used_percent": used_percent,
-        "used_ratio": used_ratio,
-        "raw_line": last_line,
-    }
 
+def _scan_bluetooth_peers(adb_id: str) -> List[Dict[str, Any]]:
+    """List Bluetooth peers known to one ADB host with their `bluetoothctl info`."""
+    peers = []
+    cmd = ["adb", "-s", adb_id, "shell", "bluetoothctl", "devices"]
+    try:
+        bt_result = adb_scheduler.run(cmd, capture_output=True, text=True, check=True)
+    except (subprocess.SubprocessError, FileNotFoundError):
+        return peers
 
-def collect_path_usage(device_id: str, paths: List[str]) -> Dict[str, Dict[str, Any]]:
-    """Gather filesystem usage statistics for the given paths via `adb df`."""
-    usage: Dict[str, Dict[str, Any]] = {}
+    known = parse_bluetoothctl_devices(bt_result.stdout)
+    try:
+        infos = get_bluetoothctl_infos(adb_id, [mac for mac, _ in known])
+    except (subprocess.SubprocessError, FileNotFoundError):
+        return peers
 
-    for path in paths:
-        cmd = ["adb", "-s", device_id, "shell", "df", "-k", path]
-        try:
-            result = subprocess.run(
-                cmd,
-                capture_output=True,
-                text=True,
-                check=False,
-            )
-        except (subprocess.SubprocessError, FileNotFoundError) as exc:
-            usage[path] = {
-                "path": path,
-                "success": False,
-                "error": str(exc),
-                "raw_output": None,
-            }
+    for mac_addr, device_name in known:
+        if mac_addr not in infos:
             continue
+        parsed_info, raw_output = infos[mac_addr]
+        peers.append({
+            "device_id": mac_addr,
+            "device_type": "bluetooth",
+            "name": device_name,
+            "status": "online" if parsed_info.get("connected") else "offline",
+            "connection_info": {
+                "adb_host": adb_id,
+                "bluetooth_info": parsed_info,
+                "raw_output": raw_output
+            }
+        })
+    return peers
 
-        parsed = parse_df_output(result.stdout)
-        if parsed:
-            used_percent = parsed.get("used_percent")
-            if used_percent is None:
-                size_kb = parsed.get("size_kb")
-                used_kb = parsed.get("used_kb")
-                if size_kb and used_kb is not None and size_kb > 0:
-                    parsed["used_percent"] = (used_kb / size_kb) * 100
 
-            usage[path] = {
-                "path": path,
-                "success": True,
-                **parsed,
-                "raw_output": result.stdout,
-            }
-        else:
-            error_message = result.stderr.strip() or "Unable to parse df output"
-            usage[path] = {
-                "path": path,
-                "success": False,
-                "error": error_message,
-                "raw_output": result.stdout,
-            }
+def scan_bluetooth_devices() -> List[Dict[str, Any]]:
+    """Scan for Bluetooth devices and return structured data."""
+    devices = []
+    try:
+        # Get ADB devices first
+        adb_result = adb_scheduler.run(["adb", "devices"], capture_output=True, text=True, check=True)
+    except (subprocess.SubprocessError, FileNotFoundError):
+        return devices
+
+    adb_lines = adb_result.stdout.strip().split("\n")[1:]
+    adb_device_ids = [line.split("\t")[0] for line in adb_lines if line and "\tdevice" in line]
+    for peers in _map_within_budget(_scan_bluetooth_peers, adb_device_ids, SCAN_PROBE_BUDGET_SECONDS):
+        devices.extend(peers or [])
+    return devices
 
-    return usage
+# Columns whose changes clients are not told about (bumped by every presence sweep)
+DEVICE_UPDATE_IGNORED_COLUMNS = {"last_seen", "row_version"}
+FLEET_REVISION_ROW_ID = 1
 
 
-def parse_version_output(version_output: str) -> Dict[str, Any]:
-    """Parse ql-getversion output into structured build/module versions."""
+@sa_event.listens_for(SessionLocal, "before_flush")
+def _track_device_changes(session: Session, flush_context: Any, instances: Any) -> None:
+    """Remember which devices (with their old and new groups) a session changed, for device_update events."""
+    changed: Dict[str, set] = session.info.setdefault("changed_devices", {})
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, DBUser):
+            # Occupants are embedded in device lists
+            session.info["fleet_changed"] = True
+        if not isinstance(obj, DBDevice):
+            continue
+        if obj in session.deleted:
+            changed.setdefault(obj.device_id, set()).update([obj.group_name] if obj.group_name else [])
+            session.info["fleet_changed"] = True
+            continue
+        attrs = sa_inspect(obj).attrs
+        if obj in session.new or any(
+            attr.history.has_changes() for attr in attrs if attr.key not in DEVICE_UPDATE_IGNORED_COLUMNS
+        ):
+            changed.setdefault(obj.device_id, set()).update(
+                group for group in attrs.group_name.history.sum() if group
+            )
+            session.info["fleet_changed"] = True
+            # Retires the device's cached list fragment in every process
+            obj.row_version = (obj.row_version or 0) + 1
+
+
+@sa_event.listens_for(SessionLocal, "after_flush")
+def _bump_fleet_revision_row(session: Session, flush_context: Any) -> None:
+    """Bump the fleet revision in the transaction that changed the fleet, so it commits or rolls back with it."""
+    if session.info.pop("fleet_changed", False):
+        session.connection().execute(
+            DBFleetRevision.__table__.update()
+            .where(DBFleetRevision.id == FLEET_REVISION_ROW_ID)
+            .values(revision=DBFleetRevision.revision + 1)
+        )
 
-    build_info: Dict[str, Optional[str]] = {
-        "version": None,
-        "build_time": None,
-        "hostname": None,
-        "commit": None,
-        "branch": None,
-    }
 
-    module_versions: Dict[str, Optional[str]] = {
-        "camera_soc": None,
-        "camera_mcu": None,
-        "cabin_soc": None,
-        "cabin_mcu": None,
-    }
+def fleet_revision(db: Session) -> int:
+    """The committed fleet revision; read it before the queries of the body cached under it."""
+    return db.query(DBFleetRevision.revision).filter(DBFleetRevision.id == FLEET_REVISION_ROW_ID).scalar() or 0
 
-    ic_version: Optional[str] = None
-    in_build_section = False
 
-    for raw_line in version_output.splitlines():
-        line = raw_line.strip()
-        if not line:
-            continue
+@sa_event.listens_for(DBDevice.group_name, "set", active_history=True)
+def _load_previous_group(target: DBDevice, value: Any, oldvalue: Any, initiator: Any) -> None:
+    """Makes group_name history carry the group a device is moved out of, so its subscribers hear about it."""
 
-        lower_line = line.lower()
 
-        if "build info start" in lower_line:
-            in_build_section = True
-            continue
-        if "build info end" in lower_line:
-            in_build_section = False
-            continue
+def _pop_device_changes(db: Session) -> Dict[str, set]:
+    """Devices `db` changed since the last call, as device_id -> groups; call before closing it."""
+    return db.info.pop("changed_devices", {})
 
-        if in_build_section:
-            match = re.search(r"build info\s+(?P<key>\w+)\s*(?P<value>.+)", line, re.IGNORECASE)
-            if match:
-                key = match.group("key").lower()
-                value = match.group("value").strip() or None
-                if key in build_info:
-                    build_info[key] = value
-            continue
 
-        if "geticversion" in lower_line and "version" in lower_line:
-            matches = re.findall(r"version[:：]\s*([^,\s]+)", line, re.IGNORECASE)
-            if matches:
-                ic_version = matches[-1].strip() or None
-            continue
+def _broadcast_device_update(current_time: datetime, changed: Dict[str, set]) -> None:
+    """Tell WebSocket clients of every worker which devices changed, from any thread."""
+    if not changed:
+        return
+    event_bus.publish({
+        "type": "device_update",
+        "timestamp": current_time.isoformat(),
+        "device_ids": sorted(changed),
+        "groups": sorted(set().union(*changed.values())),
+    })
 
-        if "getallversion" in lower_line and "version:" in lower_line:
-            version_str = line.rsplit("version:", 1)[1]
-            for pair in version_str.split(','):
-                key, _, value = pair.partition(':')
-                key = key.strip().lower()
-                value = value.strip() or None
-                if key in module_versions:
-                    module_versions[key] = value
-            continue
 
-    if not module_versions.get("camera_mcu") and ic_version:
-        module_versions["camera_mcu"] = ic_version
+def _publish_occupancy_event(device: DBDevice, action: str, occupant_id: Optional[int], actor: DBUser) -> None:
+    event_bus.publish({
+        "type": "occupancy",
+        "action": action,
+        "device_id": device.device_id,
+        "user_id": occupant_id,
+        "groups": [device.group_name] if device.group_name else [],
+        "actor": actor.username,
+        "timestamp": datetime.utcnow().isoformat(),
+    })
 
-    normalized: Dict[str, Any] = {
-        "host": module_versions.get("camera_soc") or build_info.get("version"),
-        "host_starflash": module_versions.get("camera_mcu"),
-        "cabin": module_versions.get("cabin_soc"),
-        "cabin_starflash": module_versions.get("cabin_mcu"),
-        "build_info": {k: v for k, v in build_info.items() if v},
-        "module_versions": module_versions,
-    }
 
-    return normalized
+def _publish_scan_event(phase: str, **details: Any) -> None:
+    event_bus.publish({"type": "scan", "phase": phase, "timestamp": datetime.utcnow().isoformat(), **details})
 
 
-def scan_adb_devices() -> List[Dict[str, Any]]:
-    """Scan for ADB devices and return structured data."""
-    devices = []
-    try:
-        result = subprocess.run(["adb", "devices"], capture_output=True, text=True, check=True)
-        lines = result.stdout.strip().split("\n")[1:]
-        for line in lines:
-            if line and "\t" in line:
-                parts = line.split("\t")
-                device_id = parts[0]
-                status = parts[1] if len(parts) > 1 else "unknown"
-                
-                # Get device alias name
-                device_alias = get_adb_device_alias(device_id) if status == "device" else None
-                device_name = device_alias or f"Camera Device {device_id}"
-                
-                # Get Bluetooth information for ADB devices
-                bluetooth_info = get_adb_bluetooth_info(device_id) if status == "device" else {}
-                
-                # Get WiFi AP information for ADB devices
-                wifi_ap_info = get_adb_wifi_ap_info(device_id) if status == "device" else {}
-                
-                connection_info = {
-                    "adb_status": status,
-                    "bluetooth_info": bluetooth_info,
-                    "wifi_ap_info": wifi_ap_info
-                }
-                
-                devices.append({
-                    "device_id": device_id,
-                    "device_type": "adb",
-                    "name": device_name,
-                    "status": "online" if status == "device" else "offline",
-                    "connection_info": connection_info
-                })
-    except (subprocess.CalledProcessError, FileNotFoundError):
-        pass
-    return devices
+def _list_shard_devices(port: int) -> List[Dict[str, str]]:
+    """`adb devices -l` against one adb server."""
+    result = adb_scheduler.run(adb_shards.shards[port].command("devices", "-l"), capture_output=True, text=True, check=True)
+    entries = parse_adb_devices_long(result.stdout)
+    adb_shards.record_listing(port, len(entries))
+    return entries
 
-def scan_bluetooth_devices() -> List[Dict[str, Any]]:
-    """Scan for Bluetooth devices and return structured data."""
-    devices = []
-    try:
-        # Get ADB devices first
-        adb_result = subprocess.run(["adb", "devices"], capture_output=True, text=True, check=True)
-        adb_lines = adb_result.stdout.strip().split("\n")[1:]
-        adb_device_ids = [line.split("\t")[0] for line in adb_lines if line and "\tdevice" in line]
-        
-        for adb_id in adb_device_ids:
-            try:
-                # Get bluetooth devices for this ADB device
-                cmd = ["adb", "-s", adb_id, "shell", "bluetoothctl", "devices"]
-                bt_result = subprocess.run(cmd, capture_output=True, text=True, check=True)
-                
-                for line in bt_result.stdout.split("\n"):
-                    line = line.strip()
-                    if line.startswith("Device "):
-                        parts = line.split(" ", 2)
-                        if len(parts) >= 2:
-                            mac_addr = parts[1]
-                            device_name = parts[2] if len(parts) > 2 else "Unknown"
-                            
-                            # Get detailed info
-                            info_cmd = ["adb", "-s", adb_id, "shell", "bluetoothctl", "info", mac_addr]
-                            info_result = subprocess.run(info_cmd, capture_output=True, text=True, check=True)
-                            parsed_info = parse_bluetoothctl_info(info_result.stdout)
-                            
-                            devices.append({
-                                "device_id": mac_addr,
-                                "device_type": "bluetooth",
-                                "name": device_name,
-                                "status": "online" if parsed_info.get("connected") else "offline",
-                                "connection_info": {
-                                    "adb_host": adb_id,
-                                    "bluetooth_info": parsed_info,
-                                    "raw_output": info_result.stdout
-                                }
-                            })
-            except (subprocess.CalledProcessError, FileNotFoundError):
-                continue
-    except (subprocess.CalledProcessError, FileNotFoundError):
-        pass
-    return devices
 
-def update_devices_in_db():
-    """Background task to update device information in database."""
+def _apply_adb_presence(
+    db: Session,
+    known: Dict[str, DBDevice],
+    entries_by_serial: Dict[str, Dict[str, str]],
+    owner_fields: Dict[str, Dict[str, Any]],
+    stale_serials: List[str],
+    current_time: datetime,
+) -> Tuple[bool, List[str]]:
+    """Upsert ADB rows from `adb devices -l` entries and take `stale_serials` offline.
+
+    `owner_fields` holds per-serial routing fields (adb server port, agent)
+    merged into connection_info. Returns whether anything changed and the
+    serials that came online.
+    """
+    changed = False
+    reconnected_device_ids = []
+    for serial, entry in entries_by_serial.items():
+        status = "online" if entry["state"] == "device" else "offline"
+        presence = {
+            "adb_status": entry["state"],
+            "transport_id": entry.get("transport_id"),
+            "product": entry.get("product"),
+            "usb": entry.get("usb"),
+            **owner_fields.get(serial, {}),
+        }
+
+        db_device = known.get(serial)
+        if db_device is None:
+            db_device = DBDevice(
+                device_id=serial,
+                device_type="adb",
+                name=f"Camera Device {serial}",
+                status=status,
+                connection_info="{}",
+                tags="[]"
+            )
+            db.add(db_device)
+            known[serial] = db_device
+            changed = True
+            if status == "online":
+                deep_probes.force(serial)
+                reconnected_device_ids.append(serial)
+        elif (db_device.status == "offline") != (status == "offline"):
+            # Reconnected or dropped devices may have rebooted or been reflashed
+            probe_cache.invalidate(serial)
+            db_device.status = status
+            changed = True
+            if status == "online":
+                deep_probes.force(serial)
+                reconnected_device_ids.append(serial)
+
+        connection_info = json.loads(db_device.connection_info) if db_device.connection_info else {}
+        model = entry.get("model")
+        # Only fill the model column while it still holds what adb reported, never over an admin edit
+        if model and db_device.model in (None, "", connection_info.get("adb_model")) and db_device.model != model:
+            db_device.model = model
+            changed = True
+        if model:
+            presence["adb_model"] = model
+        if any(connection_info.get(key) != value for key, value in presence.items()):
+            connection_info.update(presence)
+            db_device.connection_info = json.dumps(connection_info)
+            changed = True
+        db_device.last_seen = current_time
+
+    for serial in stale_serials:
+        db_device = known[serial]
+        if db_device.status != "offline":
+            probe_cache.invalidate(serial)
+            db_device.status = "offline"
+            changed = True
+    return changed, reconnected_device_ids
+
+
+def scan_device_presence() -> None:
+    """Fast scan tier: ADB presence, state and model from `adb devices -l`.
+
+    Every adb server shard is listed in parallel and each serial's owning
+    server is recorded as `adb_server_port` in connection_info. Devices
+    owned by an agent with a live heartbeat, on whichever worker it is
+    connected to, are left to that agent's snapshots. Status
+    changes invalidate cached probes, and devices coming online have every
+    deep probe made due. Clients are only notified when something changed.
+    """
     if not update_lock.acquire(blocking=False):
-        logger.debug("Device update skipped because a previous run is still in progress")
+        logger.debug("Presence scan skipped because a previous run is still in progress")
         return
 
+    started = time.perf_counter()
     db = SessionLocal()
     try:
-        # Scan for devices
-        adb_devices = scan_adb_devices()
-        bluetooth_devices = scan_bluetooth_devices()
-        all_scanned_devices = adb_devices + bluetooth_devices
+        ports = list(adb_shards.shards)
+        listings = _map_within_budget(_list_shard_devices, ports, ADB_OPERATION_TIMEOUTS["devices"])
+        failed_ports = {port for port, listing in zip(ports, listings) if listing is None}
+        if len(failed_ports) == len(ports):
+            return
 
         current_time = datetime.utcnow()
-        scanned_device_ids = set()
-
-        # Update or create devices
-        for device_data in all_scanned_devices:
-            scanned_device_ids.add(device_data["device_id"])
-
-            db_device = db.query(DBDevice).filter(DBDevice.device_id == device_data["device_id"]).first()
-            if db_device:
-                # Update existing device
-                db_device.name = device_data["name"]  # Update name to use Alias
-                db_device.status = device_data["status"]
-                db_device.connection_info = json.dumps(device_data["connection_info"])
-                db_device.last_seen = current_time
-            else:
-                # Create new device
-                db_device = DBDevice(
-                    device_id=device_data["device_id"],
-                    device_type=device_data["device_type"],
-                    name=device_data["name"],
-                    status=device_data["status"],
-                    connection_info=json.dumps(device_data["connection_info"]),
-                    last_seen=current_time,
-                    tags="[]"
+        known = {
+            device.device_id: device
+            for device in db.query(DBDevice).filter(DBDevice.device_type == "adb").all()
+        }
+        recorded_ports = {}
+        recorded_agents = {}
+        for serial, db_device in known.items():
+            connection_info = json.loads(db_device.connection_info or "{}")
+            recorded_ports[serial] = connection_info.get("adb_server_port")
+            recorded_agents[serial] = connection_info.get("agent_id")
+            # Routes survive restarts so device commands reach the right server before the next sweep
+            if recorded_ports[serial] is not None and adb_shards.port_for(serial) is None:
+                adb_shards.assign(serial, recorded_ports[serial])
+        # Agents may be connected to any worker; their heartbeats say which are still alive
+        agent_hub.refresh_routes()
+
+        # A serial can be listed by several servers (e.g. unauthorized on both); an online listing wins
+        entries_by_serial: Dict[str, Dict[str, str]] = {}
+        listing_states: Dict[str, Dict[int, str]] = {}
+        for port, listing in zip(ports, listings):
+            for entry in listing or []:
+                listing_states.setdefault(entry["serial"], {})[port] = entry["state"]
+                current = entries_by_serial.get(entry["serial"])
+                if current is None or (current["state"] != "device" and entry["state"] == "device"):
+                    entries_by_serial[entry["serial"]] = entry
+
+        owner_fields: Dict[str, Dict[str, Any]] = {}
+        for serial in entries_by_serial:
+            # A device plugged into this host is no longer routed to the agent that had it
+            agent_hub.release(serial)
+            owner_fields[serial] = {"agent_id": None}
+            if adb_shards.sharded:
+                owner_fields[serial]["adb_server_port"] = adb_shards.resolve_owner(
+                    serial, listing_states[serial], recorded_ports.get(serial)
                 )
-                db.add(db_device)
 
-        # Mark devices as offline if not seen
+        # Devices of a server that did not answer keep their last known status; those of a
+        # live agent are kept up to date by its snapshots
+        stale_serials = [
+            serial for serial in known
+            if serial not in entries_by_serial
+            and not (recorded_agents.get(serial) and agent_hub.alive(recorded_agents[serial]))
+            and recorded_ports.get(serial) not in failed_ports
+        ]
+        changed, reconnected_device_ids = _apply_adb_presence(
+            db, known, entries_by_serial, owner_fields, stale_serials, current_time
+        )
+
+        # Bluetooth peers are refreshed by the deep tier; expire those it has not seen lately
         offline_threshold = current_time - timedelta(minutes=5)
-        offline_devices = db.query(DBDevice).filter(
+        for device in db.query(DBDevice).filter(
+            DBDevice.device_type != "adb",
             DBDevice.last_seen < offline_threshold,
             DBDevice.status != "offline"
-        ).all()
-
-        for device in offline_devices:
-            if device.device_id not in scanned_device_ids:
-                device.status = "offline"
+        ).all():
+            device.status = "offline"
+            changed = True
 
         db.commit()
-        
-        # Broadcast update to WebSocket clients from the main event loop
-        if event_loop and not event_loop.is_closed():
-            try:
-                asyncio.run_coroutine_threadsafe(
-                    manager.broadcast({
-                        "type": "device_update",
-                        "timestamp": current_time.isoformat()
-                    }),
-                    event_loop,
-                )
-            except RuntimeError as exc:
-                print(f"Failed to schedule broadcast: {exc}")
-        else:
-            print("Event loop unavailable, skipping device update broadcast")
+        _schedule_version_refresh(reconnected_device_ids)
+        if changed:
+            _broadcast_device_update(current_time, _pop_device_changes(db))
+        presence_scan_stats.update(
+            last_run=current_time,
+            duration_ms=round((time.perf_counter() - started) * 1000, 3),
+            adb_devices=len(entries_by_serial),
+            failed_servers=sorted(failed_ports),
+            runs_total=presence_scan_stats["runs_total"] + 1,
+        )
+        boot_timer.mark("fresh_fleet")
 
     except Exception as e:
-        logger.exception("Error updating devices: %s", e)
+        logger.exception("Error during presence scan: %s", e)
+        SCAN_ERRORS_TOTAL.inc("presence")
         db.rollback()
     finally:
         db.close()
         update_lock.release()
+        SCAN_PHASE_SECONDS.observe(time.perf_counter() - started, "presence")
 
 
-@app.on_event("startup")
-async def startup_event():
-    """Initialize resources when the application starts."""
-    global scheduler
+def apply_agent_snapshot(agent_id: str, snapshot: Dict[str, Any]) -> int:
+    """Presence sweep for the devices of one agent, from the `adb devices -l` output it pushed.
 
-    create_tables()
-    loop = asyncio.get_running_loop()
-    app.state.event_loop = loop
+    Returns the number of devices the agent reported.
+    """
+    entries_by_serial = {entry["serial"]: entry for entry in parse_adb_devices_long(snapshot.get("adb_devices", ""))}
+    with update_lock:
+        db = SessionLocal()
+        try:
+            current_time = datetime.utcnow()
+            known = {
+                device.device_id: device
+                for device in db.query(DBDevice).filter(DBDevice.device_type == "adb").all()
+            }
+            stale_serials = [
+                serial for serial, db_device in known.items()
+                if serial not in entries_by_serial
+                and json.loads(db_device.connection_info or "{}").get("agent_id") == agent_id
+            ]
+            for serial in entries_by_serial:
+                agent_hub.assign(serial, agent_id)
+            owner_fields = {serial: {"agent_id": agent_id} for serial in entries_by_serial}
+            changed, reconnected_device_ids = _apply_adb_presence(
+                db, known, entries_by_serial, owner_fields, stale_serials, current_time
+            )
+            db.commit()
+            changes = _pop_device_changes(db)
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+    _schedule_version_refresh(reconnected_device_ids)
+    if changed:
+        _broadcast_device_update(current_time, changes)
+    return len(entries_by_serial)
 
-    # Run an immediate device scan without blocking the event loop
-    await loop.run_in_executor(None, update_devices_in_db)
 
-    if scheduler is None:
-        scheduler = BackgroundScheduler()
-
-    if not scheduler.running:
-        scheduler.add_job(
-            update_devices_in_db,
-            "interval",
-            seconds=30,
-            id="device_monitor",
-            replace_existing=True,
+def _mark_agent_devices_offline(agent_id: str) -> None:
+    """Take every device of a disconnected agent offline; routes stay so commands fail fast.
+
+    Skipped when the agent has already reconnected to another worker.
+    """
+    if not agent_hub.clear_heartbeat(agent_id):
+        return
+    with update_lock:
+        db = SessionLocal()
+        try:
+            owned = {
+                device.device_id: device
+                for device in db.query(DBDevice).filter(DBDevice.device_type == "adb", DBDevice.status != "offline")
+                if json.loads(device.connection_info or "{}").get("agent_id") == agent_id
+            }
+            changed, _ = _apply_adb_presence(db, owned, {}, {}, list(owned), datetime.utcnow())
+            db.commit()
+            changes = _pop_device_changes(db)
+        finally:
+            db.close()
+    if changed:
+        _broadcast_device_update(datetime.utcnow(), changes)
+
+
+def _adb_device_row(db: Session, device_id: str) -> Optional[DBDevice]:
+    return db.query(DBDevice).filter(DBDevice.device_id == device_id, DBDevice.device_type == "adb").first()
+
+
+def _apply_alias(db: Session, device_id: str, alias: Optional[str]) -> bool:
+    device = _adb_device_row(db, device_id)
+    name = alias or f"Camera Device {device_id}"
+    if device is None or device.name == name:
+        return False
+    device.name = name
+    return True
+
+
+def _connection_info_applier(field: str) -> Callable[[Session, str, Any], bool]:
+    def apply(db: Session, device_id: str, value: Any) -> bool:
+        device = _adb_device_row(db, device_id)
+        if device is None:
+            return False
+        connection_info = json.loads(device.connection_info) if device.connection_info else {}
+        if connection_info.get(field) == value:
+            return False
+        connection_info[field] = value
+        device.connection_info = json.dumps(connection_info)
+        return True
+    return apply
+
+
+def _apply_bluetooth_peers(db: Session, adb_host: str, peers: List[Dict[str, Any]]) -> bool:
+    """Upsert the Bluetooth peers seen by one ADB host."""
+    current_time = datetime.utcnow()
+    changed = False
+    for peer in peers:
+        db_device = db.query(DBDevice).filter(DBDevice.device_id == peer["device_id"]).first()
+        connection_info = json.dumps(peer["connection_info"])
+        if db_device is None:
+            db.add(DBDevice(
+                device_id=peer["device_id"],
+                device_type="bluetooth",
+                name=peer["name"],
+                status=peer["status"],
+                connection_info=connection_info,
+                last_seen=current_time,
+                tags="[]"
+            ))
+            changed = True
+            continue
+
+        if db_device.status != peer["status"]:
+            probe_cache.invalidate(db_device.device_id)
+            changed = True
+        if db_device.name != peer["name"]:
+            changed = True
+        db_device.name = peer["name"]
+        db_device.status = peer["status"]
+        db_device.connection_info = connection_info
+        db_device.last_seen = current_time
+    return changed
+
+
+def _bluetooth_controller_fingerprint(info: Dict[str, Any]) -> Any:
+    return [
+        info.get("bluetooth_name"),
+        info.get("bluetooth_enabled"),
+        sorted(peer.get("mac") for peer in info.get("connected_devices", [])),
+    ]
+
+
+def _bluetooth_peers_fingerprint(peers: List[Dict[str, Any]]) -> Any:
+    # RSSI and raw output move on every run; only membership and link state count as change
+    return sorted(
+        (peer["device_id"], peer["name"], peer["status"], peer["connection_info"]["bluetooth_info"].get("paired"))
+        for peer in peers
+    )
+
+
+deep_probes.register(DeepProbe(
+    "alias", get_adb_device_alias, _apply_alias,
+    interval_seconds=300, budget_seconds=10,
+))
+deep_probes.register(DeepProbe(
+    "bluetooth_controller", get_adb_bluetooth_info, _connection_info_applier("bluetooth_info"),
+    interval_seconds=60, budget_seconds=20, fingerprint=_bluetooth_controller_fingerprint,
+))
+deep_probes.register(DeepProbe(
+    "wifi_ap", get_adb_wifi_ap_info, _connection_info_applier("wifi_ap_info"),
+    interval_seconds=300, budget_seconds=10,
+))
+deep_probes.register(DeepProbe(
+    "bluetooth_peers", _scan_bluetooth_peers, _apply_bluetooth_peers,
+    interval_seconds=30, budget_seconds=30, fingerprint=_bluetooth_peers_fingerprint,
+))
+
+
+def run_deep_probes(
+    device_ids: Optional[List[str]] = None,
+    probes: Optional[List[str]] = None,
+    force: bool = False,
+) -> Dict[str, int]:
+    """Deep scan tier: run due probes against online ADB devices and store the results.
+
+    Each probe only takes as many devices per run as fit its cost budget,
+    most overdue first. `force` makes the selected probes due now and ignores
+    the budget (full scans, user actions).
+    """
+    started = time.perf_counter()
+    try:
+        db = SessionLocal()
+        try:
+            online_ids = [
+                row.device_id for row in db.query(DBDevice.device_id).filter(
+                    DBDevice.device_type == "adb",
+                    DBDevice.status.in_(["online", "occupied"]),
+                ).all()
+            ]
+        finally:
+            db.close()
+        if device_ids is not None:
+            wanted = set(device_ids)
+            online_ids = [device_id for device_id in online_ids if device_id in wanted]
+
+        summary: Dict[str, int] = {}
+        changes: Dict[str, set] = {}
+        changed = False
+        for name in probes or list(deep_probes.probes):
+            probe = deep_probes.probes[name]
+            if force:
+                for device_id in online_ids:
+                    deep_probes.force(device_id, [name])
+            targets = deep_probes.select_due(probe, online_ids, within_budget=not force)
+            if not targets:
+                continue
+
+            def timed_run(target: str, probe: DeepProbe = probe) -> Tuple[Any, float]:
+                started = time.perf_counter()
+                value = probe.run(target)
+                return value, time.perf_counter() - started
+
+            results = []
+            for target, outcome in zip(targets, _map_within_budget(timed_run, targets, SCAN_PROBE_BUDGET_SECONDS)):
+                # Probe helpers swallow adb errors and return placeholders; the breaker tells them apart
+                if outcome is None or device_breakers.snapshot(target)["consecutive_failures"] > 0:
+                    deep_probes.record_failure(probe, target)
+                    DEEP_PROBE_FAILURES.inc(name)
+                    continue
+                value, cost = outcome
+                DEEP_PROBE_SECONDS.observe(cost, name)
+                deep_probes.record(probe, target, value, cost)
+                results.append((target, value))
+            summary[name] = len(targets)
+            if results:
+                changed = _apply_probe_results(probe, results, changes) or changed
+
+        if changed:
+            _broadcast_device_update(datetime.utcnow(), changes)
+        return summary
+    except Exception as e:
+        logger.exception("Error running deep probes: %s", e)
+        SCAN_ERRORS_TOTAL.inc("deep_probes")
+        return {}
+    finally:
+        SCAN_PHASE_SECONDS.observe(time.perf_counter() - started, "deep_probes")
+
+
+def _apply_probe_results(probe: DeepProbe, results: List[Tuple[str, Any]], changes: Dict[str, set]) -> bool:
+    """Store one probe's results in a short transaction under update_lock; True if any was news.
+
+    The appliers re-read each row inside it, so fields that presence sweeps
+    and agent snapshots committed while the probes ran (adb_status,
+    adb_server_port, agent_id) are kept rather than overwritten.
+    """
+    with update_lock:
+        db = SessionLocal()
+        try:
+            changed = False
+            for target, value in results:
+                changed = probe.apply(db, target, value) or changed
+            db.commit()
+            for device_id, groups in _pop_device_changes(db).items():
+                changes.setdefault(device_id, set()).update(groups)
+            return changed
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+
+def update_devices_in_db():
+    """Full scan: presence followed by every deep probe, regardless of schedule."""
+    with profiler.profile_scan("full scan"):
+        started = time.perf_counter()
+        _publish_scan_event("started")
+        scan_device_presence()
+        probes = run_deep_probes(force=True)
+    elapsed = time.perf_counter() - started
+    SCAN_PHASE_SECONDS.observe(elapsed, "full_scan")
+    _publish_scan_event("completed", duration_ms=round(elapsed * 1000, 3), probes=probes)
+
+
+def _sample_adb_device_health(device_id: str) -> Dict[str, float]:
+    """Probe disk usage and uptime of one online ADB device."""
+    metrics: Dict[str, float] = {}
+    usage = collect_path_usage(device_id, list(TELEMETRY_DISK_METRICS))
+    for path, metric in TELEMETRY_DISK_METRICS.items():
+        entry = usage.get(path) or {}
+        if entry.get("success") and entry.get("used_percent") is not None:
+            metrics[metric] = float(entry["used_percent"])
+
+    try:
+        result = adb_scheduler.run(
+            ["adb", "-s", device_id, "shell", "cat", "/proc/uptime"],
+            capture_output=True,
+            text=True,
+            check=True,
         )
-        scheduler.start()
+        metrics["uptime_seconds"] = float(result.stdout.split()[0])
+    except (subprocess.SubprocessError, FileNotFoundError, IndexError, ValueError):
+        pass
+
+    return metrics
+
+
+def sample_device_telemetry():
+    """Background task recording one health sample per known device."""
+    db = SessionLocal()
+    try:
+        devices = db.query(
+            DBDevice.id,
+            DBDevice.device_id,
+            DBDevice.device_type,
+            DBDevice.status,
+            DBDevice.connection_info,
+        ).all()
+    finally:
+        db.close()
+
+    now = time.time()
+    samples = []
+    adb_targets = []
+    for device in devices:
+        if device.device_type == "adb":
+            online = device.status in {"online", "occupied"}
+            samples.append((device.id, "link.online", now, 1.0 if online else 0.0))
+            if online:
+                adb_targets.append(device)
+        elif device.device_type == "bluetooth":
+            # RSSI/TX power come from the last scan; no extra adb round trip needed
+            info = json.loads(device.connection_info) if device.connection_info else {}
+            bt_info = info.get("bluetooth_info") or {}
+            samples.append((device.id, "link.online", now, 1.0 if bt_info.get("connected") else 0.0))
+            for field, metric in (("rssi", "bt.rssi"), ("tx_power", "bt.tx_power")):
+                if bt_info.get(field) is not None:
+                    samples.append((device.id, metric, now, float(bt_info[field])))
+
+    if adb_targets:
+        with ThreadPoolExecutor(max_workers=TELEMETRY_SAMPLER_WORKERS) as pool:
+            results = pool.map(lambda d: _sample_adb_device_health(d.device_id), adb_targets)
+            for device, metrics in zip(adb_targets, results):
+                samples.extend((device.id, metric, now, value) for metric, value in metrics.items())
+
+    telemetry_store.record_many(samples)
 
 
 # Lifecycle management hooks
-def start_scheduler():
-    """Start the background scheduler if it is not already running."""
+def _register_scan_jobs(target: BackgroundScheduler) -> None:
+    """Register the two scan tiers (presence sweeps, scheduled deep probes) and adb server health checks."""
+    target.add_job(
+        scan_device_presence,
+        "interval",
+        seconds=PRESENCE_SCAN_INTERVAL_SECONDS,
+        id="device_presence",
+        replace_existing=True,
+    )
+    target.add_job(
+        run_deep_probes,
+        "interval",
+        seconds=DEEP_PROBE_TICK_SECONDS,
+        id="device_deep_probes",
+        # A slow tick must not overlap the next one; missed ticks collapse into one run
+        max_instances=1,
+        coalesce=True,
+        replace_existing=True,
+    )
+    target.add_job(
+        adb_shards.health_check,
+        "interval",
+        seconds=ADB_SHARD_HEALTH_INTERVAL_SECONDS,
+        id="adb_server_health",
+        replace_existing=True,
+    )
+
+
+def _register_maintenance_jobs(target: BackgroundScheduler) -> None:
+    """Register periodic housekeeping jobs that are not part of device scanning."""
+    target.add_job(
+        compact_usage_logs,
+        "interval",
+        hours=USAGE_LOG_COMPACTION_INTERVAL_HOURS,
+        id="usage_log_compaction",
+        replace_existing=True,
+    )
+    target.add_job(
+        sample_device_telemetry,
+        "interval",
+        seconds=TELEMETRY_SAMPLE_INTERVAL_SECONDS,
+        id="telemetry_sampler",
+        replace_existing=True,
+    )
+    target.add_job(
+        telemetry_store.downsample,
+        "interval",
+        hours=1,
+        id="telemetry_downsample",
+        replace_existing=True,
+    )
+
+
+def _initial_scan() -> None:
+    """First job of a newly elected scanner: bring every adb server shard up, then run a full scan."""
+    adb_shards.start_all()
+    update_devices_in_db()
+
+
+_fleet_freshness_cache: Dict[str, Any] = {"checked": None, "last_scan_at": None}
+
+
+def fleet_freshness() -> Dict[str, Any]:
+    """How current the devices table is: the last presence sweep of whichever process scans.
+
+    Right after a restart the table still holds the previous scanner's view;
+    until a sweep lands it is reported stale since that sweep (or since
+    never, when no scan was ever recorded).
+    """
+    last_scan_at = presence_scan_stats["last_run"]
+    if last_scan_at is None:
+        now = time.monotonic()
+        checked = _fleet_freshness_cache["checked"]
+        if checked is None or now - checked > FLEET_FRESHNESS_CACHE_SECONDS:
+            lease = scanner_lease.status()
+            _fleet_freshness_cache.update(checked=now, last_scan_at=lease["last_scan_at"] if lease else None)
+        last_scan_at = _fleet_freshness_cache["last_scan_at"]
+    stale = last_scan_at is None or (datetime.utcnow() - last_scan_at).total_seconds() > SCANNER_MAX_LAG_SECONDS
+    if not stale:
+        boot_timer.mark("fresh_fleet")
+    return {"last_scan_at": last_scan_at, "stale": stale, "stale_since": last_scan_at if stale else None}
+
+
+def _scanner_heartbeat() -> Dict[str, Any]:
+    """Scan progress the leader stores in the lease row on every renewal, for /api/health/scanner."""
+    heartbeat = {
+        "last_scan_at": presence_scan_stats["last_run"],
+        "last_scan_duration_ms": presence_scan_stats["duration_ms"],
+    }
+    # A freshly elected leader keeps reporting its predecessor's last sweep until its own first one
+    return {column: value for column, value in heartbeat.items() if value is not None}
+
+
+def _on_scanner_tick(leader: bool) -> None:
+    """Called after every lease renewal attempt: start or stop the scanning jobs on leadership changes."""
+    if scheduler is None:
+        return
+    scanning = scheduler.get_job("device_presence") is not None
+    if leader and not scanning:
+        _register_scan_jobs(scheduler)
+        _register_maintenance_jobs(scheduler)
+        scheduler.add_job(_initial_scan, id="initial_scan", replace_existing=True)
+    elif not leader and scanning:
+        # Jobs already running finish; nothing new starts until the lease is won back
+        scheduler.remove_all_jobs()
+        # The next scanner samples from scratch: seal what was collected here so every worker can read it
+        telemetry_store.flush()
+    if leader:
+        lease = scanner_lease.status()
+        if lease and lease["scan_requested_at"]:
+            scanner_lease.update(scan_requested_at=None)
+            scheduler.add_job(update_devices_in_db, id="requested_scan", replace_existing=True)
+
+
+def start_scanner():
+    """Start the background scheduler and compete for the scanner lease.
+
+    The scheduler only holds jobs while this process holds the lease, so a
+    deployment with several workers (or a separate scanner.py process) still
+    runs exactly one set of scans.
+    """
     global scheduler
     if scheduler and scheduler.running:
         return
 
     scheduler = BackgroundScheduler()
-    scheduler.add_job(update_devices_in_db, "interval", seconds=30)
     scheduler.start()
+    scanner_lease.start(_on_scanner_tick, _scanner_heartbeat)
 
 
-def stop_scheduler():
-    """Stop the background scheduler if it is running."""
+def stop_scanner():
+    """Hand the scanner lease over and stop the background scheduler."""
     global scheduler
+    scanner_lease.stop()
     if scheduler and scheduler.running:
         scheduler.shutdown(wait=False)
     scheduler = None
 
 
-@app.on_event("startup")
-async def on_startup() -> None:
-    """Initialize database and background services."""
-    global event_loop
-    create_tables()
-    event_loop = asyncio.get_running_loop()
-    start_scheduler()
-
-
-@app.on_event("shutdown")
-async def on_shutdown() -> None:
-    """Clean up background services."""
-    stop_scheduler()
-
 # Authentication endpoints
 @app.post("/auth/register", response_model=User)
 def register_user(user: UserCreate, db: Session = Depends(get_db)):
@@ -946,18 +1535,69 @@ def read_users_me(current_user: DBUser = Depends(get_current_active_user)):
     return current_user
 
 # Device management endpoints
-@app.get("/api/devices", response_model=List[DeviceWithUser])
-def get_devices(
-    device_type: Optional[str] = None,
-    status: Optional[str] = None,
-    search: Optional[str] = None,
-    model: Optional[str] = None,
-    group: Optional[str] = None,
-    skip: int = 0,
-    limit: int = 100,
-    db: Session = Depends(get_db)
-):
-    query = db.query(DBDevice)
+DEVICE_FIELDS = DEVICE_ROW_FIELDS + ("user", "breaker", "stale", "stale_since")
+DEVICE_SUMMARY_FIELDS = (
+    "id", "device_id", "device_type", "name", "model", "status", "group_name", "tags",
+    "last_seen", "occupied_by", "occupied_at", "user", "stale", "stale_since",
+)
+CLOSED_BREAKER_JSON = encode_json(DeviceBreaker().model_dump())
+# Plain column tuples build fragments faster than full ORM entities
+DEVICE_FRAGMENT_COLUMNS = (DBDevice.row_version,) + tuple(getattr(DBDevice, field) for field in DEVICE_FRAGMENT_FIELDS)
+# Rows per IN (...) when loading devices whose fragments are missing
+DEVICE_FRAGMENT_LOAD_CHUNK = 500
+# Cached device lists are rebuilt at least this often so last_seen keeps moving
+DEVICE_LAST_SEEN_RESOLUTION_SECONDS = 15
+LAST_SEEN_KEY = encode_json("last_seen") + b":"
+
+
+def _device_list_fields(view: str, fields: Optional[str]) -> Tuple[str, ...]:
+    """Fields to return: `fields=` (plus device_id, the row key) wins over `view=`."""
+    if fields:
+        requested = {field.strip() for field in fields.split(",") if field.strip()}
+        unknown = requested - set(DEVICE_FIELDS)
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(sorted(unknown))}")
+        return tuple(field for field in DEVICE_FIELDS if field in requested or field == "device_id")
+    if view == "summary":
+        return DEVICE_SUMMARY_FIELDS
+    return DEVICE_FIELDS
+
+
+def _load_device_fragments(db: Session, versions: List[Tuple[str, int]]) -> Dict[str, DeviceFragment]:
+    """Fragments for (device_id, row_version) pairs, encoding (and caching) those that changed since last listed."""
+    fragments, missing = device_fragments.get_many(versions)
+    if missing:
+        built = {}
+        for start in range(0, len(missing), DEVICE_FRAGMENT_LOAD_CHUNK):
+            chunk = missing[start:start + DEVICE_FRAGMENT_LOAD_CHUNK]
+            rows = db.query(*DEVICE_FRAGMENT_COLUMNS).filter(DBDevice.device_id.in_(chunk))
+            for device in rows:
+                with profile_span("decode"):
+                    built[device.device_id] = DeviceFragment(device)
+        device_fragments.put(built)
+        fragments.update(built)
+    return fragments
+
+
+def _build_device_list(
+    db: Session,
+    device_type: Optional[str],
+    status: Optional[str],
+    search: Optional[str],
+    model: Optional[str],
+    group: Optional[str],
+    skip: int,
+    limit: int,
+    fields: Tuple[str, ...],
+    freshness: Dict[str, Any],
+) -> bytes:
+    """The JSON array of matching devices, joined from per-device fragments.
+
+    Only device id, row_version and last_seen are read for devices whose
+    fragment is current; rows are loaded just for those that changed since
+    they were last listed.
+    """
+    query = db.query(DBDevice.device_id, DBDevice.row_version, DBDevice.last_seen)
     
     if device_type:
         query = query.filter(DBDevice.device_type == device_type)
@@ -974,46 +1614,109 @@ def get_devices(
     if group:
         query = query.filter(DBDevice.group_name == group)
 
-    devices = query.offset(skip).limit(limit).all()
-
-    # Convert to response model with user info
-    result = []
-    for device in devices:
-        device_dict = {
-            "id": device.id,
-            "device_id": device.device_id,
-            "device_type": device.device_type,
-            "name": device.name,
-            "model": device.model,
-            "status": device.status,
-            "connection_info": json.loads(device.connection_info) if device.connection_info else {},
-            "last_seen": device.last_seen,
-            "created_at": device.created_at,
-            "occupied_by": device.occupied_by,
-            "occupied_at": device.occupied_at,
-            "group_name": device.group_name,
-            "tags": json.loads(device.tags) if device.tags else [],
-            "user": None
-        }
-        
-        if device.occupied_by:
-            user = db.query(DBUser).filter(DBUser.id == device.occupied_by).first()
-            if user:
-                device_dict["user"] = {
+    rows = query.offset(skip).limit(limit).all()
+    fragments = _load_device_fragments(db, [(row.device_id, row.row_version) for row in rows])
+    # A device deleted between the two queries is simply left out
+    listed = [(fragments[row.device_id], row.last_seen) for row in rows if row.device_id in fragments]
+
+    # Fragment fields before and after last_seen, which is spliced in from the listing query
+    row_fields = tuple(field for field in fields if field in DEVICE_ROW_FIELDS)
+    if "last_seen" in row_fields:
+        split = row_fields.index("last_seen")
+        head_fields, tail_fields = row_fields[:split], row_fields[split + 1:]
+    else:
+        head_fields, tail_fields = row_fields, ()
+    users: Dict[Optional[int], bytes] = {}
+    if "user" in fields:
+        occupant_ids = {fragment.occupied_by for fragment, _ in listed if fragment.occupied_by}
+        if occupant_ids:
+            users = {
+                user.id: encode_json({
                     "id": user.id,
                     "username": user.username,
                     "email": user.email,
                     "role": user.role,
                     "is_active": user.is_active,
                     "created_at": user.created_at
-                }
-        
-        result.append(device_dict)
-    
-    return result
+                })
+                for user in db.query(DBUser).filter(DBUser.id.in_(occupant_ids))
+            }
+    breakers: Dict[Optional[str], bytes] = {}
+    if "breaker" in fields:
+        breakers = {
+            target: encode_json(DeviceBreaker(**snapshot).model_dump())
+            for target, snapshot in device_breakers.stats().items()
+        }
+    # Fields that are the same for every device of this response
+    shared = b"".join(
+        b"," + encode_json(field) + b":" + encode_json(freshness[field])
+        for field in ("stale", "stale_since") if field in fields
+    )
 
-@app.get("/api/devices/stats", response_model=DeviceStats)
-def get_device_stats(db: Session = Depends(get_db)):
+    parts = []
+    for fragment, last_seen in listed:
+        part = b"{" + fragment.join(head_fields)
+        if len(head_fields) < len(row_fields):
+            part += (b"," if head_fields else b"") + LAST_SEEN_KEY + encode_json(last_seen)
+            if tail_fields:
+                part += b"," + fragment.join(tail_fields)
+        if "user" in fields:
+            part += b',"user":' + users.get(fragment.occupied_by, b"null")
+        if "breaker" in fields:
+            target = fragment.breaker_target
+            part += b',"breaker":' + (breakers.get(target, CLOSED_BREAKER_JSON) if target else b"null")
+        parts.append(part + shared + b"}")
+    return b"[" + b",".join(parts) + b"]"
+
+
+@app.get("/api/devices", response_model=List[DeviceWithUser])
+def get_devices(
+    request: Request,
+    device_type: Optional[str] = None,
+    status: Optional[str] = None,
+    search: Optional[str] = None,
+    model: Optional[str] = None,
+    group: Optional[str] = None,
+    skip: int = 0,
+    limit: int = 100,
+    view: str = Query(
+        "full", pattern="^(summary|full)$", description="summary leaves out connection_info, created_at and breaker"
+    ),
+    fields: Optional[str] = Query(None, description="Comma-separated fields to return instead of a view"),
+    db: Session = Depends(get_db)
+):
+    """Devices matching the filters; repeated polls are served from the fleet response cache (ETag / 304).
+
+    Raw probe output is left out of connection_info; fetch it per device from
+    /api/devices/{device_id}/connection-info.
+    """
+    selected = _device_list_fields(view, fields)
+    freshness = fleet_freshness()
+    # Presence sweeps move last_seen without a fleet revision bump
+    last_seen_bucket = int(time.time() // DEVICE_LAST_SEEN_RESOLUTION_SECONDS) if "last_seen" in selected else None
+    key = (
+        "devices", device_type, status, search, model, group, skip, limit, selected,
+        freshness["stale"], freshness["stale_since"], device_breakers.version, last_seen_bucket,
+    )
+    return fleet_response_cache.respond(
+        "/api/devices",
+        key,
+        fleet_revision(db),
+        request.headers.get("if-none-match"),
+        lambda: _build_device_list(db, device_type, status, search, model, group, skip, limit, selected, freshness),
+    )
+
+
+@app.get("/api/devices/{device_id}/connection-info")
+def get_device_connection_info(device_id: str, db: Session = Depends(get_db)):
+    """A device's complete stored connection_info, including the raw probe output device lists leave out."""
+    row = db.query(DBDevice.connection_info).filter(DBDevice.device_id == device_id).first()
+    if row is None:
+        raise HTTPException(status_code=404, detail="Device not found")
+    return {"device_id": device_id, "connection_info": json.loads(row.connection_info) if row.connection_info else {}}
+
+
+def _build_device_stats(db: Session, freshness: Dict[str, Any]) -> bytes:
     total = db.query(DBDevice).count()
     online = db.query(DBDevice).filter(DBDevice.status == "online").count()
     occupied = db.query(DBDevice).filter(DBDevice.occupied_by.isnot(None)).count()
@@ -1029,7 +1732,22 @@ def get_device_stats(db: Session = Depends(get_db)):
         online_devices=online,
         occupied_devices=occupied,
         offline_devices=offline,
-        devices_by_type=devices_by_type
+        devices_by_type=devices_by_type,
+        stale=freshness["stale"],
+        stale_since=freshness["stale_since"],
+    ).model_dump_json().encode()
+
+
+@app.get("/api/devices/stats", response_model=DeviceStats)
+def get_device_stats(request: Request, db: Session = Depends(get_db)):
+    freshness = fleet_freshness()
+    key = ("stats", freshness["stale"], freshness["stale_since"])
+    return fleet_response_cache.respond(
+        "/api/devices/stats",
+        key,
+        fleet_revision(db),
+        request.headers.get("if-none-match"),
+        lambda: _build_device_stats(db, freshness),
     )
 
 @app.post("/api/devices/{device_id}/occupy")
@@ -1063,6 +1781,7 @@ def occupy_device(
     )
     db.add(log)
     db.commit()
+    _publish_occupancy_event(device, "occupy", current_user.id, current_user)
     
     return {"message": "Device occupied successfully"}
 
@@ -1084,6 +1803,7 @@ def release_device(
         raise HTTPException(status_code=403, detail="Not authorized to release this device")
     
     # Release the device
+    occupant_id = device.occupied_by
     device.occupied_by = None
     device.occupied_at = None
     device.status = "online" if device.status == "occupied" else device.status
@@ -1096,6 +1816,7 @@ def release_device(
     )
     db.add(log)
     db.commit()
+    _publish_occupancy_event(device, "release", occupant_id, current_user)
     
     return {"message": "Device released successfully"}
 
@@ -1113,10 +1834,10 @@ async def reboot_device(
     _ensure_device_control_permission(device, current_user)
 
     tokens = ["adb", "-s", device_id, "reboot"]
-    result = await _execute_adb_command(tokens)
+    result = await _execute_adb_command(tokens, user=current_user.username)
+    probe_cache.invalidate(device_id)
     status = "success" if result["returncode"] == 0 else "error"
     _record_device_log(
-        db,
         device,
         current_user,
         "reboot",
@@ -1160,10 +1881,10 @@ async def install_apk(
             tokens.append("-r")
         tokens.append(file_path)
 
-        result = await _execute_adb_command(tokens)
+        result = await _execute_adb_command(tokens, user=current_user.username)
+        probe_cache.invalidate(device_id)
         status = "success" if result["returncode"] == 0 else "error"
         _record_device_log(
-            db,
             device,
             current_user,
             "install_apk",
@@ -1228,10 +1949,9 @@ async def fetch_logcat(
         tokens.extend(["-v", str(log_format)])
         command_descriptor += f" -v {log_format}"
 
-    result = await _execute_adb_command(tokens)
+    result = await _execute_adb_command(tokens, user=current_user.username)
     status = "success" if result["returncode"] == 0 else "error"
     _record_device_log(
-        db,
         device,
         current_user,
         "adb_logcat",
@@ -1243,7 +1963,7 @@ async def fetch_logcat(
         raise HTTPException(status_code=500, detail=error_message)
 
     if clear_after:
-        await _execute_adb_command(["adb", "-s", device_id, "logcat", "-c"])
+        await _execute_adb_command(["adb", "-s", device_id, "logcat", "-c"], user=current_user.username)
 
     filename = f"{device_id}_logcat_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}.log"
     return PlainTextResponse(
@@ -1272,6 +1992,9 @@ def update_device(
     if device_update.status is not None:
         device.status = device_update.status
     if device_update.group_name is not None:
+        if device_update.group_name != device.group_name:
+            # The group decides which mount points the filesystem probe inspects
+            probe_cache.invalidate(device_id, ["mounts"])
         device.group_name = device_update.group_name
     if device_update.tags is not None:
         device.tags = json.dumps(device_update.tags)
@@ -1281,6 +2004,7 @@ def update_device(
         device.connection_info = json.dumps(existing_info)
     
     db.commit()
+    _broadcast_device_update(datetime.utcnow(), _pop_device_changes(db))
     return {"message": "Device updated successfully"}
 
 @app.get("/api/devices/{device_id}/logs", response_model=List[DeviceUsageLogWithDetails])
@@ -1288,41 +2012,70 @@ def get_device_logs(
     device_id: str,
     skip: int = 0,
     limit: int = 50,
+    include_archived: bool = False,
     db: Session = Depends(get_db)
 ):
     device = db.query(DBDevice).filter(DBDevice.device_id == device_id).first()
     if not device:
         raise HTTPException(status_code=404, detail="Device not found")
-    
-    logs = db.query(DBDeviceUsageLog).filter(
-        DBDeviceUsageLog.device_id == device.id
-    ).order_by(DBDeviceUsageLog.timestamp.desc()).offset(skip).limit(limit).all()
-    
-    result = []
-    for log in logs:
-        user = db.query(DBUser).filter(DBUser.id == log.user_id).first()
-        result.append({
+
+    # Make rows queued by the audit writer visible to this read
+    audit_writer.flush()
+
+    log_query = db.query(DBDeviceUsageLog).filter(DBDeviceUsageLog.device_id == device.id)
+    logs = [
+        {
             "id": log.id,
-            "device_id": log.device_id,
             "user_id": log.user_id,
             "action": log.action,
             "timestamp": log.timestamp,
             "notes": log.notes,
-            "device": {
-                "id": device.id,
-                "device_id": device.device_id,
-            "device_type": device.device_type,
-            "name": device.name,
-            "model": device.model,
-            "status": device.status,
-                "connection_info": json.loads(device.connection_info) if device.connection_info else {},
-                "last_seen": device.last_seen,
-                "created_at": device.created_at,
-                "occupied_by": device.occupied_by,
-                "occupied_at": device.occupied_at,
-                "group_name": device.group_name,
-                "tags": json.loads(device.tags) if device.tags else []
-            },
+        }
+        for log in log_query.order_by(DBDeviceUsageLog.timestamp.desc()).offset(skip).limit(limit).all()
+    ]
+
+    if include_archived and len(logs) < limit:
+        # Archived rows are older than everything in the hot table, so they
+        # continue the same newest-first ordering after the hot rows run out
+        archive_skip = max(0, skip - log_query.count())
+        for position, entry in enumerate(iter_archived_logs(db, device.id)):
+            if position < archive_skip:
+                continue
+            if len(logs) >= limit:
+                break
+            logs.append(entry)
+
+    device_payload = {
+        "id": device.id,
+        "device_id": device.device_id,
+        "device_type": device.device_type,
+        "name": device.name,
+        "model": device.model,
+        "status": device.status,
+        "connection_info": json.loads(device.connection_info) if device.connection_info else {},
+        "last_seen": device.last_seen,
+        "created_at": device.created_at,
+        "occupied_by": device.occupied_by,
+        "occupied_at": device.occupied_at,
+        "group_name": device.group_name,
+        "tags": json.loads(device.tags) if device.tags else []
+    }
+    users: Dict[int, Optional[DBUser]] = {}
+
+    result = []
+    for log in logs:
+        user_id = log["user_id"]
+        if user_id not in users:
+            users[user_id] = db.query(DBUser).filter(DBUser.id == user_id).first()
+        user = users[user_id]
+        result.append({
+            "id": log["id"],
+            "device_id": device.id,
+            "user_id": user_id,
+            "action": log["action"],
+            "timestamp": log["timestamp"],
+            "notes": log["notes"],
+            "device": device_payload,
             "user": {
                 "id": user.id,
                 "username": user.username,
@@ -1332,9 +2085,263 @@ def get_device_logs(
                 "created_at": user.created_at
             } if user else None
         })
-    
+
+    return result
+
+
+@app.get("/api/devices/{device_id}/logs/rollups", response_model=List[DeviceUsageRollup])
+def get_device_log_rollups(
+    device_id: str,
+    start_day: Optional[str] = Query(None, description="First day (YYYY-MM-DD) to include"),
+    end_day: Optional[str] = Query(None, description="Last day (YYYY-MM-DD) to include"),
+    db: Session = Depends(get_db)
+):
+    """Daily action counts for usage logs that were moved out of the hot table."""
+    device = db.query(DBDevice).filter(DBDevice.device_id == device_id).first()
+    if not device:
+        raise HTTPException(status_code=404, detail="Device not found")
+
+    query = db.query(DBDeviceUsageRollup).filter(DBDeviceUsageRollup.device_id == device.id)
+    if start_day:
+        query = query.filter(DBDeviceUsageRollup.day >= start_day)
+    if end_day:
+        query = query.filter(DBDeviceUsageRollup.day <= end_day)
+
+    return query.order_by(DBDeviceUsageRollup.day.desc(), DBDeviceUsageRollup.action).all()
+
+
+def _epoch_seconds(value: datetime) -> float:
+    if value.tzinfo is None:
+        return calendar.timegm(value.timetuple()) + value.microsecond / 1e6
+    return value.timestamp()
+
+
+@app.get("/api/devices/{device_id}/metrics")
+def get_device_metrics(
+    device_id: str,
+    metric: str,
+    start: Optional[datetime] = Query(None, alias="from", description="Range start (defaults to 24h ago)"),
+    end: Optional[datetime] = Query(None, alias="to", description="Range end (defaults to now)"),
+    step: Optional[int] = Query(None, ge=1, description="Bucket width in seconds"),
+    agg: str = "avg",
+    current_user: DBUser = Depends(get_current_active_user),
+    db: Session = Depends(get_db)
+):
+    """Bucketed history for one telemetry metric of a device."""
+    device = db.query(DBDevice).filter(DBDevice.device_id == device_id).first()
+    if not device:
+        raise HTTPException(status_code=404, detail="Device not found")
+
+    if metric not in TELEMETRY_METRICS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown metric '{metric}'. Available: {', '.join(sorted(TELEMETRY_METRICS))}",
+        )
+    if agg not in TELEMETRY_AGGREGATES:
+        raise HTTPException(status_code=400, detail=f"agg must be one of {', '.join(TELEMETRY_AGGREGATES)}")
+
+    end_ts = _epoch_seconds(end) if end else time.time()
+    start_ts = _epoch_seconds(start) if start else end_ts - 24 * 3600
+    if start_ts >= end_ts:
+        raise HTTPException(status_code=400, detail="'from' must be earlier than 'to'")
+
+    series = telemetry_store.query(device.id, metric, start_ts, end_ts, step=step, agg=agg)
+    return {"device_id": device_id, "from": start_ts, "to": end_ts, **series}
+
+
+@app.get("/api/fleet/versions")
+def get_fleet_versions(
+    request: Request,
+    group_by: Optional[str] = Query(None, description="module_versions field to group by"),
+    current_user: DBUser = Depends(get_current_active_user),
+    db: Session = Depends(get_db)
+):
+    """Stored firmware versions of the fleet.
+
+    Any module_versions field (camera_soc, camera_mcu, ...) can be passed as a
+    query parameter to filter on an exact value; use `none` to match devices
+    where the field is missing.
+    """
+    if group_by is not None and group_by not in MODULE_VERSION_FIELDS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"group_by must be one of {', '.join(MODULE_VERSION_FIELDS)}",
+        )
+    filters = {
+        field: request.query_params[field]
+        for field in MODULE_VERSION_FIELDS
+        if field in request.query_params
+    }
+
+    rows = db.query(DBDevice, DBDeviceVersionSnapshot).join(
+        DBDeviceVersionSnapshot, DBDeviceVersionSnapshot.device_id == DBDevice.id
+    ).order_by(DBDevice.device_id).all()
+
+    devices = []
+    for device, snapshot in rows:
+        versions = json.loads(snapshot.versions) if snapshot.versions else {}
+        module_versions = versions.get("module_versions") or {}
+        if any(
+            (module_versions.get(field) or "none") != value
+            for field, value in filters.items()
+        ):
+            continue
+        devices.append({
+            "device_id": device.device_id,
+            "name": device.name,
+            "status": device.status,
+            "group_name": device.group_name,
+            "collected_at": snapshot.collected_at,
+            **versions,
+        })
+
+    response: Dict[str, Any] = {"total": len(devices), "devices": devices}
+    if group_by:
+        groups: Dict[str, List[str]] = {}
+        for entry in devices:
+            key = (entry.get("module_versions") or {}).get(group_by) or "none"
+            groups.setdefault(key, []).append(entry["device_id"])
+        response["group_by"] = group_by
+        response["groups"] = [
+            {"value": value, "count": len(device_ids), "device_ids": device_ids}
+            for value, device_ids in sorted(groups.items(), key=lambda item: -len(item[1]))
+        ]
+    return response
+
+
+@app.post("/api/fleet/versions/refresh")
+def refresh_fleet_versions(current_user: DBUser = Depends(get_current_active_user)):
+    """Collect ql-getversion from every online ADB device now."""
+    return collect_fleet_versions()
+
+
+@app.get("/api/admin/probe-cache")
+def get_probe_cache_stats(current_user: DBUser = Depends(get_admin_user)):
+    """Hit/miss counters and TTLs of the per-device probe cache."""
+    return probe_cache.stats()
+
+
+@app.get("/api/admin/adb-scheduler")
+def get_adb_scheduler_stats(
+    device_id: Optional[str] = Query(None, description="Only report this device serial"),
+    current_user: DBUser = Depends(get_admin_user),
+):
+    """Running adb commands, queue depth and wait times per device."""
+    return adb_scheduler.stats(device_id)
+
+
+@app.get("/api/admin/scan")
+def get_scan_stats(
+    device_id: Optional[str] = Query(None, description="Include the deep-probe schedule of this device"),
+    current_user: DBUser = Depends(get_admin_user),
+):
+    """Presence sweep timing and per-probe schedule, cost and budget of the deep tier."""
+    result = {
+        "presence": {"interval_seconds": PRESENCE_SCAN_INTERVAL_SECONDS, **presence_scan_stats},
+        "deep_probes": deep_probes.stats(),
+    }
+    if device_id:
+        result["device"] = deep_probes.device_stats(device_id)
     return result
 
+
+@app.get("/api/admin/adb-servers")
+def get_adb_servers(current_user: DBUser = Depends(get_admin_user)):
+    """adb server shards with health, restart count and how many devices each owns."""
+    return adb_shards.stats()
+
+
+@app.post("/api/admin/adb-servers/{port}/restart")
+def restart_adb_server(port: int, current_user: DBUser = Depends(get_admin_user)):
+    """Kill and restart one adb server; its devices reappear on the next presence sweep."""
+    if port not in adb_shards.shards:
+        raise HTTPException(status_code=404, detail="adb server not found")
+    return adb_shards.restart(port)
+
+
+@app.get("/api/admin/event-bus")
+def get_event_bus_stats(current_user: DBUser = Depends(get_admin_user)):
+    """Event bus backend, publish/delivery counters and delivery latency percentiles."""
+    return event_bus.stats()
+
+
+@app.get("/api/admin/websockets")
+def get_websocket_stats(current_user: DBUser = Depends(get_admin_user)):
+    """`/ws` clients with queue depth, send latency and drop counters, plus broadcast fan-out time."""
+    return manager.stats()
+
+
+@app.post("/api/admin/profiling")
+def arm_profiling(
+    requests: int = Body(0, embed=True, ge=0, le=100),
+    scan: bool = Body(False, embed=True),
+    path_prefix: Optional[str] = Body(None, embed=True),
+    current_user: DBUser = Depends(get_admin_user),
+):
+    """Profile the next `requests` requests (optionally only under `path_prefix`) and/or the next full scan.
+
+    Profiling state is per process: with several workers, requests are profiled
+    by whichever worker serves them, and scans only on the scanner.
+    """
+    profiler.arm(requests, scan, path_prefix)
+    return {**profiler.stats(), "scanner": scanner_lease.is_leader}
+
+
+@app.delete("/api/admin/profiling")
+def disarm_profiling(current_user: DBUser = Depends(get_admin_user)):
+    profiler.disarm()
+    return {"message": "Profiling disarmed"}
+
+
+@app.get("/api/admin/profiling")
+def get_profiles(current_user: DBUser = Depends(get_admin_user)):
+    """Armed state and the recent profiles with their SQL / subprocess / decode timing breakdown."""
+    return profiler.stats()
+
+
+@app.get("/api/admin/profiling/{profile_id}/flamegraph", response_class=PlainTextResponse)
+def download_flamegraph(profile_id: int, current_user: DBUser = Depends(get_admin_user)):
+    """Sampled stacks of one profile in folded format (flamegraph.pl, inferno, speedscope)."""
+    profile = profiler.get(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return PlainTextResponse(
+        profile.folded(),
+        headers={"Content-Disposition": f'attachment; filename="profile-{profile_id}.folded"'},
+    )
+
+
+@app.get("/api/admin/agents")
+def get_agents(current_user: DBUser = Depends(get_admin_user)):
+    """Rack agents connected to this worker, the heartbeats of those on every worker and devices owned per agent."""
+    return agent_hub.stats()
+
+
+@app.get("/api/admin/breakers")
+def get_circuit_breakers(current_user: DBUser = Depends(get_admin_user)):
+    """Devices whose adb calls have recently failed, with breaker state and backoff."""
+    return device_breakers.stats()
+
+
+@app.post("/api/admin/breakers/{device_id}/reset")
+def reset_circuit_breaker(device_id: str, current_user: DBUser = Depends(get_admin_user)):
+    """Close a device's breaker immediately, e.g. after replugging it."""
+    device_breakers.reset(device_id)
+    return device_breakers.snapshot(device_id)
+
+
+@app.get("/api/admin/audit/metrics")
+def get_audit_metrics(current_user: DBUser = Depends(get_admin_user)):
+    """Queue depth and flush latency of the background audit-log writer."""
+    return audit_writer.stats()
+
+
+@app.post("/api/admin/audit/compact")
+def run_usage_log_compaction(current_user: DBUser = Depends(get_admin_user)):
+    """Archive usage logs older than the retention window right away."""
+    audit_writer.flush()
+    return compact_usage_logs()
+
 # Legacy endpoints for backward compatibility
 @app.get("/devices")
 def get_devices_legacy():
@@ -1366,22 +2373,99 @@ def get_bluetooth_infos_legacy():
     
     return {"results": list(result.values())}
 
-# WebSocket endpoint
-@app.websocket("/ws")
-async def websocket_endpoint(websocket: WebSocket):
-    await manager.connect(websocket)
+# WebSocket endpoint
+@app.websocket("/ws")
+async def websocket_endpoint(websocket: WebSocket):
+    """Event stream; clients may send `{"type": "subscribe", "topics": [...]}` to receive only some events.
+
+    `?token=` is optional and only needed for the `occupancy:me` topic.
+    """
+    user_id = None
+    token = websocket.query_params.get("token")
+    if token:
+        db = SessionLocal()
+        try:
+            user_id = get_user_from_token(token, db).id
+        except HTTPException as exc:
+            await websocket.close(code=1008, reason=exc.detail)
+            return
+        finally:
+            db.close()
+
+    await manager.connect(websocket, user_id)
     try:
         while True:
-            data = await websocket.receive_text()
-            # Handle incoming messages if needed
+            manager.handle_message(websocket, await websocket.receive_text())
     except WebSocketDisconnect:
+        pass
+    finally:
         manager.disconnect(websocket)
 
+@app.websocket("/ws/agent")
+async def agent_endpoint(websocket: WebSocket):
+    """Persistent connection of a rack agent: device snapshots in, adb commands out."""
+    agent_id = websocket.query_params.get("agent_id")
+    if not agent_id or not agent_hub.authenticate(websocket.query_params.get("token")):
+        await websocket.close(code=1008, reason="Invalid agent credentials")
+        return
+
+    await websocket.accept()
+    connection = agent_hub.attach(agent_id, websocket, websocket.client.host if websocket.client else None)
+    try:
+        while True:
+            message = await websocket.receive_json()
+            if message.get("type") == "snapshot":
+                agent_hub.submit_snapshot(connection, message, apply_agent_snapshot)
+            else:
+                await agent_hub.handle_message(connection, message)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        if agent_hub.detach(connection):
+            await asyncio.get_running_loop().run_in_executor(None, _mark_agent_devices_offline, agent_id)
+
 # Trigger manual device scan
 @app.post("/api/devices/scan")
 def trigger_device_scan(current_user: DBUser = Depends(get_current_active_user)):
-    update_devices_in_db()
-    return {"message": "Device scan triggered successfully"}
+    if scanner_lease.is_leader:
+        update_devices_in_db()
+        return {"message": "Device scan triggered successfully"}
+    # Another process is the scanner; it picks the request up on its next lease renewal
+    if not scanner_lease.update(scan_requested_at=datetime.utcnow()):
+        raise HTTPException(status_code=503, detail="No scanner is running")
+    return {"message": "Device scan requested from the scanner"}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    """Prometheus text exposition of this process's counters and histograms."""
+    return PlainTextResponse(metrics_registry.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/api/health/scanner")
+def scanner_health():
+    """Liveness of the deployment's scanner: who holds the lease and how far behind the last sweep is."""
+    lease = scanner_lease.status()
+    now = datetime.utcnow()
+    if lease is None:
+        return JSONResponse(status_code=503, content={"healthy": False, "mode": SCANNER_MODE, "leader": None})
+    lag = (now - lease["last_scan_at"]).total_seconds() if lease["last_scan_at"] else None
+    healthy = not lease["expired"] and lag is not None and lag <= SCANNER_MAX_LAG_SECONDS
+    content = {
+        "healthy": healthy,
+        "mode": SCANNER_MODE,
+        "leader": lease["holder"],
+        "is_this_process": scanner_lease.is_leader,
+        "lease_expired": lease["expired"],
+        "lease_renewed_at": lease["renewed_at"],
+        "lease_expires_at": lease["expires_at"],
+        "last_scan_at": lease["last_scan_at"],
+        "last_scan_duration_ms": lease["last_scan_duration_ms"],
+        "scan_lag_seconds": round(lag, 3) if lag is not None else None,
+        "max_lag_seconds": SCANNER_MAX_LAG_SECONDS,
+        "scan_requested_at": lease["scan_requested_at"],
+    }
+    return JSONResponse(status_code=200 if healthy else 503, content=jsonable_encoder(content))
 
 # Bluetooth control endpoints
 @app.post("/api/devices/{device_id}/bluetooth/connect")
@@ -1405,7 +2489,8 @@ def bluetooth_connect(
             raise HTTPException(status_code=400, detail="No ADB host found for this Bluetooth device")
 
         cmd = ["adb", "-s", adb_host, "shell", "bluetoothctl", "connect", device_id]
-        result = subprocess.run(cmd, capture_output=True, text=True)
+        result = adb_scheduler.run(cmd, ADB_PRIORITY_USER, current_user.username, capture_output=True, text=True)
+        probe_cache.invalidate(adb_host, ["bluetooth"])
         stdout = (result.stdout or "").strip()
         stderr = (result.stderr or "").strip()
         combined = stdout or stderr
@@ -1419,16 +2504,14 @@ def bluetooth_connect(
                 error_detail = combined or "Unknown error"
                 raise HTTPException(status_code=500, detail=f"Bluetooth connect failed: {error_detail}")
 
-        log = DBDeviceUsageLog(
-            device_id=device.id,
-            user_id=current_user.id,
-            action="bluetooth_connect",
-            notes=f"Bluetooth connect command executed: {' '.join(cmd)} | stdout: {stdout} | stderr: {stderr}"
+        _record_device_log(
+            device,
+            current_user,
+            "bluetooth_connect",
+            f"Bluetooth connect command executed: {' '.join(cmd)} | stdout: {stdout} | stderr: {stderr}",
         )
-        db.add(log)
-        db.commit()
 
-        update_devices_in_db()
+        run_deep_probes([adb_host], ["bluetooth_peers"], force=True)
 
         return {
             "message": message,
@@ -1437,6 +2520,8 @@ def bluetooth_connect(
             "command": ' '.join(cmd)
         }
 
+    except (DeviceUnavailableError, subprocess.TimeoutExpired) as e:
+        raise _adb_http_error(e, "bluetoothctl")
     except Exception as e:
         if isinstance(e, HTTPException):
             raise
@@ -1463,7 +2548,8 @@ def bluetooth_disconnect(
             raise HTTPException(status_code=400, detail="No ADB host found for this Bluetooth device")
 
         cmd = ["adb", "-s", adb_host, "shell", "bluetoothctl", "disconnect", device_id]
-        result = subprocess.run(cmd, capture_output=True, text=True)
+        result = adb_scheduler.run(cmd, ADB_PRIORITY_USER, current_user.username, capture_output=True, text=True)
+        probe_cache.invalidate(adb_host, ["bluetooth"])
         stdout = (result.stdout or "").strip()
         stderr = (result.stderr or "").strip()
 
@@ -1471,16 +2557,14 @@ def bluetooth_disconnect(
             error_detail = stdout or stderr or "Unknown error"
             raise HTTPException(status_code=500, detail=f"Bluetooth disconnect failed: {error_detail}")
 
-        log = DBDeviceUsageLog(
-            device_id=device.id,
-            user_id=current_user.id,
-            action="bluetooth_disconnect",
-            notes=f"Bluetooth disconnect command executed: {' '.join(cmd)} | stdout: {stdout} | stderr: {stderr}"
+        _record_device_log(
+            device,
+            current_user,
+            "bluetooth_disconnect",
+            f"Bluetooth disconnect command executed: {' '.join(cmd)} | stdout: {stdout} | stderr: {stderr}",
         )
-        db.add(log)
-        db.commit()
 
-        update_devices_in_db()
+        run_deep_probes([adb_host], ["bluetooth_peers"], force=True)
 
         return {
             "message": "Bluetooth disconnect command sent successfully",
@@ -1489,6 +2573,8 @@ def bluetooth_disconnect(
             "command": ' '.join(cmd)
         }
 
+    except (DeviceUnavailableError, subprocess.TimeoutExpired) as e:
+        raise _adb_http_error(e, "bluetoothctl")
     except Exception as e:
         if isinstance(e, HTTPException):
             raise
@@ -1515,7 +2601,8 @@ def bluetooth_pair(
             raise HTTPException(status_code=400, detail="No ADB host found for this Bluetooth device")
 
         cmd = ["adb", "-s", adb_host, "shell", "bluetoothctl", "pair", device_id]
-        result = subprocess.run(cmd, capture_output=True, text=True)
+        result = adb_scheduler.run(cmd, ADB_PRIORITY_USER, current_user.username, capture_output=True, text=True)
+        probe_cache.invalidate(adb_host, ["bluetooth"])
         stdout = (result.stdout or "").strip()
         stderr = (result.stderr or "").strip()
         combined = stdout or stderr
@@ -1529,16 +2616,14 @@ def bluetooth_pair(
                 error_detail = combined or "Unknown error"
                 raise HTTPException(status_code=500, detail=f"Bluetooth pair failed: {error_detail}")
 
-        log = DBDeviceUsageLog(
-            device_id=device.id,
-            user_id=current_user.id,
-            action="bluetooth_pair",
-            notes=f"Bluetooth pair command executed: {' '.join(cmd)} | stdout: {stdout} | stderr: {stderr}"
+        _record_device_log(
+            device,
+            current_user,
+            "bluetooth_pair",
+            f"Bluetooth pair command executed: {' '.join(cmd)} | stdout: {stdout} | stderr: {stderr}",
         )
-        db.add(log)
-        db.commit()
 
-        update_devices_in_db()
+        run_deep_probes([adb_host], ["bluetooth_peers"], force=True)
 
         return {
             "message": message,
@@ -1547,6 +2632,8 @@ def bluetooth_pair(
             "command": ' '.join(cmd)
         }
 
+    except (DeviceUnavailableError, subprocess.TimeoutExpired) as e:
+        raise _adb_http_error(e, "bluetoothctl")
     except Exception as e:
         if isinstance(e, HTTPException):
             raise
@@ -1555,6 +2642,7 @@ def bluetooth_pair(
 @app.get("/api/devices/{device_id}/bluetooth/info")
 def get_device_bluetooth_info(
     device_id: str,
+    fresh: bool = Query(False, description="Bypass the probe cache"),
     current_user: DBUser = Depends(get_current_active_user),
     db: Session = Depends(get_db)
 ):
@@ -1567,10 +2655,13 @@ def get_device_bluetooth_info(
         raise HTTPException(status_code=400, detail="Device is not an ADB device")
     
     try:
-        bluetooth_info = get_adb_bluetooth_info(device_id)
+        bluetooth_info, cache_info = probe_cache.get_or_load(
+            device_id, "bluetooth", lambda: get_adb_bluetooth_info(device_id, ADB_PRIORITY_USER, current_user.username), fresh=fresh
+        )
         return {
             "device_id": device_id,
-            "bluetooth_info": bluetooth_info
+            "bluetooth_info": bluetooth_info,
+            "cache": cache_info,
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to get Bluetooth info: {str(e)}")
@@ -1578,6 +2669,7 @@ def get_device_bluetooth_info(
 @app.get("/api/devices/{device_id}/wifi/ap/info")
 def get_device_wifi_ap_info(
     device_id: str,
+    fresh: bool = Query(False, description="Bypass the probe cache"),
     current_user: DBUser = Depends(get_current_active_user),
     db: Session = Depends(get_db)
 ):
@@ -1590,62 +2682,48 @@ def get_device_wifi_ap_info(
         raise HTTPException(status_code=400, detail="Device is not an ADB device")
     
     try:
-        wifi_ap_info = get_adb_wifi_ap_info(device_id)
+        wifi_ap_info, cache_info = probe_cache.get_or_load(
+            device_id, "wifi_ap", lambda: get_adb_wifi_ap_info(device_id, ADB_PRIORITY_USER, current_user.username), fresh=fresh
+        )
         return {
             "device_id": device_id,
-            "wifi_ap_info": wifi_ap_info
+            "wifi_ap_info": wifi_ap_info,
+            "cache": cache_info,
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to get WiFi AP info: {str(e)}")
 
 
-@app.get("/api/devices/{device_id}/filesystem/mounts")
-def get_device_mounts(
-    device_id: str,
-    current_user: DBUser = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
-):
-    """Inspect mount information for critical paths on an ADB device."""
-    device = db.query(DBDevice).filter(DBDevice.device_id == device_id).first()
-    if not device:
-        raise HTTPException(status_code=404, detail="Device not found")
+def _mount_points_for(device: DBDevice) -> List[str]:
+    return MOUNT_POINTS_BY_GROUP.get(device.group_name or "", DEFAULT_MOUNT_POINTS)
 
-    if device.device_type != "adb":
-        raise HTTPException(status_code=400, detail="Filesystem inspection is only supported for ADB devices")
 
-    adb_cmd = ["adb", "-s", device_id, "shell", "mount"]
-    try:
-        result = subprocess.run(
-            adb_cmd,
-            capture_output=True,
-            text=True,
-            check=False,
-        )
-    except FileNotFoundError as exc:
-        raise HTTPException(status_code=500, detail=f"Failed to execute mount command: {str(exc)}")
+async def _probe_device_mounts(device_id: str, mount_points: List[str], user: Optional[str] = None) -> Dict[str, Any]:
+    """Fetch `mount` and `df` for all mount points in one adb round trip.
 
-    if result.returncode != 0 and result.returncode == 255:
-        subprocess.run(
-            ["adb", "-s", device_id, "wait-for-device"],
-            capture_output=True,
-            text=True,
-            check=False,
-        )
-        time.sleep(0.5)
-        result = subprocess.run(
-            adb_cmd,
-            capture_output=True,
-            text=True,
-            check=False,
-        )
+    adb exits with 255 when the transport drops (e.g. the device is still
+    re-enumerating after a reboot); those attempts are retried with
+    exponential backoff without blocking the event loop.
+    """
+    tokens = ["adb", "-s", device_id, "shell", "mount; " + _build_df_script(mount_points)]
+    result: Dict[str, Any] = {}
+    for attempt in range(MOUNT_PROBE_ATTEMPTS):
+        try:
+            result = await _execute_adb_command(tokens, user=user)
+        except FileNotFoundError as exc:
+            raise HTTPException(status_code=500, detail=f"Failed to execute mount command: {str(exc)}")
+        if result["returncode"] != 255:
+            break
+        if attempt + 1 < MOUNT_PROBE_ATTEMPTS:
+            await asyncio.sleep(MOUNT_PROBE_BACKOFF_SECONDS * (2 ** attempt))
 
-    if result.returncode != 0:
-        error_message = result.stderr.strip() or result.stdout.strip() or f"adb exited with code {result.returncode}"
+    mount_output, df_sections = _split_df_sections(result["stdout"])
+    if result["returncode"] != 0:
+        error_message = result["stderr"].strip() or mount_output.strip() or f"adb exited with code {result['returncode']}"
         raise HTTPException(status_code=500, detail=f"Failed to execute mount command: {error_message}")
 
-    mounts = parse_mount_output(result.stdout)
-    mount_points = ["/", "/data", "/data/zhuimi"]
-    usage_map = collect_path_usage(device_id, mount_points)
+    mounts = parse_mount_output(mount_output)
+    usage_map = {path: _build_path_usage(path, df_sections.get(path)) for path in mount_points}
     mount_details = []
 
     for mount_point in mount_points:
@@ -1668,13 +2746,66 @@ def get_device_mounts(
         "mounts": mount_details,
         "path_usage": list(usage_map.values()),
         "zhuimi_writable": zhuimi_info.get("writable") if zhuimi_info else False,
+        "raw_output": mount_output,
+    }
+
+
+def _probe_device_versions(
+    device_id: str,
+    priority: int = ADB_PRIORITY_BACKGROUND,
+    user: Optional[str] = None,
+) -> Dict[str, Any]:
+    """Run ql-getversion on the device and parse its output."""
+    try:
+        result = adb_scheduler.run(
+            ["adb", "-s", device_id, "shell", "ql-getversion"],
+            priority,
+            user,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+    except (DeviceUnavailableError, subprocess.TimeoutExpired) as exc:
+        raise _adb_http_error(exc, "ql-getversion")
+    except (subprocess.SubprocessError, FileNotFoundError) as exc:
+        error_message = getattr(exc, "stderr", None) or str(exc)
+        raise HTTPException(status_code=500, detail=f"Failed to execute ql-getversion: {error_message}")
+
+    versions = parse_version_output(result.stdout)
+
+    return {
+        "device_id": device_id,
+        "versions": versions,
         "raw_output": result.stdout,
     }
 
 
+@app.get("/api/devices/{device_id}/filesystem/mounts")
+async def get_device_mounts(
+    device_id: str,
+    fresh: bool = Query(False, description="Bypass the probe cache"),
+    current_user: DBUser = Depends(get_current_active_user),
+    db: Session = Depends(get_db)
+):
+    """Inspect mount information for critical paths on an ADB device."""
+    device = db.query(DBDevice).filter(DBDevice.device_id == device_id).first()
+    if not device:
+        raise HTTPException(status_code=404, detail="Device not found")
+
+    if device.device_type != "adb":
+        raise HTTPException(status_code=400, detail="Filesystem inspection is only supported for ADB devices")
+
+    mount_points = _mount_points_for(device)
+    result, cache_info = await probe_cache.get_or_load_async(
+        device_id, "mounts", lambda: _probe_device_mounts(device_id, mount_points, current_user.username), fresh=fresh
+    )
+    return {**result, "cache": cache_info}
+
+
 @app.get("/api/devices/{device_id}/versions")
 def get_device_versions(
     device_id: str,
+    fresh: bool = Query(False, description="Bypass the probe cache"),
     current_user: DBUser = Depends(get_current_active_user),
     db: Session = Depends(get_db)
 ):
@@ -1686,26 +2817,87 @@ def get_device_versions(
     if device.device_type != "adb":
         raise HTTPException(status_code=400, detail="Version query is only supported for ADB devices")
 
+    result, cache_info = probe_cache.get_or_load(
+        device_id,
+        "versions",
+        lambda: _probe_and_store_versions(device.id, device_id, ADB_PRIORITY_USER, current_user.username),
+        fresh=fresh,
+    )
+    return {**result, "cache": cache_info}
+
+
+def _probe_and_store_versions(
+    device_pk: int,
+    device_id: str,
+    priority: int = ADB_PRIORITY_BACKGROUND,
+    user: Optional[str] = None,
+) -> Dict[str, Any]:
+    """Probe versions and keep the parsed result as the device's inventory snapshot."""
+    result = _probe_device_versions(device_id, priority, user)
+    db = SessionLocal()
     try:
-        result = subprocess.run(
-            ["adb", "-s", device_id, "shell", "ql-getversion"],
-            capture_output=True,
-            text=True,
-            check=True,
+        snapshot = db.query(DBDeviceVersionSnapshot).filter(
+            DBDeviceVersionSnapshot.device_id == device_pk
+        ).first()
+        if snapshot is None:
+            snapshot = DBDeviceVersionSnapshot(device_id=device_pk)
+            db.add(snapshot)
+        snapshot.collected_at = datetime.utcnow()
+        snapshot.versions = json.dumps(result["versions"])
+        db.commit()
+    finally:
+        db.close()
+    return result
+
+
+def collect_fleet_versions(device_ids: Optional[List[str]] = None) -> Dict[str, Any]:
+    """Refresh version snapshots of online ADB devices concurrently."""
+    db = SessionLocal()
+    try:
+        query = db.query(DBDevice.id, DBDevice.device_id).filter(
+            DBDevice.device_type == "adb",
+            DBDevice.status.in_(["online", "occupied"]),
         )
-    except (subprocess.CalledProcessError, FileNotFoundError) as exc:
-        error_message = getattr(exc, "stderr", None) or str(exc)
-        raise HTTPException(status_code=500, detail=f"Failed to execute ql-getversion: {error_message}")
+        if device_ids is not None:
+            query = query.filter(DBDevice.device_id.in_(device_ids))
+        targets = query.all()
+    finally:
+        db.close()
 
-    versions = parse_version_output(result.stdout)
+    def refresh(target) -> Optional[str]:
+        try:
+            probe_cache.get_or_load(
+                target.device_id,
+                "versions",
+                lambda: _probe_and_store_versions(target.id, target.device_id),
+                fresh=True,
+            )
+            return None
+        except HTTPException as exc:
+            return exc.detail
+        except Exception as exc:
+            return str(exc)
+
+    errors: Dict[str, str] = {}
+    if targets:
+        with ThreadPoolExecutor(max_workers=FLEET_VERSION_WORKERS) as pool:
+            for target, error in zip(targets, pool.map(refresh, targets)):
+                if error:
+                    errors[target.device_id] = error
 
     return {
-        "device_id": device_id,
-        "versions": versions,
-        "raw_output": result.stdout,
+        "requested": len(targets),
+        "collected": len(targets) - len(errors),
+        "errors": errors,
     }
 
 
+def _schedule_version_refresh(device_ids: List[str]) -> None:
+    """Refresh version snapshots in the background, e.g. after devices reconnect."""
+    if device_ids:
+        background_executor.submit(collect_fleet_versions, device_ids)
+
+
 @app.post("/api/devices/{device_id}/filesystem/push")
 async def push_file_to_device(
     device_id: str,
@@ -1729,14 +2921,6 @@ async def push_file_to_device(
     if not file.filename:
         raise HTTPException(status_code=400, detail="Uploaded file must include a filename")
 
-    try:
-        contents = await file.read()
-    except Exception as exc:  # pragma: no cover - defensive read guard
-        raise HTTPException(status_code=500, detail=f"Failed to read uploaded file: {exc}")
-
-    if not contents:
-        raise HTTPException(status_code=400, detail="Uploaded file is empty")
-
     target_dir = (remote_dir or "/data").strip() or "/data"
     if not target_dir.startswith("/"):
         raise HTTPException(status_code=400, detail="Remote directory must be an absolute path")
@@ -1751,32 +2935,43 @@ async def push_file_to_device(
     tmp_path = None
     try:
         with tempfile.NamedTemporaryFile(delete=False) as tmp:
-            tmp.write(contents)
-            tmp.flush()
             tmp_path = tmp.name
+            try:
+                # Copied in chunks on a worker thread: a large upload neither sits in memory nor stalls the loop
+                await asyncio.get_running_loop().run_in_executor(
+                    None, shutil.copyfileobj, file.file, tmp, UPLOAD_COPY_CHUNK_BYTES
+                )
+            except Exception as exc:  # pragma: no cover - defensive read guard
+                raise HTTPException(status_code=500, detail=f"Failed to read uploaded file: {exc}")
+            size = tmp.tell()
 
-        result = subprocess.run(
-            ["adb", "-s", device_id, "push", tmp_path, remote_path],
-            capture_output=True,
-            text=True,
-        )
+        if not size:
+            raise HTTPException(status_code=400, detail="Uploaded file is empty")
 
-        stdout = (result.stdout or "").strip()
-        stderr = (result.stderr or "").strip()
+        try:
+            result = await adb_scheduler.run_async(
+                ["adb", "-s", device_id, "push", tmp_path, remote_path],
+                ADB_PRIORITY_USER,
+                current_user.username,
+            )
+        except (DeviceUnavailableError, subprocess.TimeoutExpired, AgentCommandError) as exc:
+            raise _adb_http_error(exc, "ADB push")
+
+        stdout = result["stdout"].strip()
+        stderr = result["stderr"].strip()
         combined = stdout or stderr
+        probe_cache.invalidate(device_id)
 
-        if result.returncode != 0:
+        if result["returncode"] != 0:
             error_detail = combined or "Unknown error"
             raise HTTPException(status_code=500, detail=f"ADB push failed: {error_detail}")
 
-        log = DBDeviceUsageLog(
-            device_id=device.id,
-            user_id=current_user.id,
-            action="filesystem_push",
-            notes=f"Pushed {filename} to {remote_path} ({len(contents)} bytes)",
+        _record_device_log(
+            device,
+            current_user,
+            "filesystem_push",
+            f"Pushed {filename} to {remote_path} ({size} bytes)",
         )
-        db.add(log)
-        db.commit()
 
         return {
             "message": "File pushed successfully",
@@ -1817,11 +3012,16 @@ def download_fastapi_log(
     error_state: Optional[HTTPException] = None
 
     for log_path in log_paths:
-        result = subprocess.run(
-            ["adb", "-s", device_id, "shell", "cat", log_path],
-            capture_output=True,
-            text=True,
-        )
+        try:
+            result = adb_scheduler.run(
+                ["adb", "-s", device_id, "shell", "cat", log_path],
+                ADB_PRIORITY_USER,
+                current_user.username,
+                capture_output=True,
+                text=True,
+            )
+        except (DeviceUnavailableError, subprocess.TimeoutExpired) as exc:
+            raise _adb_http_error(exc, f"Reading {log_path}")
 
         stdout = (result.stdout or "").strip()
         stderr = (result.stderr or "").strip()
@@ -1840,14 +3040,12 @@ def download_fastapi_log(
     if not selected_path:
         raise error_state or HTTPException(status_code=500, detail="Failed to read FastAPI log from device")
 
-    log_entry = DBDeviceUsageLog(
-        device_id=device.id,
-        user_id=current_user.id,
-        action="download_fastapi_log",
-        notes=f"Downloaded {selected_path} via API",
+    _record_device_log(
+        device,
+        current_user,
+        "download_fastapi_log",
+        f"Downloaded {selected_path} via API",
     )
-    db.add(log_entry)
-    db.commit()
 
     filename = f"{device_id}_log_FastCGIServer.log"
 
@@ -1885,27 +3083,125 @@ async def adb_terminal(websocket: WebSocket, device_id: str):
             await websocket.close(code=1008, reason=exc.detail)
             return
 
+        pty_mode = websocket.query_params.get("mode") == "pty"
         await websocket.accept()
+        if pty_mode:
+            await _run_pty_terminal(websocket, db, device, current_user)
+        else:
+            await _run_command_terminal(websocket, db, device, current_user)
+
+        # The session also ends when the client hangs up, and a closed socket cannot be closed again
+        if websocket.client_state == WebSocketState.CONNECTED:
+            await websocket.close()
+    finally:
+        db.close()
+
+
+async def _run_command_terminal(
+    websocket: WebSocket,
+    db: Session,
+    device: DBDevice,
+    current_user: DBUser,
+) -> None:
+    """One-shot mode: every command runs in its own adb process.
+
+    Output is streamed as `chunk` messages while the command runs, followed by
+    a final `output` message. A `cancel` message kills the running command.
+    """
+    await websocket.send_json({
+        "type": "ready",
+        "mode": "command",
+        "message": f"Connected to {device.name or device.device_id}",
+        "device_id": device.device_id,
+        "max_output_bytes": MAX_TERMINAL_OUTPUT_BYTES,
+    })
+
+    receive_task: Optional[asyncio.Task] = None
+    command_task: Optional[asyncio.Task] = None
+    cancel_event = asyncio.Event()
+    command_text = ""
+
+    async def send_chunk(stream_name: str, text: str) -> None:
         await websocket.send_json({
-            "type": "ready",
-            "message": f"Connected to {device.name or device.device_id}",
-            "device_id": device.device_id,
+            "type": "chunk",
+            "command": command_text,
+            "stream": stream_name,
+            "data": text,
         })
 
+    try:
         while True:
-            try:
-                payload = await asyncio.wait_for(
-                    websocket.receive_json(),
-                    timeout=TERMINAL_TIMEOUT_SECONDS,
-                )
-            except asyncio.TimeoutError:
+            if receive_task is None:
+                receive_task = asyncio.create_task(websocket.receive_json())
+
+            pending = {receive_task}
+            if command_task is not None:
+                pending.add(command_task)
+
+            done, _ = await asyncio.wait(
+                pending,
+                # Inactivity only counts while no command is running
+                timeout=None if command_task is not None else TERMINAL_TIMEOUT_SECONDS,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            if not done:
                 await websocket.send_json({
                     "type": "timeout",
                     "message": "Session closed due to inactivity",
                 })
                 break
+
+            if command_task is not None and command_task in done:
+                try:
+                    result = command_task.result()
+                except Exception as exc:
+                    # Sending a chunk failed, which means the client went away
+                    logger.debug("Terminal command stream aborted: %s", exc)
+                    break
+                finally:
+                    command_task = None
+                status = result["status"]
+
+                db.refresh(device)
+                try:
+                    _ensure_device_control_permission(device, current_user)
+                except HTTPException as exc:
+                    await websocket.send_json({
+                        "type": "error",
+                        "command": command_text,
+                        "message": exc.detail,
+                    })
+                    break
+
+                _record_device_log(
+                    device,
+                    current_user,
+                    "adb_terminal",
+                    _build_command_log(command_text, result, status),
+                )
+
+                await websocket.send_json({
+                    "type": "output",
+                    "command": command_text,
+                    "status": status,
+                    "returncode": result["returncode"],
+                    "stdout": "",
+                    "stderr": "",
+                    "streamed": True,
+                    "output_bytes": result["output_bytes"],
+                })
+
+            if receive_task not in done:
+                continue
+
+            try:
+                payload = receive_task.result()
             except WebSocketDisconnect:
                 break
+            except ValueError:
+                payload = None
+            finally:
+                receive_task = None
 
             if not isinstance(payload, dict):
                 await websocket.send_json({
@@ -1914,15 +3210,34 @@ async def adb_terminal(websocket: WebSocket, device_id: str):
                 })
                 continue
 
-            if payload.get("type") != "command":
+            message_type = payload.get("type")
+            if message_type == "cancel":
+                if command_task is None:
+                    await websocket.send_json({
+                        "type": "error",
+                        "message": "No command is running",
+                    })
+                else:
+                    cancel_event.set()
+                continue
+
+            if message_type != "command":
                 await websocket.send_json({
                     "type": "error",
                     "message": "Unsupported message type",
                 })
                 continue
 
-            command_text = (payload.get("command") or "").strip()
-            if not command_text:
+            if command_task is not None:
+                await websocket.send_json({
+                    "type": "error",
+                    "command": (payload.get("command") or "").strip(),
+                    "message": "A command is already running",
+                })
+                continue
+
+            requested_command = (payload.get("command") or "").strip()
+            if not requested_command:
                 await websocket.send_json({
                     "type": "error",
                     "message": "Command cannot be empty",
@@ -1930,49 +3245,231 @@ async def adb_terminal(websocket: WebSocket, device_id: str):
                 continue
 
             try:
-                tokens = _prepare_adb_command(device.device_id, command_text)
+                tokens = _prepare_adb_command(device.device_id, requested_command)
             except HTTPException as exc:
                 await websocket.send_json({
                     "type": "error",
-                    "command": command_text,
+                    "command": requested_command,
                     "message": exc.detail,
                 })
                 continue
 
-            result = await _execute_adb_command(tokens)
-            status = "success" if result["returncode"] == 0 else "error"
+            command_text = requested_command
+            if tokens[3] in CACHE_INVALIDATING_ADB_COMMANDS:
+                probe_cache.invalidate(device.device_id)
+            cancel_event = asyncio.Event()
+            command_task = asyncio.create_task(
+                _stream_adb_command(tokens, send_chunk, cancel_event, user=current_user.username)
+            )
+    finally:
+        if receive_task and not receive_task.done():
+            receive_task.cancel()
+        if command_task is not None:
+            cancel_event.set()
+            try:
+                await command_task
+            except Exception:
+                pass
+
+
+async def _run_pty_terminal(
+    websocket: WebSocket,
+    db: Session,
+    device: DBDevice,
+    current_user: DBUser,
+) -> None:
+    """Persistent mode: one long-lived `adb shell` PTY streamed as binary frames.
+
+    Client -> server: binary frames or {"type": "input", "data": ...} carry
+    keystrokes, {"type": "resize", "cols", "rows"} resizes the PTY and
+    {"type": "ack", "bytes": n} acknowledges rendered output for flow control.
+
+    The command policy applies to every line before its Enter is forwarded.
+    ShellLineTracker only passes keys whose effect on the shell's line is
+    known, so the line checked is the line the shell runs; line editing,
+    history and Tab completion are not available in this mode. A session
+    whose input cannot be queued is closed rather than let the two drift
+    apart. Every Enter is logged.
+    """
+    if not pty_supported():
+        await websocket.send_json({
+            "type": "error",
+            "message": "Persistent terminal sessions are not supported on this server",
+        })
+        return
+
+    try:
+        cols = int(websocket.query_params.get("cols", DEFAULT_PTY_COLS))
+        rows = int(websocket.query_params.get("rows", DEFAULT_PTY_ROWS))
+    except ValueError:
+        cols, rows = DEFAULT_PTY_COLS, DEFAULT_PTY_ROWS
+
+    agent_id = agent_hub.owner(device.device_id)
+    if agent_id is not None:
+        await websocket.send_json({
+            "type": "error",
+            "message": f"Persistent terminal sessions are not available for devices attached to agent {agent_id}; "
+                       "use command mode",
+        })
+        return
+
+    # Long-lived shells bypass the adb scheduler: a session would pin a slot until closed
+    session = PtyTerminalSession(device.device_id, cols=cols, rows=rows)
+    try:
+        await session.start()
+    except (OSError, RuntimeError) as exc:
+        await websocket.send_json({
+            "type": "error",
+            "message": f"Failed to start adb shell: {exc}",
+        })
+        return
 
-            db.refresh(device)
+    await websocket.send_json({
+        "type": "ready",
+        "mode": "pty",
+        "message": f"Connected to {device.name or device.device_id}",
+        "device_id": device.device_id,
+        "high_watermark": PTY_HIGH_WATERMARK_BYTES,
+    })
+
+    tracker = ShellLineTracker()
+    # Output counts as activity: a session left streaming `logcat` or `top` is in use
+    last_activity = time.monotonic()
+
+    async def send_output(data: bytes) -> None:
+        nonlocal last_activity
+        last_activity = time.monotonic()
+        await websocket.send_bytes(data)
+
+    pump_task = asyncio.create_task(pump_pty_output(session, send_output))
+    receive_task: Optional[asyncio.Task] = None
+
+    async def write_input(data: str) -> bool:
+        if session.write(data):
+            return True
+        # Dropped keystrokes would leave the shell's line different from the tracked one
+        await websocket.send_json({"type": "error", "message": "Too much unread input; session closed"})
+        return False
+
+    async def submit_line(line: str) -> bool:
+        command_text = line.strip()
+        if command_text:
             try:
-                _ensure_device_control_permission(device, current_user)
+                _check_shell_line(device.device_id, command_text)
             except HTTPException as exc:
+                if not await write_input(CTRL_U):
+                    return False
                 await websocket.send_json({
                     "type": "error",
                     "command": command_text,
                     "message": exc.detail,
                 })
-                break
-
-            _record_device_log(
-                db,
-                device,
-                current_user,
-                "adb_terminal",
-                _build_command_log(command_text, result, status),
-            )
+                return True
 
+        db.refresh(device)
+        try:
+            _ensure_device_control_permission(device, current_user)
+        except HTTPException as exc:
+            session.write(CTRL_U)
             await websocket.send_json({
-                "type": "output",
+                "type": "error",
                 "command": command_text,
-                "status": status,
-                "returncode": result["returncode"],
-                "stdout": _truncate(result["stdout"], MAX_TERMINAL_RESPONSE_CHARS),
-                "stderr": _truncate(result["stderr"], MAX_TERMINAL_RESPONSE_CHARS),
+                "message": exc.detail,
             })
+            return False
+
+        if not await write_input("\r"):
+            return False
+        _record_device_log(
+            device,
+            current_user,
+            "adb_terminal",
+            json.dumps({"command": command_text, "mode": "pty"}, ensure_ascii=False),
+        )
+        return True
+
+    try:
+        while True:
+            if receive_task is None:
+                receive_task = asyncio.create_task(websocket.receive())
+
+            idle_for = time.monotonic() - last_activity
+            if idle_for >= TERMINAL_TIMEOUT_SECONDS:
+                await websocket.send_json({
+                    "type": "timeout",
+                    "message": "Session closed due to inactivity",
+                })
+                break
+            done, _ = await asyncio.wait(
+                {receive_task, pump_task},
+                timeout=TERMINAL_TIMEOUT_SECONDS - idle_for,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            if not done:
+                continue
+
+            if pump_task in done:
+                pump_task.result()
+                await session.close()
+                await websocket.send_json({
+                    "type": "exit",
+                    "returncode": session.returncode,
+                })
+                break
 
-        await websocket.close()
+            message = receive_task.result()
+            receive_task = None
+            last_activity = time.monotonic()
+            if message["type"] == "websocket.disconnect":
+                break
+
+            if message.get("bytes") is not None:
+                data = message["bytes"].decode("utf-8", errors="replace")
+            else:
+                try:
+                    payload = json.loads(message.get("text") or "")
+                except ValueError:
+                    payload = None
+                if not isinstance(payload, dict):
+                    await websocket.send_json({"type": "error", "message": "Invalid payload"})
+                    continue
+
+                message_type = payload.get("type")
+                if message_type == "ack":
+                    try:
+                        session.acknowledge(int(payload.get("bytes") or 0))
+                    except (TypeError, ValueError):
+                        pass
+                    continue
+                if message_type == "resize":
+                    try:
+                        session.resize(int(payload["cols"]), int(payload["rows"]))
+                    except (KeyError, TypeError, ValueError):
+                        await websocket.send_json({"type": "error", "message": "Invalid resize payload"})
+                    continue
+                if message_type != "input":
+                    await websocket.send_json({"type": "error", "message": "Unsupported message type"})
+                    continue
+                data = str(payload.get("data") or "")
+
+            keep_open = True
+            for kind, value in tracker.feed(data):
+                if kind == "text":
+                    keep_open = await write_input(value)
+                else:
+                    keep_open = await submit_line(value)
+                if not keep_open:
+                    break
+            if not keep_open:
+                break
+    except WebSocketDisconnect:
+        pass
     finally:
-        db.close()
+        for task in (receive_task, pump_task):
+            if task and not task.done():
+                task.cancel()
+        await session.close()
+
 
 
 
@@ -0,0 +1,340 @@
+"""Lightweight Prometheus-style counters, gauges and histograms served at `/metrics`.
+
+Recording a sample is a dict lookup and a few additions under a lock, so the
+instrumentation stays on in production. Label values are kept to small,
+fixed sets (operation, phase, route template); never label by device or user.
+"""
+import re
+import threading
+import time
+from bisect import bisect_left
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from profiling import record_span
+
+# Importing this module is among the first things the server does, so boot phases count from here
+PROCESS_STARTED_AT = time.monotonic()
+
+# Seconds; spans a sub-millisecond SQL query up to a slow full scan
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+LabelValues = Tuple[str, ...]
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _check(self, labels: LabelValues) -> LabelValues:
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {labels}")
+        return labels
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels: str) -> float:
+        return self._values.get(labels, 0)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return super().render() + [
+            f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}" for labels, value in items
+        ]
+
+
+class Gauge(_Metric):
+    """A value that goes up and down; `function` makes it computed at scrape time instead."""
+
+    kind = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        function: Optional[Callable[[], Any]] = None,
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+        self.function = function
+
+    def set(self, value: float, *labels: str) -> None:
+        with self._lock:
+            self._values[labels] = value
+
+    def render(self) -> List[str]:
+        if self.function is not None:
+            result = self.function()
+            # A labelled function gauge returns {label values: value}
+            items = sorted(result.items()) if isinstance(result, dict) else [((), result)]
+        else:
+            with self._lock:
+                items = sorted(self._values.items())
+        return super().render() + [
+            f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}" for labels, value in items
+        ]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [count per bucket (last is +Inf)..., sum, count]
+        self._series: Dict[LabelValues, List[float]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[self._check(labels)] = [0] * (len(self.buckets) + 3)
+            series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def time(self, *labels: str) -> "_Timer":
+        """Context manager observing the seconds spent inside it."""
+        return _Timer(self, labels)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted((labels, list(series)) for labels, series in self._series.items())
+        lines = super().render()
+        for labels, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {_format_value(cumulative)}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(series[-2])}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {_format_value(series[-1])}")
+        return lines
+
+
+class _Timer:
+    __slots__ = ("histogram", "labels", "started")
+
+    def __init__(self, histogram: Histogram, labels: LabelValues) -> None:
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self) -> "_Timer":
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.histogram.observe(time.perf_counter() - self.started, *self.labels)
+
+
+class MetricsRegistry:
+    def __init__(self) -> None:
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> Any:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+              function: Optional[Callable[[], Any]] = None) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames, function))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+metrics_registry = MetricsRegistry()
+
+LOCK_WAIT_SECONDS = metrics_registry.histogram(
+    "lock_wait_seconds", "Time spent waiting to acquire an instrumented lock", ["lock"]
+)
+LOCK_HELD_SECONDS = metrics_registry.histogram(
+    "lock_held_seconds", "Time an instrumented lock was held", ["lock"]
+)
+LOCK_CONTENDED_TOTAL = metrics_registry.counter(
+    "lock_contended_total", "Acquisitions that found an instrumented lock already held", ["lock"]
+)
+LOCK_SKIPPED_TOTAL = metrics_registry.counter(
+    "lock_skipped_total", "Non-blocking acquisitions that gave up because the lock was held", ["lock"]
+)
+
+HTTP_REQUEST_SECONDS = metrics_registry.histogram(
+    "http_request_duration_seconds", "HTTP request latency by route template", ["method", "route", "status"]
+)
+DB_QUERY_SECONDS = metrics_registry.histogram(
+    "db_query_duration_seconds", "SQL statement execution time", ["statement"]
+)
+
+
+class BootTimer:
+    """Seconds from process start until each boot phase (ready, first_request, fresh_fleet) first happened."""
+
+    def __init__(self) -> None:
+        self.seconds: Dict[str, float] = {}
+
+    def mark(self, phase: str) -> None:
+        if phase not in self.seconds:
+            self.seconds[phase] = round(time.monotonic() - PROCESS_STARTED_AT, 6)
+
+
+boot_timer = BootTimer()
+metrics_registry.gauge(
+    "app_boot_seconds",
+    "Seconds from process start until the app was ready, served its first request, and saw a fresh fleet scan",
+    ["phase"],
+    function=lambda: {(phase,): seconds for phase, seconds in boot_timer.seconds.items()},
+)
+
+
+class InstrumentedLock:
+    """`threading.Lock` that records wait time, hold time and contention under a `lock` label."""
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self._lock = threading.Lock()
+        self._acquired_at = 0.0
+
+    def acquire(self, blocking: bool = True, timeout: float = -1) -> bool:
+        if self._lock.acquire(blocking=False):
+            self._acquired_at = time.perf_counter()
+            LOCK_WAIT_SECONDS.observe(0.0, self.name)
+            return True
+        LOCK_CONTENDED_TOTAL.inc(self.name)
+        if not blocking:
+            LOCK_SKIPPED_TOTAL.inc(self.name)
+            return False
+        started = time.perf_counter()
+        acquired = self._lock.acquire(timeout=timeout)
+        if acquired:
+            self._acquired_at = time.perf_counter()
+            LOCK_WAIT_SECONDS.observe(self._acquired_at - started, self.name)
+        return acquired
+
+    def release(self) -> None:
+        held = time.perf_counter() - self._acquired_at
+        self._lock.release()
+        LOCK_HELD_SECONDS.observe(held, self.name)
+
+    def locked(self) -> bool:
+        return self._lock.locked()
+
+    def __enter__(self) -> bool:
+        return self.acquire()
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.release()
+
+
+_STATEMENT_KIND = re.compile(r"\s*(\w+)")
+
+
+def instrument_engine(engine: Any) -> None:
+    """Time every SQL statement of a SQLAlchemy engine by statement kind (SELECT, INSERT, ...)."""
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _start(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _stop(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["query_started"].pop()
+        match = _STATEMENT_KIND.match(statement)
+        kind = match.group(1).upper() if match else "OTHER"
+        elapsed = time.perf_counter() - started
+        DB_QUERY_SECONDS.observe(elapsed, kind)
+        record_span("sql", elapsed)
+
+    @event.listens_for(engine, "handle_error")
+    def _failed(context):
+        started = context.connection.info.get("query_started") if context.connection is not None else None
+        if started:
+            started.pop()
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording HTTP request latency labelled by route template, not raw path."""
+
+    def __init__(self, app: Any) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Dict[str, Any], receive: Any, send: Any) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        status_code = [500]
+
+        async def send_wrapper(message: Dict[str, Any]) -> None:
+            if message["type"] == "http.response.start":
+                status_code[0] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            boot_timer.mark("first_request")
+            route = scope.get("route")
+            HTTP_REQUEST_SECONDS.observe(
+                time.perf_counter() - started,
+                scope["method"],
+                getattr(route, "path", "unmatched"),
+                str(status_code[0]),
+            )
@@ -49,8 +49,20 @@ class Device(DeviceBase):
     class Config:
         from_attributes = True
 
+class DeviceBreaker(BaseModel):
+    state: str = "closed"
+    consecutive_failures: int = 0
+    opened_at: Optional[datetime] = None
+    retry_at: Optional[datetime] = None
+    backoff_seconds: Optional[float] = None
+    last_error: Optional[str] = None
+
 class DeviceWithUser(Device):
     user: Optional[User] = None
+    breaker: Optional[DeviceBreaker] = None
+    # True while the fleet has not been swept recently (e.g. right after a restart)
+    stale: bool = False
+    stale_since: Optional[datetime] = None
 
 class DeviceOccupyRequest(BaseModel):
     notes: Optional[str] = None
@@ -72,6 +84,15 @@ class DeviceUsageLogWithDetails(DeviceUsageLog):
     device: Device
     user: User
 
+class DeviceUsageRollup(BaseModel):
+    day: str
+    action: str
+    user_id: Optional[int] = None
+    count: int
+
+    class Config:
+        from_attributes = True
+
 class Token(BaseModel):
     access_token: str
     token_type: str
@@ -85,3 +106,5 @@ class DeviceStats(BaseModel):
     occupied_devices: int
     offline_devices: int
     devices_by_type: Dict[str, int]
+    stale: bool = False
+    stale_since: Optional[datetime] = None
@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+"""Fixture checks and throughput microbenchmarks for parsers.py.
+
+Every parser is first run against captured device output with known results
+(the command exits 1 if any differs), then timed on that output repeated to
+about --megabytes of input. Results are JSON with MB/s and calls/s per
+parser; --compare prints the change against an earlier run.
+
+Usage:
+    python parser_benchmark.py [--megabytes 4] [--output results.json] [--compare baseline.json]
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from parsers import (
+    parse_adb_devices_long,
+    parse_bluetoothctl_devices,
+    parse_bluetoothctl_info,
+    parse_bluetoothctl_info_blocks,
+    parse_bluetoothctl_show,
+    parse_df_output,
+    parse_mount_output,
+    parse_version_output,
+    split_bluetoothctl_info,
+)
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+BLUETOOTH_INFO = """Device 40:4E:36:AA:BB:CC (public)
+\tName: Pixel Buds
+\tAlias: Pixel Buds
+\tClass: 0x00240404
+\tIcon: audio-card
+\tPaired: yes
+\tTrusted: yes
+\tBlocked: no
+\tConnected: yes
+\tLegacyPairing: no
+\tUUID: Audio Sink                (0000110b-0000-1000-8000-00805f9b34fb)
+\tUUID: A/V Remote Control        (0000110e-0000-1000-8000-00805f9b34fb)
+\tModalias: bluetooth:v00E0p1200d1436
+\tManufacturerData Key: 0x004c
+\tManufacturerData Value:
+  07 19 01 0e 20 2b 77 8f                          .... +w.
+\tRSSI: 0xffffffc4 (-60)
+\tTxPower: 4
+\tServicesResolved: yes
+"""
+
+# Older bluez: UUID before its description, plain RSSI
+BLUETOOTH_INFO_LEGACY = """Device 00:1B:66:01:02:03
+\tName: Car Kit
+\tAlias: Car Kit
+\tPaired: no
+\tConnected: no
+\tUUID: 0000111e-0000-1000-8000-00805f9b34fb (Handsfree)
+\tRSSI: -71
+"""
+
+BLUETOOTH_UNAVAILABLE = "Device 11:22:33:44:55:66 not available\n"
+
+BLUETOOTH_DEVICES = """Device 40:4E:36:AA:BB:CC Pixel Buds
+Device 00:1B:66:01:02:03 Car Kit
+Device 11:22:33:44:55:66
+"""
+
+BLUETOOTH_SHOW = """Controller 00:1A:7D:DA:71:13 (public)
+\tName: cam-1042
+\tAlias: Cabin Camera 1042
+\tClass: 0x006c0104
+\tPowered: yes
+\tDiscoverable: no
+"""
+
+DF = """Filesystem     1K-blocks    Used Available Use% Mounted on
+/dev/block/dm-5  8388608 2097152   6291456  25% /data
+"""
+
+DF_WRAPPED = """Filesystem           1K-blocks      Used Available Use% Mounted on
+/dev/mapper/very-long-volume-name
+                      1,048,576   524,288   524,288  50% /data/zhuimi
+"""
+
+MOUNT = """/dev/block/dm-0 on / type ext4 (ro,seclabel,relatime)
+tmpfs on /dev type tmpfs (rw,seclabel,nosuid,relatime,mode=755)
+/dev/block/dm-5 on /data type ext4 (rw,seclabel,nosuid,nodev,noatime)
+not a mount line
+"""
+
+VERSION = """ql-getversion v2
+build info start
+build info version QL_CAM_2.3.1
+build info build_time 2024-05-02 10:11:12
+build info commit 8f2c1e0
+build info end
+[geticversion] ic version: 1.0.7
+[getallversion] version:camera_soc:2.3.1,cabin_soc:1.9.0,cabin_mcu:0.4.2
+"""
+
+ADB_DEVICES = """List of devices attached
+* daemon started successfully
+CAM1042        device usb:1-1 product:cam_x model:QL_Cam device:cam transport_id:3
+CAM1043        no permissions (user in plugdev group; are your udev rules wrong?) usb:1-2 transport_id:4
+CAM1044        unauthorized usb:1-3 transport_id:5
+"""
+
+PIXEL_BUDS = {
+    "mac": "40:4E:36:AA:BB:CC", "name": "Pixel Buds", "alias": "Pixel Buds", "class": "0x00240404",
+    "icon": "audio-card", "connected": True, "paired": True, "trusted": True, "blocked": False,
+    "rssi": -60, "tx_power": 4, "modalias": "bluetooth:v00E0p1200d1436", "services_resolved": True,
+    "uuids": [
+        {"uuid": "0000110b-0000-1000-8000-00805f9b34fb", "desc": "Audio Sink"},
+        {"uuid": "0000110e-0000-1000-8000-00805f9b34fb", "desc": "A/V Remote Control"},
+    ],
+    "manufacturer_data": {"0x004c": ""},
+}
+CAR_KIT = {
+    "mac": "00:1B:66:01:02:03", "name": "Car Kit", "alias": "Car Kit", "class": None, "icon": None,
+    "connected": False, "paired": False, "trusted": None, "blocked": None, "rssi": -71, "tx_power": None,
+    "modalias": None, "services_resolved": None,
+    "uuids": [{"uuid": "0000111e-0000-1000-8000-00805f9b34fb", "desc": "Handsfree"}],
+    "manufacturer_data": {},
+}
+UNAVAILABLE = {
+    **{key: None for key in PIXEL_BUDS}, "mac": "11:22:33:44:55:66", "uuids": [], "manufacturer_data": {},
+}
+CONCATENATED = BLUETOOTH_INFO + BLUETOOTH_INFO_LEGACY + BLUETOOTH_UNAVAILABLE
+
+# name -> (parser, fixture input, expected result)
+FIXTURES: Dict[str, Tuple[Callable[[str], Any], str, Any]] = {
+    "bluetoothctl info": (parse_bluetoothctl_info, BLUETOOTH_INFO, PIXEL_BUDS),
+    "bluetoothctl info (legacy)": (parse_bluetoothctl_info, BLUETOOTH_INFO_LEGACY, CAR_KIT),
+    "bluetoothctl info (empty)": (parse_bluetoothctl_info, "", {**UNAVAILABLE, "mac": None}),
+    "bluetoothctl info blocks": (parse_bluetoothctl_info_blocks, CONCATENATED, [PIXEL_BUDS, CAR_KIT, UNAVAILABLE]),
+    "bluetoothctl info split": (split_bluetoothctl_info, CONCATENATED, {
+        "40:4E:36:AA:BB:CC": BLUETOOTH_INFO,
+        "00:1B:66:01:02:03": BLUETOOTH_INFO_LEGACY,
+        "11:22:33:44:55:66": BLUETOOTH_UNAVAILABLE,
+    }),
+    "bluetoothctl devices": (parse_bluetoothctl_devices, BLUETOOTH_DEVICES, [
+        ("40:4E:36:AA:BB:CC", "Pixel Buds"), ("00:1B:66:01:02:03", "Car Kit"), ("11:22:33:44:55:66", "Unknown"),
+    ]),
+    "bluetoothctl show": (parse_bluetoothctl_show, BLUETOOTH_SHOW, {
+        "name": "cam-1042", "alias": "Cabin Camera 1042", "powered": True,
+    }),
+    "df": (parse_df_output, DF, {
+        "filesystem": "/dev/block/dm-5", "mounted_on": "/data", "size_kb": 8388608, "used_kb": 2097152,
+        "available_kb": 6291456, "used_percent": 25.0, "used_ratio": 0.25,
+        "raw_line": "/dev/block/dm-5  8388608 2097152   6291456  25% /data",
+    }),
+    "df (wrapped)": (parse_df_output, DF_WRAPPED, {
+        "filesystem": "/dev/mapper/very-long-volume-name", "mounted_on": "/data/zhuimi", "size_kb": 1048576,
+        "used_kb": 524288, "available_kb": 524288, "used_percent": 50.0, "used_ratio": 0.5,
+        "raw_line": "/dev/mapper/very-long-volume-name 1,048,576   524,288   524,288  50% /data/zhuimi",
+    }),
+    "mount": (parse_mount_output, MOUNT, {
+        "/": {"source": "/dev/block/dm-0", "fstype": "ext4", "options": ["ro", "seclabel", "relatime"],
+              "writable": False},
+        "/dev": {"source": "tmpfs", "fstype": "tmpfs",
+                 "options": ["rw", "seclabel", "nosuid", "relatime", "mode=755"], "writable": True},
+        "/data": {"source": "/dev/block/dm-5", "fstype": "ext4",
+                  "options": ["rw", "seclabel", "nosuid", "nodev", "noatime"], "writable": True},
+    }),
+    "ql-getversion": (parse_version_output, VERSION, {
+        "host": "2.3.1", "host_starflash": "1.0.7", "cabin": "1.9.0", "cabin_starflash": "0.4.2",
+        "build_info": {"version": "QL_CAM_2.3.1", "build_time": "2024-05-02 10:11:12", "commit": "8f2c1e0"},
+        "module_versions": {"camera_soc": "2.3.1", "camera_mcu": "1.0.7", "cabin_soc": "1.9.0", "cabin_mcu": "0.4.2"},
+    }),
+    "adb devices -l": (parse_adb_devices_long, ADB_DEVICES, [
+        {"serial": "CAM1042", "state": "device", "usb": "1-1", "product": "cam_x", "model": "QL_Cam",
+         "device": "cam", "transport_id": "3"},
+        {"serial": "CAM1043", "state": "no permissions (user in plugdev group; are your udev rules wrong?)",
+         "usb": "1-2", "transport_id": "4"},
+        {"serial": "CAM1044", "state": "unauthorized", "usb": "1-3", "transport_id": "5"},
+    ]),
+}
+
+# name -> (parser, one unit of input); each call parses one unit
+SINGLE_BENCHMARKS: Dict[str, Tuple[Callable[[str], Any], str]] = {
+    "bluetoothctl info": (parse_bluetoothctl_info, BLUETOOTH_INFO),
+    "bluetoothctl show": (parse_bluetoothctl_show, BLUETOOTH_SHOW),
+    "df": (parse_df_output, DF),
+    "mount": (parse_mount_output, MOUNT),
+    "ql-getversion": (parse_version_output, VERSION),
+    "adb devices -l": (parse_adb_devices_long, ADB_DEVICES),
+}
+
+# name -> (parser, block); one call parses the block repeated to the whole corpus
+CORPUS_BENCHMARKS: Dict[str, Tuple[Callable[[str], Any], str]] = {
+    "bluetoothctl info blocks": (parse_bluetoothctl_info_blocks, BLUETOOTH_INFO + BLUETOOTH_INFO_LEGACY),
+    "bluetoothctl info split": (split_bluetoothctl_info, BLUETOOTH_INFO + BLUETOOTH_INFO_LEGACY),
+}
+
+
+def check_fixtures() -> Dict[str, bool]:
+    checks = {}
+    for name, (parser, text, expected) in FIXTURES.items():
+        actual = parser(text)
+        checks[name] = actual == expected
+        if not checks[name]:
+            print(f"{name}: expected {expected!r}\n{' ' * len(name)}  got      {actual!r}", file=sys.stderr)
+    return checks
+
+
+def _throughput(input_bytes: int, calls: int, seconds: float) -> Dict[str, Any]:
+    return {
+        "input_bytes": input_bytes,
+        "calls": calls,
+        "seconds": round(seconds, 4),
+        "mb_per_second": round(input_bytes / seconds / 1e6, 2),
+        "calls_per_second": round(calls / seconds, 1),
+    }
+
+
+def bench_single(parser: Callable[[str], Any], text: str, megabytes: float) -> Dict[str, Any]:
+    calls = max(1, int(megabytes * 1e6 / len(text)))
+    started = time.perf_counter()
+    for _ in range(calls):
+        parser(text)
+    return _throughput(calls * len(text), calls, time.perf_counter() - started)
+
+
+def bench_corpus(parser: Callable[[str], Any], block: str, megabytes: float) -> Dict[str, Any]:
+    corpus = block * max(1, int(megabytes * 1e6 / len(block)))
+    started = time.perf_counter()
+    parser(corpus)
+    return _throughput(len(corpus), 1, time.perf_counter() - started)
+
+
+def _git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (subprocess.SubprocessError, FileNotFoundError):
+        return None
+
+
+def compare(baseline: Dict[str, Any], current: Dict[str, Any]) -> List[str]:
+    lines = []
+    for name, result in current["benchmarks"].items():
+        before = baseline.get("benchmarks", {}).get(name)
+        if before and before.get("mb_per_second"):
+            old, new = before["mb_per_second"], result["mb_per_second"]
+            lines.append(f"{name}: {old} -> {new} MB/s ({(new - old) / old * 100:+.1f}%)")
+    return lines
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--megabytes", type=float, default=4, help="input parsed per benchmark")
+    parser.add_argument("--output", help="write the JSON results here instead of stdout")
+    parser.add_argument("--compare", help="earlier results JSON to compare against")
+    args = parser.parse_args()
+
+    checks = check_fixtures()
+    results: Dict[str, Any] = {
+        "revision": _git_revision(),
+        "python": platform.python_version(),
+        "checks": checks,
+        "ok": all(checks.values()),
+        "benchmarks": {},
+    }
+    for name, (parse, text) in SINGLE_BENCHMARKS.items():
+        results["benchmarks"][name] = bench_single(parse, text, args.megabytes)
+    for name, (parse, block) in CORPUS_BENCHMARKS.items():
+        results["benchmarks"][name] = bench_corpus(parse, block, args.megabytes)
+
+    report = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as handle:
+            handle.write(report + "\n")
+    else:
+        print(report)
+    if args.compare:
+        with open(args.compare) as handle:
+            for line in compare(json.load(handle), results):
+                print(line, file=sys.stderr)
+    return 0 if results["ok"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,410 @@
+"""Parsers for the text adb, bluetoothctl, df, mount and ql-getversion print on devices.
+
+Patterns are compiled once at import and lines are dispatched through lookup
+tables instead of trying one regex after another, since the scanner runs some
+of these for every Bluetooth peer on every scan. `parser_benchmark.py` checks
+them against fixtures and measures their throughput.
+"""
+import re
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# ---------------------------------------------------------------- bluetoothctl
+
+_BLUETOOTH_DEVICE = re.compile(r"Device\s+([0-9A-Fa-f:]{17})")
+_BLUETOOTH_UUID = re.compile(r"[0-9a-fA-F-]{4,}")
+# Keys are compared lowercased without spaces or underscores, so `TxPower`,
+# `Tx Power` and `tx_power` all land in the same field
+_BLUETOOTH_KEY_DELETE = str.maketrans("", "", " _")
+
+
+def _text(value: str) -> Optional[str]:
+    return value or None
+
+
+def _yes_no(value: str) -> bool:
+    return value.lower() == "yes"
+
+
+def _signed_int(value: str) -> Optional[int]:
+    # Newer bluez prints `RSSI: 0xffffffc4 (-60)`; the decimal is in the parentheses
+    if value.endswith(")") and "(" in value:
+        value = value[value.rindex("(") + 1:-1]
+    try:
+        return int(value)
+    except ValueError:
+        return None
+
+
+# normalized key -> (field, converter)
+BLUETOOTH_INFO_FIELDS: Dict[str, Tuple[str, Callable[[str], Any]]] = {
+    "name": ("name", _text),
+    "alias": ("alias", _text),
+    "class": ("class", _text),
+    "icon": ("icon", _text),
+    "connected": ("connected", _yes_no),
+    "paired": ("paired", _yes_no),
+    "trusted": ("trusted", _yes_no),
+    "blocked": ("blocked", _yes_no),
+    "rssi": ("rssi", _signed_int),
+    "txpower": ("tx_power", _signed_int),
+    "modalias": ("modalias", _text),
+    "servicesresolved": ("services_resolved", _yes_no),
+}
+
+
+def _empty_bluetooth_info() -> Dict[str, Any]:
+    return {
+        "mac": None,
+        "name": None,
+        "alias": None,
+        "class": None,
+        "icon": None,
+        "connected": None,
+        "paired": None,
+        "trusted": None,
+        "blocked": None,
+        "rssi": None,
+        "tx_power": None,
+        "modalias": None,
+        "services_resolved": None,
+        "uuids": [],
+        "manufacturer_data": {},
+    }
+
+
+def _parse_uuid(value: str) -> Optional[Dict[str, Optional[str]]]:
+    """`Audio Sink (0000110b-...)`, `0000110b-... (Audio Sink)` or a bare UUID."""
+    if value.endswith(")") and "(" in value:
+        head, _, tail = value[:-1].rpartition("(")
+        head, tail = head.strip(), tail.strip()
+        if _BLUETOOTH_UUID.fullmatch(tail):
+            return {"uuid": tail, "desc": head or None}
+        if _BLUETOOTH_UUID.fullmatch(head):
+            return {"uuid": head, "desc": tail or None}
+        return None
+    if _BLUETOOTH_UUID.fullmatch(value):
+        return {"uuid": value, "desc": None}
+    return None
+
+
+def _add_uuid(parsed: Dict[str, Any], value: str) -> None:
+    uuid = _parse_uuid(value)
+    if uuid is not None:
+        parsed["uuids"].append(uuid)
+
+
+def _add_manufacturer_data(parsed: Dict[str, Any], value: str) -> None:
+    # `ManufacturerData Key: 0x004c` or `ManufacturerData: 0x004c 06 1a ...`
+    parts = value.split(None, 1)
+    if parts:
+        parsed["manufacturer_data"][parts[0]] = parts[1] if len(parts) > 1 else ""
+
+
+def _setter(field: str, convert: Callable[[str], Any]) -> Callable[[Dict[str, Any], str], None]:
+    def apply(parsed: Dict[str, Any], value: str) -> None:
+        parsed[field] = convert(value)
+    return apply
+
+
+_BLUETOOTH_SETTERS = {key: _setter(field, convert) for key, (field, convert) in BLUETOOTH_INFO_FIELDS.items()}
+# Raw key as printed -> handler (None for keys we ignore); filled on first sight of each spelling
+_BLUETOOTH_KEY_HANDLERS: Dict[str, Optional[Callable[[Dict[str, Any], str], None]]] = {}
+_BLUETOOTH_KEY_HANDLERS_MAX = 1024
+
+
+def _bluetooth_key_handler(key: str) -> Optional[Callable[[Dict[str, Any], str], None]]:
+    normalized = key.lower().translate(_BLUETOOTH_KEY_DELETE)
+    if normalized == "uuid":
+        handler = _add_uuid
+    elif normalized.startswith("manufacturerdata"):
+        handler = _add_manufacturer_data
+    else:
+        handler = _BLUETOOTH_SETTERS.get(normalized)
+    if len(_BLUETOOTH_KEY_HANDLERS) < _BLUETOOTH_KEY_HANDLERS_MAX:
+        _BLUETOOTH_KEY_HANDLERS[key] = handler
+    return handler
+
+
+def parse_bluetoothctl_info_blocks(text: str) -> List[Dict[str, Any]]:
+    """Parse the output of one or several `bluetoothctl info` runs, one dict per `Device` block.
+
+    Lines before the first `Device` header (output without one) form a block
+    of their own.
+    """
+    blocks: List[Dict[str, Any]] = []
+    if not text:
+        return blocks
+    handlers = _BLUETOOTH_KEY_HANDLERS
+    current: Optional[Dict[str, Any]] = None
+    for raw in text.splitlines():
+        line = raw.strip()
+        if not line:
+            continue
+        if line[0] == "D" and line.startswith("Device"):
+            match = _BLUETOOTH_DEVICE.match(line)
+            if match:
+                current = _empty_bluetooth_info()
+                current["mac"] = match.group(1)
+                blocks.append(current)
+                continue
+        if current is None:
+            current = _empty_bluetooth_info()
+            blocks.append(current)
+        key, sep, value = line.partition(":")
+        if not sep:
+            continue
+        handler = handlers[key] if key in handlers else _bluetooth_key_handler(key)
+        if handler is not None:
+            handler(current, value.strip())
+    return blocks
+
+
+def parse_bluetoothctl_info(text: str) -> Dict[str, Any]:
+    """Parse `bluetoothctl info` output of a single device into structured fields."""
+    blocks = parse_bluetoothctl_info_blocks(text)
+    return blocks[0] if blocks else _empty_bluetooth_info()
+
+
+def split_bluetoothctl_info(text: str) -> Dict[str, str]:
+    """Raw text of each `Device` block of concatenated `bluetoothctl info` output, by MAC."""
+    blocks: Dict[str, List[str]] = {}
+    current: Optional[List[str]] = None
+    for line in text.splitlines(keepends=True):
+        stripped = line.strip()
+        if stripped.startswith("Device"):
+            match = _BLUETOOTH_DEVICE.match(stripped)
+            if match:
+                current = blocks.setdefault(match.group(1), [])
+        if current is not None:
+            current.append(line)
+    return {mac: "".join(lines) for mac, lines in blocks.items()}
+
+
+def parse_bluetoothctl_devices(text: str) -> List[Tuple[str, str]]:
+    """`bluetoothctl devices` lines (`Device <mac> <name>`) as (mac, name) pairs."""
+    devices = []
+    for raw in text.splitlines():
+        line = raw.strip()
+        if line.startswith("Device "):
+            parts = line.split(" ", 2)
+            if len(parts) >= 2:
+                devices.append((parts[1], parts[2] if len(parts) > 2 else "Unknown"))
+    return devices
+
+
+def parse_bluetoothctl_show(text: str) -> Dict[str, Any]:
+    """Controller name, alias and power state from `bluetoothctl show`."""
+    controller: Dict[str, Any] = {"name": None, "alias": None, "powered": False}
+    for raw in text.splitlines():
+        key, sep, value = raw.strip().partition(":")
+        if not sep:
+            continue
+        if key == "Name":
+            controller["name"] = value.strip()
+        elif key == "Alias":
+            controller["alias"] = value.strip()
+        elif key == "Powered":
+            controller["powered"] = "yes" in value.lower()
+    return controller
+
+
+# ---------------------------------------------------------------- mount / df
+
+_MOUNT_LINE = re.compile(r"^(?P<source>\S+) on (?P<mountpoint>\S+) type (?P<fstype>\S+) \((?P<options>[^)]*)\)")
+
+
+def parse_mount_output(mount_output: str) -> Dict[str, Dict[str, Any]]:
+    """Parse `mount` command output into a dictionary keyed by mount point."""
+    mounts: Dict[str, Dict[str, Any]] = {}
+    match_line = _MOUNT_LINE.match
+    for raw_line in mount_output.splitlines():
+        match = match_line(raw_line.strip())
+        if not match:
+            continue
+
+        options = [opt.strip() for opt in match.group("options").split(',') if opt.strip()]
+        mounts[match.group("mountpoint")] = {
+            "source": match.group("source"),
+            "fstype": match.group("fstype"),
+            "options": options,
+            "writable": any(opt.startswith("rw") for opt in options)
+        }
+
+    return mounts
+
+
+def _parse_int(value: str) -> Optional[int]:
+    """Convert numeric strings that may include commas into integers."""
+    if value is None:
+        return None
+    stripped = value.replace(',', '').strip()
+    if not stripped:
+        return None
+    try:
+        return int(stripped)
+    except ValueError:
+        return None
+
+
+def _parse_percent(value: str) -> Optional[float]:
+    """Parse percentage strings such as '45%' into float values."""
+    if value is None:
+        return None
+    stripped = value.strip().rstrip('%')
+    if not stripped:
+        return None
+    try:
+        return float(stripped)
+    except ValueError:
+        return None
+
+
+def parse_df_output(df_output: str) -> Optional[Dict[str, Any]]:
+    """Parse `df` command output (single path) into structured usage details."""
+    if not df_output:
+        return None
+
+    # Only the last data row is used
+    last_line = previous_line = None
+    for raw_line in df_output.splitlines():
+        line = raw_line.strip()
+        if line and not line.lower().startswith("filesystem"):
+            previous_line, last_line = last_line, line
+
+    if last_line is None:
+        return None
+
+    parts = last_line.split()
+    if len(parts) == 5 and previous_line is not None and len(previous_line.split()) == 1:
+        # A long filesystem name puts the numbers on a line of their own
+        last_line = f"{previous_line} {last_line}"
+        parts = [previous_line] + parts
+    if len(parts) < 6:
+        return None
+
+    filesystem = parts[0]
+    size_kb = _parse_int(parts[-5])
+    used_kb = _parse_int(parts[-4])
+    available_kb = _parse_int(parts[-3])
+    used_percent = _parse_percent(parts[-2])
+    mounted_on = parts[-1]
+
+    used_ratio = None
+    if size_kb and used_kb is not None and size_kb > 0:
+        used_ratio = used_kb / size_kb
+
+    return {
+        "filesystem": filesystem,
+        "mounted_on": mounted_on,
+        "size_kb": size_kb,
+        "used_kb": used_kb,
+        "available_kb": available_kb,
+        "used_percent": used_percent,
+        "used_ratio": used_ratio,
+        "raw_line": last_line,
+    }
+
+
+# ---------------------------------------------------------------- ql-getversion
+
+MODULE_VERSION_FIELDS = ("camera_soc", "camera_mcu", "cabin_soc", "cabin_mcu")
+
+_BUILD_INFO_LINE = re.compile(r"build info\s+(?P<key>\w+)\s*(?P<value>.+)", re.IGNORECASE)
+_IC_VERSION = re.compile(r"version[:：]\s*([^,\s]+)", re.IGNORECASE)
+
+
+def parse_version_output(version_output: str) -> Dict[str, Any]:
+    """Parse ql-getversion output into structured build/module versions."""
+
+    build_info: Dict[str, Optional[str]] = {
+        "version": None,
+        "build_time": None,
+        "hostname": None,
+        "commit": None,
+        "branch": None,
+    }
+
+    module_versions: Dict[str, Optional[str]] = {field: None for field in MODULE_VERSION_FIELDS}
+
+    ic_version: Optional[str] = None
+    in_build_section = False
+
+    for raw_line in version_output.splitlines():
+        line = raw_line.strip()
+        if not line:
+            continue
+
+        lower_line = line.lower()
+        if "build info start" in lower_line:
+            in_build_section = True
+            continue
+        if "build info end" in lower_line:
+            in_build_section = False
+            continue
+
+        if in_build_section:
+            match = _BUILD_INFO_LINE.search(line)
+            if match:
+                key = match.group("key").lower()
+                if key in build_info:
+                    build_info[key] = match.group("value").strip() or None
+            continue
+
+        if "geticversion" in lower_line:
+            matches = _IC_VERSION.findall(line)
+            if matches:
+                ic_version = matches[-1].strip() or None
+        elif "getallversion" in lower_line and "version:" in lower_line:
+            version_str = line.rsplit("version:", 1)[1]
+            for pair in version_str.split(','):
+                key, _, value = pair.partition(':')
+                key = key.strip().lower()
+                if key in module_versions:
+                    module_versions[key] = value.strip() or None
+
+    if not module_versions.get("camera_mcu") and ic_version:
+        module_versions["camera_mcu"] = ic_version
+
+    normalized: Dict[str, Any] = {
+        "host": module_versions.get("camera_soc") or build_info.get("version"),
+        "host_starflash": module_versions.get("camera_mcu"),
+        "cabin": module_versions.get("cabin_soc"),
+        "cabin_starflash": module_versions.get("cabin_mcu"),
+        "build_info": {k: v for k, v in build_info.items() if v},
+        "module_versions": module_versions,
+    }
+
+    return normalized
+
+
+# ---------------------------------------------------------------- adb devices
+
+ADB_DEVICE_ATTRIBUTES = {"usb", "product", "model", "device", "transport_id"}
+
+
+def parse_adb_devices_long(output: str) -> List[Dict[str, str]]:
+    """Parse `adb devices -l` into serial, state and key:value attributes.
+
+    The state can span several words (`no permissions (...)`), so everything
+    between the serial and the first known attribute is taken as the state.
+    """
+    entries = []
+    for raw_line in output.splitlines():
+        line = raw_line.strip()
+        if not line or line.startswith("List of devices") or line.startswith("*"):
+            continue
+        parts = line.split()
+        if len(parts) < 2:
+            continue
+
+        entry = {"serial": parts[0]}
+        state_words = []
+        for token in parts[1:]:
+            key, sep, value = token.partition(":")
+            if sep and key in ADB_DEVICE_ATTRIBUTES:
+                entry[key] = value
+            elif len(entry) == 1:
+                state_words.append(token)
+        entry["state"] = " ".join(state_words)
+        entries.append(entry)
+    return entries
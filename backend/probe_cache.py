@@ -0,0 +1,172 @@
+"""TTL read-through cache for expensive per-device adb probes."""
+import asyncio
+import os
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional, Tuple
+
+# Seconds a probe result stays fresh; override with e.g. PROBE_CACHE_TTL_VERSIONS=600
+PROBE_CACHE_TTLS: Dict[str, float] = {
+    "versions": 300.0,
+    "mounts": 30.0,
+    "wifi_ap": 120.0,
+    "bluetooth": 15.0,
+}
+for _probe in list(PROBE_CACHE_TTLS):
+    _override = os.environ.get(f"PROBE_CACHE_TTL_{_probe.upper()}")
+    if _override:
+        PROBE_CACHE_TTLS[_probe] = float(_override)
+
+CacheKey = Tuple[str, str]
+
+
+class _InFlight:
+    __slots__ = ("done", "value", "error")
+
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.value: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class ProbeCache:
+    """Cache probe results per (device, probe) with single-flight loading.
+
+    Concurrent misses for the same key share one loader call; errors are
+    propagated to every waiter and never cached. A result whose load started
+    before an `invalidate()` for the device is returned but not stored.
+    """
+
+    def __init__(self, ttls: Optional[Dict[str, float]] = None) -> None:
+        self.ttls = ttls if ttls is not None else PROBE_CACHE_TTLS
+        self._entries: Dict[CacheKey, Tuple[float, Any]] = {}
+        self._in_flight: Dict[CacheKey, _InFlight] = {}
+        self._async_in_flight: Dict[CacheKey, asyncio.Future] = {}
+        self._generations: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_load(
+        self,
+        device_id: str,
+        probe: str,
+        loader: Callable[[], Any],
+        fresh: bool = False,
+    ) -> Tuple[Any, Dict[str, Any]]:
+        """Return (value, cache_info) where cache_info reports hit/age/ttl."""
+        key = (device_id, probe)
+        ttl = self.ttls.get(probe, 0.0)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            now = time.monotonic()
+            if not fresh and entry and now - entry[0] < ttl:
+                self.hits += 1
+                return entry[1], self._info(True, now - entry[0], ttl)
+
+            flight = self._in_flight.get(key)
+            owner = flight is None
+            if owner:
+                flight = self._in_flight[key] = _InFlight()
+                generation = self._generations.get(device_id, 0)
+            self.misses += 1
+
+        if not owner:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value, self._info(False, 0.0, ttl)
+
+        try:
+            flight.value = loader()
+        except BaseException as exc:
+            flight.error = exc
+            raise
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+                if flight.error is None and self._generations.get(device_id, 0) == generation:
+                    self._entries[key] = (time.monotonic(), flight.value)
+            flight.done.set()
+
+        return flight.value, self._info(False, 0.0, ttl)
+
+    async def get_or_load_async(
+        self,
+        device_id: str,
+        probe: str,
+        loader: Callable[[], Awaitable[Any]],
+        fresh: bool = False,
+    ) -> Tuple[Any, Dict[str, Any]]:
+        """Coroutine variant of `get_or_load` for probes that run on the event loop."""
+        key = (device_id, probe)
+        ttl = self.ttls.get(probe, 0.0)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            now = time.monotonic()
+            if not fresh and entry and now - entry[0] < ttl:
+                self.hits += 1
+                return entry[1], self._info(True, now - entry[0], ttl)
+
+            future = self._async_in_flight.get(key)
+            owner = future is None
+            if owner:
+                future = self._async_in_flight[key] = asyncio.get_running_loop().create_future()
+                # Keep asyncio quiet about errors nobody else was waiting for
+                future.add_done_callback(lambda f: f.cancelled() or f.exception())
+                generation = self._generations.get(device_id, 0)
+            self.misses += 1
+
+        if not owner:
+            try:
+                value = await asyncio.shield(future)
+            except asyncio.CancelledError:
+                # Only the owner was cancelled, not this waiter: start the probe over instead of failing too
+                if future.cancelled() and not asyncio.current_task().cancelling():
+                    return await self.get_or_load_async(device_id, probe, loader, fresh)
+                raise
+            return value, self._info(False, 0.0, ttl)
+
+        try:
+            value = await loader()
+        except BaseException as exc:
+            with self._lock:
+                self._async_in_flight.pop(key, None)
+            if isinstance(exc, asyncio.CancelledError):
+                future.cancel()
+            else:
+                future.set_exception(exc)
+            raise
+
+        with self._lock:
+            self._async_in_flight.pop(key, None)
+            if self._generations.get(device_id, 0) == generation:
+                self._entries[key] = (time.monotonic(), value)
+        future.set_result(value)
+        return value, self._info(False, 0.0, ttl)
+
+    def invalidate(self, device_id: str, probes: Optional[Iterable[str]] = None) -> None:
+        with self._lock:
+            self._generations[device_id] = self._generations.get(device_id, 0) + 1
+            targets = list(probes) if probes is not None else list(self.ttls)
+            for probe in targets:
+                self._entries.pop((device_id, probe), None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "in_flight": len(self._in_flight) + len(self._async_in_flight),
+                "hits": self.hits,
+                "misses": self.misses,
+                "ttls": dict(self.ttls),
+            }
+
+    @staticmethod
+    def _info(hit: bool, age: float, ttl: float) -> Dict[str, Any]:
+        return {"hit": hit, "age_seconds": round(age, 3), "ttl_seconds": ttl}
+
+
+probe_cache = ProbeCache()
@@ -0,0 +1,286 @@
+"""On-demand request and scan profiling: timing breakdowns and sampled stacks for flamegraphs.
+
+Nothing is measured until an admin arms the profiler for the next N requests
+or the next full scan. Disarmed, the hooks cost one ContextVar lookup each.
+A profiled request reports where its time went in a `Server-Timing` header
+(SQL, adb subprocesses, JSON decoding, response serialization), and every
+profile keeps the stacks sampled while it ran in the folded format that
+flamegraph.pl, inferno and speedscope read.
+"""
+import functools
+import inspect
+import itertools
+import os
+import sys
+import threading
+import time
+from collections import Counter as StackCounter, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional
+
+from fastapi.routing import APIRoute
+
+PROFILE_SAMPLE_INTERVAL_SECONDS = float(os.environ.get("PROFILE_SAMPLE_INTERVAL_MS", "2")) / 1000
+PROFILE_HISTORY = 20
+PROFILE_MAX_ARMED_REQUESTS = 100
+PROFILE_MAX_STACK_DEPTH = 128
+
+# Server-Timing metric names in the order they are reported
+PROFILE_CATEGORIES = ("sql", "subprocess", "decode", "serialize")
+
+
+class Profile:
+    """Timings and stack samples collected for one request or scan."""
+
+    def __init__(self, profile_id: int, kind: str, label: str) -> None:
+        self.id = profile_id
+        self.kind = kind
+        self.label = label
+        self.started_at = datetime.utcnow()
+        self.started = time.perf_counter()
+        self.duration: Optional[float] = None
+        self.endpoint_finished: Optional[float] = None
+        self.status: Optional[int] = None
+        # category -> [seconds, count]; scans add from several threads, so the totals may exceed wall time
+        self.spans: Dict[str, List[float]] = {}
+        self.stacks: "StackCounter[str]" = StackCounter()
+        self.samples = 0
+        self.sampler: Optional["_StackSampler"] = None
+        self.token: Any = None
+        self._lock = threading.Lock()
+
+    def add(self, category: str, seconds: float) -> None:
+        with self._lock:
+            span = self.spans.setdefault(category, [0.0, 0])
+            span[0] += seconds
+            span[1] += 1
+
+    def server_timing(self, now: float) -> str:
+        entries = []
+        with self._lock:
+            spans = {category: list(span) for category, span in self.spans.items()}
+        if self.endpoint_finished is not None:
+            # From the endpoint's return until the response starts: validation, encoding, rendering
+            spans["serialize"] = [now - self.endpoint_finished, 1]
+        for category in PROFILE_CATEGORIES:
+            if category in spans:
+                seconds, count = spans[category]
+                entries.append(f'{category};dur={seconds * 1000:.3f};desc="{int(count)}x"')
+        entries.append(f"total;dur={(now - self.started) * 1000:.3f}")
+        return ", ".join(entries)
+
+    def folded(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "label": self.label,
+            "status": self.status,
+            "started_at": self.started_at,
+            "duration_ms": round(self.duration * 1000, 3) if self.duration is not None else None,
+            "breakdown_ms": {
+                category: {"ms": round(seconds * 1000, 3), "count": int(count)}
+                for category, (seconds, count) in self.spans.items()
+            },
+            "samples": self.samples,
+            "sample_interval_ms": PROFILE_SAMPLE_INTERVAL_SECONDS * 1000,
+        }
+
+
+_current_profile: ContextVar[Optional[Profile]] = ContextVar("current_profile", default=None)
+
+
+def record_span(category: str, seconds: float) -> None:
+    """Add time spent in `category` to the profile of the running request or scan, if any."""
+    profile = _current_profile.get()
+    if profile is not None:
+        profile.add(category, seconds)
+
+
+@contextmanager
+def span(category: str) -> Iterator[None]:
+    profile = _current_profile.get()
+    if profile is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.add(category, time.perf_counter() - started)
+
+
+class _StackSampler:
+    """Sample the Python stacks of every other thread into a profile until stopped."""
+
+    def __init__(self, profile: Profile) -> None:
+        self.profile = profile
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"profile-sampler-{profile.id}", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        own = threading.get_ident()
+        while not self._stop.wait(PROFILE_SAMPLE_INTERVAL_SECONDS):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < PROFILE_MAX_STACK_DEPTH:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.profile.stacks[";".join(reversed(stack))] += 1
+            self.profile.samples += 1
+
+
+class Profiler:
+    """Arms profiling for upcoming requests and scans and keeps the recent profiles."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self.armed_requests = 0
+        self.armed_scan = False
+        self.path_prefix: Optional[str] = None
+        self.profiles: Deque[Profile] = deque(maxlen=PROFILE_HISTORY)
+
+    def arm(self, requests: int = 0, scan: bool = False, path_prefix: Optional[str] = None) -> None:
+        with self._lock:
+            self.armed_requests = max(0, min(requests, PROFILE_MAX_ARMED_REQUESTS))
+            self.armed_scan = scan
+            self.path_prefix = path_prefix
+
+    def disarm(self) -> None:
+        self.arm(0, False, None)
+
+    def claim_request(self, path: str) -> bool:
+        if not self.armed_requests:
+            return False
+        with self._lock:
+            if self.armed_requests <= 0 or (self.path_prefix and not path.startswith(self.path_prefix)):
+                return False
+            self.armed_requests -= 1
+            return True
+
+    def claim_scan(self) -> bool:
+        if not self.armed_scan:
+            return False
+        with self._lock:
+            claimed, self.armed_scan = self.armed_scan, False
+            return claimed
+
+    def begin(self, kind: str, label: str) -> Profile:
+        profile = Profile(next(self._ids), kind, label)
+        profile.sampler = _StackSampler(profile)
+        profile.token = _current_profile.set(profile)
+        profile.sampler.start()
+        return profile
+
+    def end(self, profile: Profile) -> None:
+        profile.duration = time.perf_counter() - profile.started
+        profile.sampler.stop()
+        _current_profile.reset(profile.token)
+        with self._lock:
+            self.profiles.append(profile)
+
+    @contextmanager
+    def profile_scan(self, label: str) -> Iterator[Optional[Profile]]:
+        """Profile the enclosed scan if a scan profile was armed."""
+        if not self.claim_scan():
+            yield None
+            return
+        profile = self.begin("scan", label)
+        try:
+            yield profile
+        finally:
+            self.end(profile)
+
+    def get(self, profile_id: int) -> Optional[Profile]:
+        with self._lock:
+            return next((profile for profile in self.profiles if profile.id == profile_id), None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "armed_requests": self.armed_requests,
+                "armed_scan": self.armed_scan,
+                "path_prefix": self.path_prefix,
+                "profiles": [profile.summary() for profile in reversed(self.profiles)],
+            }
+
+
+profiler = Profiler()
+
+
+class ProfilingMiddleware:
+    """ASGI middleware that profiles armed requests and adds their `Server-Timing` header."""
+
+    def __init__(self, app: Any) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Dict[str, Any], receive: Any, send: Any) -> None:
+        if scope["type"] != "http" or not profiler.claim_request(scope["path"]):
+            await self.app(scope, receive, send)
+            return
+
+        profile = profiler.begin("request", f"{scope['method']} {scope['path']}")
+
+        async def send_wrapper(message: Dict[str, Any]) -> None:
+            if message["type"] == "http.response.start":
+                profile.status = message["status"]
+                timing = profile.server_timing(time.perf_counter())
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", timing.encode("latin-1")))
+                headers.append((b"x-profile-id", str(profile.id).encode("latin-1")))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            profiler.end(profile)
+
+
+def _mark_endpoint_finished() -> None:
+    profile = _current_profile.get()
+    if profile is not None:
+        profile.endpoint_finished = time.perf_counter()
+
+
+def _timed_endpoint(endpoint: Callable[..., Any]) -> Callable[..., Any]:
+    if inspect.iscoroutinefunction(endpoint):
+        @functools.wraps(endpoint)
+        async def async_wrapper(*args: Any, **kwargs: Any) -> Any:
+            try:
+                return await endpoint(*args, **kwargs)
+            finally:
+                _mark_endpoint_finished()
+        return async_wrapper
+
+    @functools.wraps(endpoint)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        try:
+            return endpoint(*args, **kwargs)
+        finally:
+            _mark_endpoint_finished()
+    return wrapper
+
+
+class ProfiledRoute(APIRoute):
+    """Route that notes when its endpoint returned, so a profile can tell endpoint time from serialization."""
+
+    def __init__(self, path: str, endpoint: Callable[..., Any], **kwargs: Any) -> None:
+        super().__init__(path, _timed_endpoint(endpoint), **kwargs)
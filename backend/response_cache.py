@@ -0,0 +1,100 @@
+"""Serialized device list and stats responses, cached against the fleet revision.
+
+The dashboard and device list poll `/api/devices` and `/api/devices/stats`
+and almost always get back what they got last time. Every transaction that
+changes a device or user bumps the `fleet_revision` row along with its
+writes; each request reads that row before anything else, and a newer
+revision drops every cached body. Until then a repeated query is answered
+from its cached bytes, and a client whose `If-None-Match` carries the body's
+ETag gets a 304. Because the revision lives in the database, a change made
+by any process is seen on the next request of every other one, with or
+without the event bus. ETags hash the body itself, so they stay strong and
+agree across workers.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Callable, Hashable, Optional, Tuple
+
+from fastapi import Response
+
+from metrics import metrics_registry
+
+RESPONSE_CACHE_MAX_ENTRIES = 256
+
+RESPONSE_CACHE_TOTAL = metrics_registry.counter(
+    "response_cache_requests_total", "Cacheable GETs answered from a cached body (hit) or rebuilt (miss)",
+    ["route", "result"],
+)
+
+
+def strong_etag(body: bytes) -> str:
+    return '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match uses the weak comparison, so a `W/` prefix on the client's tag is ignored."""
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == etag:
+            return True
+    return False
+
+
+class FleetResponseCache:
+    """Serialized JSON bodies by query for the newest fleet revision seen.
+
+    A key must hold everything besides the devices and users tables that
+    shapes the body (filters, fleet staleness, breaker states). A body built
+    while a newer revision was seen is served once but not stored, and so is
+    one for a revision older than the newest seen.
+    """
+
+    def __init__(self, max_entries: int = RESPONSE_CACHE_MAX_ENTRIES) -> None:
+        self.max_entries = max_entries
+        self.revision = 0
+        self._entries: "OrderedDict[Hashable, Tuple[str, bytes]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def respond(
+        self,
+        route: str,
+        key: Hashable,
+        revision: int,
+        if_none_match: Optional[str],
+        build: Callable[[], bytes],
+    ) -> Response:
+        """Answer from the cached body for `key`, building (and caching) it with `build` on a miss.
+
+        `revision` must be read before `build` queries anything, so a body is
+        never older than the revision it is cached under.
+        """
+        with self._lock:
+            if revision > self.revision:
+                self.revision = revision
+                self._entries.clear()
+            current = revision == self.revision
+            entry = self._entries.get(key) if current else None
+            if entry is not None:
+                self._entries.move_to_end(key)
+        RESPONSE_CACHE_TOTAL.inc(route, "hit" if entry is not None else "miss")
+        if entry is None:
+            body = build()
+            entry = (strong_etag(body), body)
+            with self._lock:
+                if current and self.revision == revision:
+                    self._entries[key] = entry
+                    if len(self._entries) > self.max_entries:
+                        self._entries.popitem(last=False)
+
+        etag, body = entry
+        # Browsers keep the body and revalidate every poll, turning our 304s back into the full response
+        headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+        if etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers=headers)
+        return Response(content=body, media_type="application/json", headers=headers)
+
+
+fleet_response_cache = FleetResponseCache()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""Standalone scanner process for deployments whose API workers run with SCANNER_MODE=external.
+
+Runs the presence sweeps, deep probes, adb server health checks and
+maintenance jobs that an API worker would otherwise run, and publishes scan
+and device events on the event bus (use EVENT_BUS_BACKEND=unix so they reach
+the workers' WebSocket clients). It takes the same scanner lease as the API
+workers, so a standby scanner can be started next to it for failover.
+
+Scan metrics are served at http://0.0.0.0:SCANNER_METRICS_PORT/metrics
+(default 9108; 0 disables), since this process has no API of its own.
+
+Usage:
+    python scanner.py
+"""
+import asyncio
+import logging
+import os
+import signal
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from agent_hub import agent_hub
+from audit import audit_writer
+from database import create_tables
+from event_bus import event_bus
+from main_enhanced import start_scanner, stop_scanner
+from metrics import metrics_registry
+from telemetry import telemetry_store
+
+SCANNER_METRICS_PORT = int(os.environ.get("SCANNER_METRICS_PORT", "9108"))
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self) -> None:
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = metrics_registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+
+def serve_metrics(port: int) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(("0.0.0.0", port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="scanner-metrics", daemon=True).start()
+    return server
+
+
+async def run() -> None:
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stop.set)
+
+    metrics_server = serve_metrics(SCANNER_METRICS_PORT) if SCANNER_METRICS_PORT else None
+    create_tables()
+    await event_bus.start()
+    audit_writer.start()
+    await loop.run_in_executor(None, agent_hub.start)
+    start_scanner()
+    try:
+        await stop.wait()
+    finally:
+        await loop.run_in_executor(None, stop_scanner)
+        await loop.run_in_executor(None, agent_hub.stop)
+        await event_bus.stop()
+        await loop.run_in_executor(None, audit_writer.stop)
+        await loop.run_in_executor(None, telemetry_store.flush)
+        if metrics_server is not None:
+            metrics_server.shutdown()
+
+
+def main() -> None:
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,314 @@
+"""Array-backed time-series store for per-device health samples."""
+import logging
+import math
+import threading
+import time
+from array import array
+from collections import defaultdict
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from database import SessionLocal, TelemetryChunk as DBTelemetryChunk
+
+logger = logging.getLogger(__name__)
+
+TELEMETRY_SAMPLE_INTERVAL_SECONDS = 60
+TELEMETRY_CHUNK_SAMPLES = 720
+# Open chunks are written out (and rewritten as they grow) this often, so a crash loses at most this
+# much and processes other than the sampler see recent samples
+TELEMETRY_CHECKPOINT_SECONDS = 600
+TELEMETRY_RAW_RETENTION_SECONDS = 2 * 24 * 3600
+TELEMETRY_ROLLUP_STEP_SECONDS = 300
+TELEMETRY_RETENTION_SECONDS = 90 * 24 * 3600
+TELEMETRY_MAX_POINTS = 500
+
+TELEMETRY_METRICS = {
+    "disk.root.used_percent": "Used space of / in percent",
+    "disk.data.used_percent": "Used space of /data in percent",
+    "disk.zhuimi.used_percent": "Used space of /data/zhuimi in percent",
+    "uptime_seconds": "Device uptime from /proc/uptime",
+    "link.online": "1 when the device is reachable (ADB online / Bluetooth connected)",
+    "bt.rssi": "Bluetooth RSSI in dBm",
+    "bt.tx_power": "Bluetooth TX power in dBm",
+}
+
+TELEMETRY_AGGREGATES = ("avg", "min", "max", "last")
+
+SeriesKey = Tuple[int, str]
+
+
+class _OpenChunk:
+    """Samples not yet sealed into a chunk, kept in compact typed arrays.
+
+    `row_id` is the telemetry_chunks row the last checkpoint wrote them to.
+    """
+
+    __slots__ = ("timestamps", "values", "row_id")
+
+    def __init__(self) -> None:
+        self.timestamps = array("d")
+        self.values = array("f")
+        self.row_id: Optional[int] = None
+
+
+def _pack(start_ts: float, timestamps: np.ndarray, values: np.ndarray) -> Tuple[bytes, bytes]:
+    offsets = np.round(timestamps - start_ts).astype(np.uint32)
+    return offsets.tobytes(), values.astype(np.float32).tobytes()
+
+
+def _unpack(chunk: DBTelemetryChunk) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Return timestamps plus mean/min/max columns for a stored chunk."""
+    timestamps = np.frombuffer(chunk.timestamps, dtype=np.uint32).astype(np.float64) + chunk.start_ts
+    values = np.frombuffer(chunk.values, dtype=np.float32)
+    if chunk.resolution:
+        values = values.reshape(3, -1)
+        return timestamps, values[0], values[1], values[2]
+    return timestamps, values, values, values
+
+
+def _bucketize(
+    timestamps: np.ndarray,
+    means: np.ndarray,
+    mins: np.ndarray,
+    maxs: np.ndarray,
+    origin: float,
+    step: float,
+) -> Dict[str, np.ndarray]:
+    """Aggregate sorted samples into fixed-width buckets with vectorized reductions."""
+    buckets = np.floor((timestamps - origin) / step).astype(np.int64)
+    bucket_ids, starts = np.unique(buckets, return_index=True)
+    ends = np.append(starts[1:], len(timestamps))
+    return {
+        "ts": origin + bucket_ids * step,
+        "avg": np.add.reduceat(means, starts) / (ends - starts),
+        "min": np.minimum.reduceat(mins, starts),
+        "max": np.maximum.reduceat(maxs, starts),
+        "last": means[ends - 1],
+        "count": ends - starts,
+    }
+
+
+class TelemetryStore:
+    """Collect samples in memory and persist them as packed, column-wise chunks.
+
+    Raw samples are sealed into `telemetry_chunks` rows every
+    TELEMETRY_CHUNK_SAMPLES samples; until then the open chunk's row is
+    rewritten every TELEMETRY_CHECKPOINT_SECONDS. `downsample()` replaces raw chunks older
+    than TELEMETRY_RAW_RETENTION_SECONDS with mean/min/max buckets of
+    TELEMETRY_ROLLUP_STEP_SECONDS and drops data past TELEMETRY_RETENTION_SECONDS.
+    """
+
+    def __init__(
+        self,
+        session_factory: Callable = SessionLocal,
+        chunk_samples: int = TELEMETRY_CHUNK_SAMPLES,
+        checkpoint_seconds: float = TELEMETRY_CHECKPOINT_SECONDS,
+    ) -> None:
+        self.session_factory = session_factory
+        self.chunk_samples = chunk_samples
+        self.checkpoint_seconds = checkpoint_seconds
+        self._open: Dict[SeriesKey, _OpenChunk] = {}
+        self._lock = threading.Lock()
+        self._checkpointed_at = time.monotonic()
+
+    def record_many(self, samples: Iterable[Tuple[int, str, float, float]]) -> None:
+        """Record (device_pk, metric, epoch_ts, value) samples."""
+        sealed: List[Tuple[SeriesKey, _OpenChunk]] = []
+        checkpoint: List[Tuple[SeriesKey, _OpenChunk]] = []
+        with self._lock:
+            for device_pk, metric, ts, value in samples:
+                if value is None or (isinstance(value, float) and math.isnan(value)):
+                    continue
+                key = (device_pk, metric)
+                chunk = self._open.get(key)
+                if chunk is None:
+                    chunk = self._open[key] = _OpenChunk()
+                chunk.timestamps.append(float(ts))
+                chunk.values.append(float(value))
+                if len(chunk.timestamps) >= self.chunk_samples:
+                    sealed.append((key, self._open.pop(key)))
+            if time.monotonic() - self._checkpointed_at >= self.checkpoint_seconds:
+                self._checkpointed_at = time.monotonic()
+                idle_before = time.time() - self.checkpoint_seconds
+                for key, chunk in list(self._open.items()):
+                    # A series that stopped reporting is sealed rather than left open indefinitely
+                    if chunk.timestamps[-1] < idle_before:
+                        sealed.append((key, self._open.pop(key)))
+                    else:
+                        checkpoint.append((key, chunk))
+
+        if sealed or checkpoint:
+            self._persist(sealed + checkpoint)
+
+    def record(self, device_pk: int, metric: str, value: float, ts: Optional[float] = None) -> None:
+        self.record_many([(device_pk, metric, ts if ts is not None else time.time(), value)])
+
+    def flush(self) -> None:
+        """Seal every open chunk, e.g. before shutdown."""
+        with self._lock:
+            sealed = list(self._open.items())
+            self._open = {}
+        if sealed:
+            self._persist(sealed)
+
+    def _persist(self, chunks: List[Tuple[SeriesKey, _OpenChunk]]) -> None:
+        """Write each chunk to its row, creating the row the first time the chunk is written."""
+        created: List[Tuple[_OpenChunk, DBTelemetryChunk]] = []
+        db = self.session_factory()
+        try:
+            for (device_pk, metric), chunk in chunks:
+                with self._lock:
+                    # Chunks still open keep growing on the sampler thread
+                    timestamps = np.array(chunk.timestamps, dtype=np.float64)
+                    values = np.array(chunk.values, dtype=np.float32)
+                    row_id = chunk.row_id
+                start_ts = float(timestamps[0])
+                packed_ts, packed_values = _pack(start_ts, timestamps, values)
+                columns = {
+                    "start_ts": start_ts,
+                    "end_ts": float(timestamps[-1]),
+                    "sample_count": len(values),
+                    "timestamps": packed_ts,
+                    "values": packed_values,
+                }
+                if row_id is not None:
+                    db.query(DBTelemetryChunk).filter(DBTelemetryChunk.id == row_id).update(
+                        columns, synchronize_session=False
+                    )
+                else:
+                    row = DBTelemetryChunk(device_id=device_pk, metric=metric, resolution=0, **columns)
+                    db.add(row)
+                    created.append((chunk, row))
+            db.flush()
+            with self._lock:
+                # Set before the commit makes the rows visible, so query() never counts a sample twice
+                for chunk, row in created:
+                    chunk.row_id = row.id
+            db.commit()
+        except Exception as exc:
+            db.rollback()
+            with self._lock:
+                for chunk, _ in created:
+                    chunk.row_id = None
+            logger.error("Failed to persist telemetry chunks: %s", exc)
+        finally:
+            db.close()
+
+    def downsample(self, now: Optional[float] = None) -> Dict[str, int]:
+        """Fold aged raw chunks into rollup chunks and expire old history."""
+        now = now if now is not None else time.time()
+        raw_cutoff = now - TELEMETRY_RAW_RETENTION_SECONDS
+        expiry_cutoff = now - TELEMETRY_RETENTION_SECONDS
+        step = TELEMETRY_ROLLUP_STEP_SECONDS
+        summary = {"raw_chunks_folded": 0, "rollup_chunks_written": 0, "chunks_expired": 0}
+
+        db = self.session_factory()
+        try:
+            summary["chunks_expired"] = db.query(DBTelemetryChunk).filter(
+                DBTelemetryChunk.end_ts < expiry_cutoff
+            ).delete(synchronize_session=False)
+
+            aged = db.query(DBTelemetryChunk).filter(
+                DBTelemetryChunk.resolution == 0,
+                DBTelemetryChunk.end_ts < raw_cutoff,
+            ).order_by(DBTelemetryChunk.device_id, DBTelemetryChunk.metric, DBTelemetryChunk.start_ts).all()
+
+            by_series: Dict[SeriesKey, List[DBTelemetryChunk]] = defaultdict(list)
+            for chunk in aged:
+                by_series[(chunk.device_id, chunk.metric)].append(chunk)
+
+            for (device_pk, metric), chunks in by_series.items():
+                columns = [_unpack(chunk) for chunk in chunks]
+                timestamps = np.concatenate([c[0] for c in columns])
+                values = np.concatenate([c[1] for c in columns]).astype(np.float64)
+                order = np.argsort(timestamps, kind="stable")
+                timestamps, values = timestamps[order], values[order]
+
+                origin = math.floor(timestamps[0] / step) * step
+                agg = _bucketize(timestamps, values, values, values, origin, step)
+                stacked = np.vstack([agg["avg"], agg["min"], agg["max"]]).astype(np.float32)
+                start_ts = float(agg["ts"][0])
+                packed_ts, _ = _pack(start_ts, agg["ts"], agg["avg"])
+
+                db.add(DBTelemetryChunk(
+                    device_id=device_pk,
+                    metric=metric,
+                    resolution=step,
+                    start_ts=start_ts,
+                    end_ts=float(agg["ts"][-1]),
+                    sample_count=len(agg["ts"]),
+                    timestamps=packed_ts,
+                    values=stacked.tobytes(),
+                ))
+                for chunk in chunks:
+                    db.delete(chunk)
+                summary["raw_chunks_folded"] += len(chunks)
+                summary["rollup_chunks_written"] += 1
+
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+        return summary
+
+    def query(
+        self,
+        device_pk: int,
+        metric: str,
+        start_ts: float,
+        end_ts: float,
+        step: Optional[float] = None,
+        agg: str = "avg",
+    ) -> Dict[str, Any]:
+        """Return bucketed points for one series between two epoch timestamps."""
+        db = self.session_factory()
+        try:
+            chunks = db.query(DBTelemetryChunk).filter(
+                DBTelemetryChunk.device_id == device_pk,
+                DBTelemetryChunk.metric == metric,
+                DBTelemetryChunk.end_ts >= start_ts,
+                DBTelemetryChunk.start_ts <= end_ts,
+            ).order_by(DBTelemetryChunk.start_ts).all()
+        finally:
+            db.close()
+
+        open_part = None
+        open_row_id = None
+        with self._lock:
+            open_chunk = self._open.get((device_pk, metric))
+            if open_chunk is not None and len(open_chunk.timestamps):
+                timestamps = np.array(open_chunk.timestamps, dtype=np.float64)
+                values = np.array(open_chunk.values, dtype=np.float32)
+                open_part = (timestamps, values, values, values)
+                open_row_id = open_chunk.row_id
+
+        # The in-memory samples supersede the open chunk's last checkpoint
+        parts = [_unpack(chunk) for chunk in chunks if chunk.id != open_row_id]
+        if open_part is not None:
+            parts.append(open_part)
+
+        if step is None:
+            step = max(1.0, math.ceil((end_ts - start_ts) / TELEMETRY_MAX_POINTS))
+
+        result = {"metric": metric, "step": step, "agg": agg, "points": []}
+        if not parts:
+            return result
+
+        timestamps = np.concatenate([p[0] for p in parts])
+        mask = (timestamps >= start_ts) & (timestamps <= end_ts)
+        if not mask.any():
+            return result
+
+        order = np.argsort(timestamps[mask], kind="stable")
+        columns = [np.concatenate([p[i] for p in parts])[mask][order].astype(np.float64) for i in range(1, 4)]
+        aggregated = _bucketize(timestamps[mask][order], *columns, origin=start_ts, step=step)
+
+        result["points"] = np.column_stack([aggregated["ts"], aggregated[agg]]).round(3).tolist()
+        return result
+
+
+telemetry_store = TelemetryStore()
@@ -0,0 +1,403 @@
+"""Persistent PTY-backed `adb shell` sessions for the terminal WebSocket."""
+import asyncio
+import asyncio.subprocess as aio_subprocess
+import codecs
+import logging
+import os
+import signal
+import struct
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from adb_shards import adb_shards
+
+try:
+    import fcntl
+    import pty
+    import termios
+except ImportError:  # pragma: no cover - PTYs are unavailable on Windows
+    pty = None
+
+logger = logging.getLogger(__name__)
+
+PTY_READ_CHUNK_BYTES = 64 * 1024
+# Flow control: stop reading from the PTY once this many bytes were sent to the
+# client without being acknowledged, resume when the backlog drops below the low mark.
+PTY_HIGH_WATERMARK_BYTES = 256 * 1024
+PTY_LOW_WATERMARK_BYTES = 64 * 1024
+# Keystrokes the shell has not read yet; a client that types (or pastes) past this loses the excess
+PTY_MAX_PENDING_INPUT_BYTES = 1024 * 1024
+DEFAULT_PTY_COLS = 120
+DEFAULT_PTY_ROWS = 30
+# Window sizes are clamped to 1..PTY_MAX_DIMENSION; TIOCSWINSZ only takes unsigned shorts
+PTY_MAX_DIMENSION = 1000
+TERMINAL_STREAM_CHUNK_BYTES = 16 * 1024
+TERMINAL_LOG_PREVIEW = 800
+# Hard deadline for a single terminal command, independent of output volume
+TERMINAL_COMMAND_TIMEOUT_SECONDS = 600
+
+CTRL_C = "\x03"
+CTRL_U = "\x15"
+CTRL_D = "\x04"
+BACKSPACE_CHARS = ("\x7f", "\b")
+
+
+async def stream_process_output(
+    command_tokens: List[str],
+    on_chunk: Callable[[str, str], Awaitable[None]],
+    cancel_event: asyncio.Event,
+    max_output_bytes: int,
+    env: Optional[Dict[str, str]] = None,
+    on_started: Optional[Callable[[], None]] = None,
+) -> Dict[str, Any]:
+    """Run a command, handing stdout/stderr chunks to `on_chunk` as they arrive.
+
+    The process group is killed once the combined output exceeds
+    `max_output_bytes`, when `cancel_event` is set or after
+    TERMINAL_COMMAND_TIMEOUT_SECONDS. Only the first TERMINAL_LOG_PREVIEW
+    characters of each stream are kept in the returned result. `on_started`
+    is called once the process has been spawned.
+    """
+    process = await asyncio.create_subprocess_exec(
+        *command_tokens,
+        stdout=aio_subprocess.PIPE,
+        stderr=aio_subprocess.PIPE,
+        # Own process group so children holding the pipes die with the command
+        start_new_session=os.name == "posix",
+        env=env,
+    )
+    if on_started is not None:
+        on_started()
+
+    state = {"bytes": 0, "truncated": False, "cancelled": False, "timed_out": False}
+    previews: Dict[str, str] = {"stdout": "", "stderr": ""}
+
+    def kill() -> None:
+        if process.returncode is not None:
+            return
+        try:
+            if os.name == "posix":
+                os.killpg(process.pid, signal.SIGKILL)
+            else:
+                process.kill()
+        except ProcessLookupError:
+            pass
+
+    async def emit(stream_name: str, text: str) -> None:
+        if not text:
+            return
+        if len(previews[stream_name]) <= TERMINAL_LOG_PREVIEW:
+            previews[stream_name] += text[:TERMINAL_LOG_PREVIEW + 1]
+        await on_chunk(stream_name, text)
+
+    async def pump(stream: asyncio.StreamReader, stream_name: str) -> None:
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        while True:
+            data = await stream.read(TERMINAL_STREAM_CHUNK_BYTES)
+            if not data:
+                await emit(stream_name, decoder.decode(b"", final=True))
+                return
+            if state["truncated"] or state["cancelled"] or state["timed_out"]:
+                continue
+
+            remaining = max_output_bytes - state["bytes"]
+            if len(data) > remaining:
+                data = data[:remaining]
+                state["truncated"] = True
+                kill()
+            state["bytes"] += len(data)
+            await emit(stream_name, decoder.decode(data))
+
+    async def watch_cancel() -> None:
+        try:
+            await asyncio.wait_for(cancel_event.wait(), TERMINAL_COMMAND_TIMEOUT_SECONDS)
+            state["cancelled"] = True
+        except asyncio.TimeoutError:
+            state["timed_out"] = True
+        kill()
+
+    watcher = asyncio.create_task(watch_cancel())
+    try:
+        await asyncio.gather(
+            pump(process.stdout, "stdout"),
+            pump(process.stderr, "stderr"),
+        )
+        await process.wait()
+    finally:
+        watcher.cancel()
+        kill()
+
+    if state["cancelled"]:
+        status = "cancelled"
+    elif state["timed_out"]:
+        status = "timeout"
+    elif state["truncated"]:
+        status = "truncated"
+    else:
+        status = "success" if process.returncode == 0 else "error"
+
+    return {
+        "returncode": process.returncode,
+        "stdout": previews["stdout"],
+        "stderr": previews["stderr"],
+        "status": status,
+        "output_bytes": state["bytes"],
+    }
+
+
+def pty_supported() -> bool:
+    return pty is not None
+
+
+class ShellLineTracker:
+    """Reconstruct the shell line typed by the user from raw terminal input.
+
+    Keystrokes are forwarded to the remote shell as they arrive, except for the
+    line terminator: the caller gets the completed line back so it can be
+    checked against the command policy before Enter is sent. Only keys whose
+    effect on the remote line is known are forwarded: printable characters,
+    which the shell appends, Backspace, and Ctrl-C and Ctrl-U, which clear the
+    line. Escape sequences (cursor keys, history, Alt bindings), Tab and other
+    control characters are dropped, so the shell's line editor cannot make the
+    line it runs differ from the one that was checked. Ctrl-D only goes
+    through on an empty line, where it means end of input.
+    """
+
+    def __init__(self) -> None:
+        self.buffer: List[str] = []
+        self._escape: Optional[str] = None
+
+    def reset(self) -> None:
+        self.buffer = []
+        self._escape = None
+
+    def feed(self, data: str) -> List[tuple]:
+        """Split input into ("text", str) segments to forward and ("line", str) completed lines."""
+        segments: List[tuple] = []
+        pending: List[str] = []
+
+        def flush_pending() -> None:
+            if pending:
+                segments.append(("text", "".join(pending)))
+                pending.clear()
+
+        for char in data:
+            if self._escape is not None:
+                self._escape += char
+                # CSI (ESC [ ... final byte in @..~), SS3 (ESC O x) or a bare ESC x
+                if self._escape == "[" or self._escape == "O":
+                    continue
+                if self._escape[0] == "[" and not ("@" <= char <= "~"):
+                    continue
+                self._escape = None
+                continue
+
+            if char == "\x1b":
+                self._escape = ""
+            elif char in ("\r", "\n"):
+                flush_pending()
+                segments.append(("line", "".join(self.buffer)))
+                self.buffer = []
+            elif char in BACKSPACE_CHARS:
+                if self.buffer:
+                    self.buffer.pop()
+                    # ^H is not the erase character of every tty; ^? is
+                    pending.append("\x7f")
+            elif char in (CTRL_C, CTRL_U):
+                self.buffer = []
+                pending.append(char)
+            elif char == CTRL_D:
+                if not self.buffer:
+                    pending.append(char)
+            elif char >= " ":
+                self.buffer.append(char)
+                pending.append(char)
+
+        flush_pending()
+        return segments
+
+
+def _clamp_dimension(value: int) -> int:
+    return max(1, min(int(value), PTY_MAX_DIMENSION))
+
+
+class PtyTerminalSession:
+    """One long-lived `adb shell` process attached to a local pseudo-terminal."""
+
+    def __init__(
+        self,
+        device_id: str,
+        cols: int = DEFAULT_PTY_COLS,
+        rows: int = DEFAULT_PTY_ROWS,
+        adb_command: Optional[List[str]] = None,
+    ) -> None:
+        self.device_id = device_id
+        self.cols = _clamp_dimension(cols)
+        self.rows = _clamp_dimension(rows)
+        self.adb_command = adb_command or adb_shards.route(["adb", "-s", device_id, "shell"])
+        self.process: Optional[asyncio.subprocess.Process] = None
+        self.master_fd: Optional[int] = None
+        self.output: "asyncio.Queue[Optional[bytes]]" = asyncio.Queue()
+        self.unacked_bytes = 0
+        self._reading = False
+        self._closed = False
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._pending_input = bytearray()
+
+    async def start(self) -> None:
+        if pty is None:
+            raise RuntimeError("PTY sessions are not supported on this platform")
+
+        master_fd, slave_fd = pty.openpty()
+        try:
+            self._set_winsize(master_fd, self.cols, self.rows)
+            self.process = await asyncio.create_subprocess_exec(
+                *self.adb_command,
+                stdin=slave_fd,
+                stdout=slave_fd,
+                stderr=slave_fd,
+                start_new_session=True,
+                env=adb_shards.env_for(self.adb_command),
+            )
+        except Exception:
+            os.close(master_fd)
+            os.close(slave_fd)
+            raise
+        os.close(slave_fd)
+        os.set_blocking(master_fd, False)
+
+        self.master_fd = master_fd
+        self._loop = asyncio.get_running_loop()
+        self._resume_reading()
+
+    @staticmethod
+    def _set_winsize(fd: int, cols: int, rows: int) -> None:
+        fcntl.ioctl(fd, termios.TIOCSWINSZ, struct.pack("HHHH", rows, cols, 0, 0))
+
+    def _resume_reading(self) -> None:
+        if self._reading or self._closed or self.master_fd is None:
+            return
+        self._loop.add_reader(self.master_fd, self._on_readable)
+        self._reading = True
+
+    def _pause_reading(self) -> None:
+        if not self._reading or self.master_fd is None:
+            return
+        self._loop.remove_reader(self.master_fd)
+        self._reading = False
+
+    def _on_readable(self) -> None:
+        try:
+            chunk = os.read(self.master_fd, PTY_READ_CHUNK_BYTES)
+        except BlockingIOError:
+            return
+        except OSError:
+            # EIO is how Linux reports that the slave side has been closed
+            chunk = b""
+
+        if not chunk:
+            self._pause_reading()
+            self.output.put_nowait(None)
+            return
+
+        self.unacked_bytes += len(chunk)
+        self.output.put_nowait(chunk)
+        if self.unacked_bytes >= PTY_HIGH_WATERMARK_BYTES:
+            self._pause_reading()
+
+    def acknowledge(self, byte_count: int) -> None:
+        """Record bytes rendered by the client and resume reading if drained."""
+        self.unacked_bytes = max(0, self.unacked_bytes - max(0, int(byte_count)))
+        if self.unacked_bytes <= PTY_LOW_WATERMARK_BYTES:
+            self._resume_reading()
+
+    def write(self, data: str) -> bool:
+        """Queue keystrokes for the shell; False if they were dropped because too much is queued already.
+
+        The PTY input buffer is tiny, so whatever the shell has not read yet
+        waits here and is written as the fd becomes writable, in order.
+        """
+        if self.master_fd is None or self._closed:
+            return False
+        payload = data.encode("utf-8")
+        if len(self._pending_input) + len(payload) > PTY_MAX_PENDING_INPUT_BYTES:
+            logger.warning("Dropping %d bytes of terminal input for %s: shell is not reading",
+                           len(payload), self.device_id)
+            return False
+        was_idle = not self._pending_input
+        self._pending_input += payload
+        if was_idle:
+            self._on_writable()
+        return True
+
+    def _on_writable(self) -> None:
+        try:
+            written = os.write(self.master_fd, self._pending_input)
+        except BlockingIOError:
+            written = 0
+        except OSError:
+            # The shell is gone; its exit is reported by the output side
+            written = len(self._pending_input)
+        del self._pending_input[:written]
+        if self._pending_input:
+            self._loop.add_writer(self.master_fd, self._on_writable)
+        else:
+            self._loop.remove_writer(self.master_fd)
+
+    def resize(self, cols: int, rows: int) -> None:
+        if self.master_fd is None or self._closed:
+            return
+        self.cols = _clamp_dimension(cols)
+        self.rows = _clamp_dimension(rows)
+        self._set_winsize(self.master_fd, self.cols, self.rows)
+
+    @property
+    def returncode(self) -> Optional[int]:
+        return self.process.returncode if self.process else None
+
+    async def close(self) -> None:
+        if self._closed:
+            return
+        self._pause_reading()
+        self._closed = True
+        if self.master_fd is not None:
+            self._loop.remove_writer(self.master_fd)
+        self._pending_input.clear()
+
+        if self.process and self.process.returncode is None:
+            try:
+                self.process.terminate()
+                await asyncio.wait_for(self.process.wait(), timeout=3)
+            except ProcessLookupError:
+                pass
+            except asyncio.TimeoutError:
+                self.process.kill()
+                await self.process.wait()
+
+        if self.master_fd is not None:
+            try:
+                os.close(self.master_fd)
+            except OSError:
+                pass
+            self.master_fd = None
+
+
+async def pump_pty_output(
+    session: PtyTerminalSession,
+    send_bytes: Callable[[bytes], "asyncio.Future"],
+) -> None:
+    """Forward PTY output to the client as binary frames until the shell exits."""
+    while True:
+        chunk = await session.output.get()
+        if chunk is None:
+            return
+        # Coalesce whatever else is already queued into one frame
+        parts = [chunk]
+        size = len(chunk)
+        while size < PTY_READ_CHUNK_BYTES and not session.output.empty():
+            extra = session.output.get_nowait()
+            if extra is None:
+                await send_bytes(b"".join(parts))
+                return
+            parts.append(extra)
+            size += len(extra)
+        await send_bytes(b"".join(parts))
@@ -0,0 +1,299 @@
+"""Fan-out of bus events to `/ws` clients through per-connection bounded queues and a topic index."""
+import asyncio
+import json
+import logging
+import os
+import re
+import time
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+from fastapi import WebSocket
+
+from metrics import metrics_registry
+
+logger = logging.getLogger(__name__)
+
+# Messages buffered per client before it counts as a slow consumer
+WS_CLIENT_QUEUE_SIZE = int(os.environ.get("WS_CLIENT_QUEUE_SIZE", "256"))
+# A single send blocked longer than this means the client stopped reading
+WS_SEND_TIMEOUT_SECONDS = float(os.environ.get("WS_SEND_TIMEOUT_SECONDS", "10"))
+# "resync": throw the backlog away and tell the client to refetch; "drop": disconnect it
+WS_SLOW_CONSUMER_POLICY = os.environ.get("WS_SLOW_CONSUMER_POLICY", "resync")
+WS_POLICY_RESYNC = "resync"
+WS_POLICY_DROP = "drop"
+# Close code for clients dropped for falling behind (1013: try again later)
+WS_CLOSE_SLOW_CONSUMER = 1013
+
+# Subscriptions one client may hold; a dashboard of a few devices needs far fewer
+WS_MAX_TOPICS_PER_CLIENT = 256
+
+WS_BROADCAST_FANOUT_SECONDS = metrics_registry.histogram(
+    "ws_broadcast_fanout_seconds", "Time to serialize an event and queue it for every interested /ws client",
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5),
+)
+WS_DROPPED_MESSAGES = metrics_registry.counter(
+    "ws_dropped_messages_total", "Events not delivered to a /ws client because it fell behind"
+)
+
+WS_RESYNC_MESSAGE = json.dumps({"type": "resync", "reason": "slow_consumer"})
+
+# Topics a client may subscribe to: every event of a kind, one device, one group,
+# its own user's occupancy events. "occupancy:me" is resolved per connection.
+WS_TOPIC_PATTERN = re.compile(r"^(device_update|occupancy|scan|occupancy:me|device:.+|group:.+)$")
+WS_TOPIC_OWN_OCCUPANCY = "occupancy:me"
+
+
+def event_topics(event: Dict[str, Any]) -> List[str]:
+    """Index keys an event is delivered under: its type plus the devices, groups and user it concerns."""
+    kind = event.get("type")
+    topics = [kind]
+    device_ids = event.get("device_ids") or ([event["device_id"]] if event.get("device_id") else [])
+    topics.extend(f"device:{device_id}" for device_id in device_ids)
+    topics.extend(f"group:{group}" for group in event.get("groups") or [])
+    if kind == "occupancy" and event.get("user_id") is not None:
+        topics.append(f"occupancy:user:{event['user_id']}")
+    return topics
+
+
+class ClientConnection:
+    """One `/ws` client: its outbound queue, writer task and counters."""
+
+    def __init__(self, websocket: WebSocket, queue_size: int, user_id: Optional[int] = None) -> None:
+        self.websocket = websocket
+        self.user_id = user_id
+        # Topic as the client named it -> index key; empty means every event
+        self.topics: Dict[str, str] = {}
+        self.queue: "asyncio.Queue[str]" = asyncio.Queue(maxsize=queue_size)
+        self.writer: Optional[asyncio.Task] = None
+        self.client = f"{websocket.client.host}:{websocket.client.port}" if websocket.client else None
+        self.connected_at = time.time()
+        # While set, events are discarded until the writer has delivered the resync notice
+        self.resync_pending = False
+        self.sent_messages = 0
+        self.sent_bytes = 0
+        self.dropped_messages = 0
+        self.overflows = 0
+        self.max_queue_depth = 0
+        self.last_send_ms: Optional[float] = None
+        self.max_send_ms = 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "client": self.client,
+            "user_id": self.user_id,
+            "topics": sorted(self.topics) or None,
+            "connected_seconds": round(time.time() - self.connected_at, 3),
+            "queue_depth": self.queue.qsize(),
+            "max_queue_depth": self.max_queue_depth,
+            "resync_pending": self.resync_pending,
+            "sent_messages": self.sent_messages,
+            "sent_bytes": self.sent_bytes,
+            "dropped_messages": self.dropped_messages,
+            "overflows": self.overflows,
+            "last_send_ms": self.last_send_ms,
+            "max_send_ms": round(self.max_send_ms, 3),
+        }
+
+
+class ConnectionManager:
+    """Registry of `/ws` clients that broadcasts without waiting on any of them.
+
+    `broadcast` serializes a message once and only enqueues the resulting
+    string; each client's writer task drains its own queue, so a stalled
+    browser delays nobody but itself. A client whose queue overflows is
+    handled per WS_SLOW_CONSUMER_POLICY, and one whose send blocks for
+    WS_SEND_TIMEOUT_SECONDS is disconnected.
+
+    Clients that never subscribe receive every event. Subscribed clients sit
+    in a topic index and an event only visits the entries for its own
+    topics, so its cost grows with the number of interested clients.
+    """
+
+    def __init__(
+        self,
+        queue_size: int = WS_CLIENT_QUEUE_SIZE,
+        slow_consumer_policy: str = WS_SLOW_CONSUMER_POLICY,
+    ) -> None:
+        if slow_consumer_policy not in (WS_POLICY_RESYNC, WS_POLICY_DROP):
+            raise ValueError(f"Unknown WS_SLOW_CONSUMER_POLICY {slow_consumer_policy!r}")
+        self.queue_size = queue_size
+        self.slow_consumer_policy = slow_consumer_policy
+        self.connections: Dict[WebSocket, ClientConnection] = {}
+        self._unfiltered: Set[ClientConnection] = set()
+        self._index: Dict[str, Set[ClientConnection]] = {}
+        self.broadcasts_total = 0
+        self.disconnected_slow_total = 0
+        self.resyncs_total = 0
+        self.last_fanout_ms: Optional[float] = None
+        self.last_fanout_recipients = 0
+
+    async def connect(self, websocket: WebSocket, user_id: Optional[int] = None) -> ClientConnection:
+        await websocket.accept()
+        connection = ClientConnection(websocket, self.queue_size, user_id)
+        self.connections[websocket] = connection
+        self._unfiltered.add(connection)
+        connection.writer = asyncio.create_task(self._write(connection))
+        return connection
+
+    def disconnect(self, websocket: WebSocket) -> None:
+        """Forget a client and stop its writer; safe to call more than once."""
+        connection = self.connections.pop(websocket, None)
+        if connection is None:
+            return
+        self._unfiltered.discard(connection)
+        for key in connection.topics.values():
+            self._unindex(key, connection)
+        if connection.writer is not None and connection.writer is not asyncio.current_task():
+            connection.writer.cancel()
+
+    def subscribe(self, websocket: WebSocket, topics: Iterable[str]) -> List[str]:
+        """Add topics to a client's subscriptions; returns the client's topics afterwards."""
+        connection = self.connections[websocket]
+        topics = list(topics)
+        for topic in topics:
+            if not isinstance(topic, str) or not WS_TOPIC_PATTERN.match(topic):
+                raise ValueError(f"Unknown topic {topic!r}")
+            if topic == WS_TOPIC_OWN_OCCUPANCY and connection.user_id is None:
+                raise ValueError("occupancy:me needs a connection opened with ?token=")
+        if len(set(connection.topics) | set(topics)) > WS_MAX_TOPICS_PER_CLIENT:
+            raise ValueError(f"At most {WS_MAX_TOPICS_PER_CLIENT} topics per connection")
+
+        for topic in topics:
+            if topic in connection.topics:
+                continue
+            key = f"occupancy:user:{connection.user_id}" if topic == WS_TOPIC_OWN_OCCUPANCY else topic
+            connection.topics[topic] = key
+            self._index.setdefault(key, set()).add(connection)
+        self._unfiltered.discard(connection)
+        return sorted(connection.topics)
+
+    def unsubscribe(self, websocket: WebSocket, topics: Iterable[str]) -> List[str]:
+        """Drop topics from a client's subscriptions; returns the client's topics afterwards.
+
+        A client left without topics keeps receiving nothing until it
+        subscribes again; it does not fall back to every event.
+        """
+        connection = self.connections[websocket]
+        for topic in topics:
+            key = connection.topics.pop(topic, None)
+            if key is not None:
+                self._unindex(key, connection)
+        self._unfiltered.discard(connection)
+        return sorted(connection.topics)
+
+    def handle_message(self, websocket: WebSocket, text: str) -> None:
+        """Apply a `subscribe` / `unsubscribe` request from a client and queue the reply."""
+        connection = self.connections.get(websocket)
+        if connection is None:
+            return
+        try:
+            message = json.loads(text)
+            kind = message.get("type")
+            topics = message.get("topics") or []
+            if kind not in ("subscribe", "unsubscribe") or not isinstance(topics, list):
+                raise ValueError("Expected {\"type\": \"subscribe\" | \"unsubscribe\", \"topics\": [...]}")
+            handler = self.subscribe if kind == "subscribe" else self.unsubscribe
+            reply = {"type": "subscriptions", "topics": handler(websocket, topics)}
+        except (ValueError, AttributeError) as exc:
+            reply = {"type": "error", "message": str(exc)}
+        self._enqueue(connection, json.dumps(reply))
+
+    async def broadcast(self, message: dict) -> None:
+        started = time.perf_counter()
+        recipients = set(self._unfiltered)
+        for key in event_topics(message):
+            recipients.update(self._index.get(key, ()))
+        if recipients:
+            payload = json.dumps(message, default=str)
+            for connection in recipients:
+                self._enqueue(connection, payload)
+        elapsed = time.perf_counter() - started
+        WS_BROADCAST_FANOUT_SECONDS.observe(elapsed)
+        self.broadcasts_total += 1
+        self.last_fanout_recipients = len(recipients)
+        self.last_fanout_ms = round(elapsed * 1000, 3)
+
+    def _unindex(self, key: str, connection: ClientConnection) -> None:
+        subscribers = self._index.get(key)
+        if subscribers is not None:
+            subscribers.discard(connection)
+            if not subscribers:
+                del self._index[key]
+
+    def _enqueue(self, connection: ClientConnection, payload: str) -> None:
+        if connection.resync_pending:
+            connection.dropped_messages += 1
+            WS_DROPPED_MESSAGES.inc()
+            return
+        try:
+            connection.queue.put_nowait(payload)
+        except asyncio.QueueFull:
+            self._overflow(connection)
+            return
+        connection.max_queue_depth = max(connection.max_queue_depth, connection.queue.qsize())
+
+    def _overflow(self, connection: ClientConnection) -> None:
+        connection.overflows += 1
+        connection.dropped_messages += connection.queue.qsize() + 1
+        WS_DROPPED_MESSAGES.inc(amount=connection.queue.qsize() + 1)
+        while not connection.queue.empty():
+            connection.queue.get_nowait()
+        if self.slow_consumer_policy == WS_POLICY_DROP:
+            logger.warning("Disconnecting slow WebSocket client %s", connection.client)
+            self.disconnected_slow_total += 1
+            self.disconnect(connection.websocket)
+            asyncio.ensure_future(self._close(connection.websocket, WS_CLOSE_SLOW_CONSUMER))
+            return
+        # Everything queued is stale anyway; the client refetches once it reads the notice
+        self.resyncs_total += 1
+        connection.resync_pending = True
+        connection.queue.put_nowait(WS_RESYNC_MESSAGE)
+
+    async def _write(self, connection: ClientConnection) -> None:
+        websocket = connection.websocket
+        try:
+            while True:
+                payload = await connection.queue.get()
+                if payload is WS_RESYNC_MESSAGE:
+                    connection.resync_pending = False
+                started = time.perf_counter()
+                await asyncio.wait_for(websocket.send_text(payload), WS_SEND_TIMEOUT_SECONDS)
+                elapsed_ms = (time.perf_counter() - started) * 1000
+                connection.last_send_ms = round(elapsed_ms, 3)
+                connection.max_send_ms = max(connection.max_send_ms, elapsed_ms)
+                connection.sent_messages += 1
+                connection.sent_bytes += len(payload)
+        except asyncio.CancelledError:
+            raise
+        except asyncio.TimeoutError:
+            logger.warning("WebSocket client %s stopped reading; disconnecting", connection.client)
+            self.disconnected_slow_total += 1
+            self.disconnect(websocket)
+            await self._close(websocket, WS_CLOSE_SLOW_CONSUMER)
+        except Exception as exc:
+            # The socket is gone (closed, reset); the endpoint's receive loop ends as well
+            logger.debug("WebSocket send to %s failed: %s", connection.client, exc)
+            self.disconnect(websocket)
+
+    @staticmethod
+    async def _close(websocket: WebSocket, code: int) -> None:
+        try:
+            await asyncio.wait_for(websocket.close(code=code), WS_SEND_TIMEOUT_SECONDS)
+        except Exception as exc:
+            # Already closed by the client, or the close frame could not be sent either
+            logger.debug("Closing WebSocket failed: %s", exc)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "connections": len(self.connections),
+            "queue_size": self.queue_size,
+            "slow_consumer_policy": self.slow_consumer_policy,
+            "broadcasts_total": self.broadcasts_total,
+            "last_fanout_ms": self.last_fanout_ms,
+            "last_fanout_recipients": self.last_fanout_recipients,
+            "unfiltered_clients": len(self._unfiltered),
+            "indexed_topics": len(self._index),
+            "resyncs_total": self.resyncs_total,
+            "disconnected_slow_total": self.disconnected_slow_total,
+            "clients": [connection.stats() for connection in self.connections.values()],
+        }
@@ -88,6 +88,7 @@ export const authAPI = {
 export const deviceAPI = {
   getDevices: (params = {}) => api.get('/devices', { params }),
   getStats: () => api.get('/devices/stats'),
+  getConnectionInfo: (deviceId) => api.get(`/devices/${deviceId}/connection-info`),
   occupyDevice: (deviceId, notes) => api.post(`/devices/${deviceId}/occupy`, { notes }),
   releaseDevice: (deviceId) => api.post(`/devices/${deviceId}/release`),
   updateDevice: (deviceId, data) => api.put(`/devices/${deviceId}`, data),
@@ -104,10 +105,10 @@ export const deviceAPI = {
   getWifiApInfo: (deviceId) => api.get(`/devices/${deviceId}/wifi/ap/info`),
 
   // Filesystem operations
-  getFilesystemMounts: (deviceId) => api.get(`/devices/${deviceId}/filesystem/mounts`),
+  getFilesystemMounts: (deviceId, params = {}) => api.get(`/devices/${deviceId}/filesystem/mounts`, { params }),
 
   // Version information
-  getVersions: (deviceId) => api.get(`/devices/${deviceId}/versions`),
+  getVersions: (deviceId, params = {}) => api.get(`/devices/${deviceId}/versions`, { params }),
 
   // Log operations
   downloadFastApiLog: (deviceId) => api.get(`/devices/${deviceId}/logs/fastapi`, { responseType: 'blob' }),
@@ -4,7 +4,11 @@ const DEV_MODE = import.meta.env.DEV
 const DEFAULT_ORIGIN = typeof window !== 'undefined' ? window.location.origin : 'http://localhost:8001'
 const API_BASE_URL = import.meta.env.VITE_API_BASE_URL || (DEV_MODE ? 'http://localhost:8001' : DEFAULT_ORIGIN)
 const WS_BASE_URL = import.meta.env.VITE_WS_BASE_URL || API_BASE_URL
-const deviceUpdateListeners = new Set()
+// listener -> topics it needs (null: every device)
+const deviceUpdateListeners = new Map()
+// Topics that together cover every event; the server sends everything until a client subscribes
+const ALL_EVENT_TOPICS = ['device_update', 'occupancy', 'scan']
+let subscribedTopics = new Set()
 
 const buildWebSocketUrl = () => {
   const base = WS_BASE_URL || DEFAULT_ORIGIN
@@ -17,8 +21,16 @@ const buildWebSocketUrl = () => {
   return url.toString()
 }
 
+const matchesTopics = (payload, topics) => {
+  if (!topics || payload.type === 'resync') return true
+  const deviceIds = payload.device_ids || (payload.device_id ? [payload.device_id] : [])
+  return deviceIds.some(id => topics.includes(`device:${id}`)) ||
+    (payload.groups || []).some(group => topics.includes(`group:${group}`))
+}
+
 const notifyDeviceUpdate = (payload) => {
-  deviceUpdateListeners.forEach((listener) => {
+  deviceUpdateListeners.forEach((topics, listener) => {
+    if (!matchesTopics(payload, topics)) return
     try {
       listener(payload)
     } catch (error) {
@@ -110,12 +122,15 @@ export const store = reactive({
 
     this.ws.onopen = () => {
       console.log('WebSocket connected:', wsUrl)
+      subscribedTopics = new Set()
+      this.syncSubscriptions()
     }
 
     this.ws.onmessage = (event) => {
       try {
         const data = JSON.parse(event.data)
-        if (data.type === 'device_update') {
+        // 'resync': the server dropped events this client was too slow to read; refetch everything
+        if (data.type === 'device_update' || data.type === 'resync') {
           notifyDeviceUpdate(data)
         }
       } catch (e) {
@@ -146,12 +161,38 @@ export const store = reactive({
     }
   },
 
-  onDeviceUpdate(callback) {
+  // Narrow the server-side subscription to what the mounted views listen for
+  syncSubscriptions() {
+    if (!this.ws || this.ws.readyState !== WebSocket.OPEN) return
+    const wanted = new Set()
+    deviceUpdateListeners.forEach((topics) => {
+      (topics || ALL_EVENT_TOPICS).forEach(topic => wanted.add(topic))
+    })
+    if (wanted.size === 0) {
+      ALL_EVENT_TOPICS.forEach(topic => wanted.add(topic))
+    }
+    const added = [...wanted].filter(topic => !subscribedTopics.has(topic))
+    const removed = [...subscribedTopics].filter(topic => !wanted.has(topic))
+    if (added.length) {
+      this.ws.send(JSON.stringify({ type: 'subscribe', topics: added }))
+    }
+    if (removed.length) {
+      this.ws.send(JSON.stringify({ type: 'unsubscribe', topics: removed }))
+    }
+    subscribedTopics = wanted
+  },
+
+  // topics: e.g. ['device:SERIAL'] to only hear about one device; omit for every device
+  onDeviceUpdate(callback, topics = null) {
     if (typeof callback !== 'function') {
       return () => {}
     }
-    deviceUpdateListeners.add(callback)
-    return () => deviceUpdateListeners.delete(callback)
+    deviceUpdateListeners.set(callback, topics)
+    this.syncSubscriptions()
+    return () => {
+      deviceUpdateListeners.delete(callback)
+      this.syncSubscriptions()
+    }
   }
 })
 